@@ -10,22 +10,37 @@ AI PC Autopilot - Модульная система управления ПК ч
 import json
 import os
 import re
+import socket
 import subprocess
 import sys
 import time
 import argparse
+import copy
 import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from enum import Enum
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 try:
-    from llama_cpp import Llama
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from llama_cpp import Llama, StoppingCriteriaList
     LLAMA_AVAILABLE = True
 except ImportError:
     LLAMA_AVAILABLE = False
     print("⚠ llama-cpp-python не установлен. Установите: pip install llama-cpp-python")
 
+# Общие с TaskPlannerPlugin черновик спекулятивного декодирования и граф зависимостей плана
+from core.dependency_graph import run_graph
+from core.speculative import PlanDraftModel, SPECULATIVE_AVAILABLE
+
 
 # ===========================================================================
 # ГЛОБАЛЬНАЯ КОНФИГУРАЦИЯ
@@ -54,6 +69,7 @@ class AppConfig:
         
         # Дополнительные параметры
         self.n_batch = self.config_data.get('n_batch', 512)
+        self.n_threads = self.config_data.get('n_threads', 0)  # 0 - половина ядер (как в llama.cpp)
         self.seed = self.config_data.get('seed', -1)
         self.top_k = self.config_data.get('top_k', 40)
         self.top_p = self.config_data.get('top_p', 0.95)
@@ -71,6 +87,29 @@ class AppConfig:
         # Новые параметры для исправления проблем
         self.generation_timeout = self.config_data.get('generation_timeout', 300)  # 5 минут
         self.max_retries = self.config_data.get('max_retries', 3)
+        self.max_parallel_actions = self.config_data.get('max_parallel_actions', 4)
+        
+        # Общий сервер моделей (ModelServerPlugin), "host:port"; пусто - локальная загрузка.
+        # Отдельный ключ: "model_server" в config.json - настройки самого плагина
+        address = self.config_data.get('model_server_address', '')
+        self.model_server_address = address if isinstance(address, str) else ''
+        
+        # Спекулятивное декодирование: n-граммы промпта и примеров, опционально малая модель
+        self.speculative = self.config_data.get('speculative', False)
+        self.draft_model_path = self.config_data.get('draft_model_path', '')
+        self.draft_tokens = self.config_data.get('draft_tokens', 8)
+        
+        # Шаблоны планов, скомпилированные из успешных планов
+        self.use_plan_templates = self.config_data.get('use_plan_templates', True)
+        
+        # Похожие прошлые планы как few-shot примеры (0 - отключено)
+        self.plan_examples = self.config_data.get('plan_examples', 3)
+        
+        # Пул резидентных моделей: бюджет RAM (0 - 80% доступной памяти),
+        # выгрузка простаивающих моделей и предзагрузка при старте
+        self.model_pool_ram_mb = self.config_data.get('model_pool_ram_mb', 0)
+        self.model_idle_timeout = self.config_data.get('model_idle_timeout', 900)
+        self.preload_models = self.config_data.get('preload_models', False)
         
     def _load_config(self, config_path: str) -> Dict:
         """Загрузка конфигурации из JSON файла"""
@@ -96,6 +135,7 @@ class AppConfig:
             'enable_self_read': self.enable_self_read,
             'command_timeout': self.command_timeout,
             'n_batch': self.n_batch,
+            'n_threads': self.n_threads,
             'seed': self.seed,
             'top_k': self.top_k,
             'top_p': self.top_p,
@@ -106,7 +146,17 @@ class AppConfig:
             'enable_web_search': self.enable_web_search,
             'data_dir': self.data_dir,
             'generation_timeout': self.generation_timeout,
-            'max_retries': self.max_retries
+            'max_retries': self.max_retries,
+            'max_parallel_actions': self.max_parallel_actions,
+            'model_server_address': self.model_server_address,
+            'speculative': self.speculative,
+            'draft_model_path': self.draft_model_path,
+            'draft_tokens': self.draft_tokens,
+            'use_plan_templates': self.use_plan_templates,
+            'plan_examples': self.plan_examples,
+            'model_pool_ram_mb': self.model_pool_ram_mb,
+            'model_idle_timeout': self.model_idle_timeout,
+            'preload_models': self.preload_models
         }
         with open(path, 'w', encoding='utf-8') as f:
             json.dump(config_dict, f, indent=2, ensure_ascii=False)
@@ -147,7 +197,7 @@ class PlanLogger:
         
         self._save_log_entry(log_entry, "prompt")
     
-    def log_successful_plan(self, prompt: str, plan: List[Dict]):
+    def log_successful_plan(self, prompt: str, plan: List[Dict], model: Optional[str] = None):
         """Логирование успешно созданного плана"""
         log_entry = {
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
@@ -157,6 +207,8 @@ class PlanLogger:
             "actions_count": len(plan),
             "status": "success"
         }
+        if model:
+            log_entry["model"] = model
         
         self._save_log_entry(log_entry, "plan")
     
@@ -217,6 +269,8 @@ class PlanLogger:
                 if os.path.isfile(filepath) and filename.endswith('.json'):
                     with open(filepath, 'r', encoding='utf-8') as f:
                         log_entry = json.load(f)
+                    # Посторонние JSON-файлы в директории логов пропускаются
+                    if isinstance(log_entry, dict):
                         logs.append(log_entry)
             
             # Сортируем по времени (новые сначала)
@@ -228,6 +282,433 @@ class PlanLogger:
             return []
 
 
+# ===========================================================================
+# МОДУЛЬ: ШАБЛОНЫ ПЛАНОВ
+# ===========================================================================
+
+class PlanTemplateIndex:
+    """Индекс параметризованных шаблонов, скомпилированных из успешных планов
+    
+    Значения из data действий, дословно встречающиеся в запросе, становятся
+    типизированными слотами; запрос превращается в регулярное выражение.
+    Новый запрос, совпавший с шаблоном, заполняется извлеченными значениями
+    без генерации.
+    """
+    
+    MODULE_NAME = "Plan Templates"
+    MODULE_VERSION = "1.0.0"
+    MODULE_DESCRIPTION = "Модуль шаблонов планов с типизированными слотами"
+    
+    SLOT_PATTERNS = {
+        'int': r'-?\d+',
+        'float': r'-?\d+(?:\.\d+)?',
+        'str': r'\S+(?:\s+\S+){{0,{extra}}}'  # не больше 2x слов примера
+    }
+    
+    # Данные команд оболочки никогда не становятся слотами
+    SHELL_EVENTS = {'system_command', 'system_shell', 'open_terminal'}
+    
+    # Минимальная доля постоянных слов в запросе (и при компиляции, и при
+    # сопоставлении) и максимальная доля запроса, которую может занять слот
+    MIN_LITERAL_SHARE = 0.5
+    MAX_SLOT_SHARE = 0.5
+    
+    # Счетчики попаданий сохраняются пакетами, остаток - в flush()
+    SAVE_HITS_EVERY = 20
+    
+    def __init__(self, data_dir: str = "./data", filename: str = os.path.join("templates", "index.json")):
+        # Хранилище вне корня директории логов: get_recent_logs читает там все *.json
+        self.path = os.path.join(data_dir, filename)
+        self.templates: Dict[str, Dict] = {}  # {шаблон запроса: запись}
+        self._compiled: Dict[str, Any] = {}
+        self._buckets: Dict[str, List[str]] = {}  # {первое слово: [шаблоны]}
+        self.stats = {'hits': 0, 'misses': 0}
+        self._unsaved_hits = 0
+        self._load()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Нормализация пробелов в запросе"""
+        return ' '.join(text.split())
+    
+    @staticmethod
+    def _leaves(value: Any, path: tuple = ()):
+        """Листовые значения данных действия с путями к ним"""
+        if isinstance(value, dict):
+            for key, item in value.items():
+                yield from PlanTemplateIndex._leaves(item, path + (key,))
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                yield from PlanTemplateIndex._leaves(item, path + (index,))
+        elif isinstance(value, (int, float, str)) and not isinstance(value, bool):
+            yield path, value
+    
+    @staticmethod
+    def _slot_type(value: Any) -> str:
+        if isinstance(value, int):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        return 'str'
+    
+    @classmethod
+    def compile(cls, prompt: str, plan: List[Dict]) -> Optional[Dict]:
+        """Компиляция шаблона из запроса и успешного плана"""
+        text = cls.normalize(prompt)
+        if not text or not PlanParser.validate_plan(plan):
+            return None
+        
+        slots: Dict[str, str] = {}
+        spans = []  # (начало, конец, имя слота)
+        values: Dict[str, str] = {}  # {текст значения: имя слота}
+        template_plan = copy.deepcopy(plan)
+        
+        for index, action in enumerate(plan):
+            if action.get('event') in cls.SHELL_EVENTS:
+                continue
+            for path, value in cls._leaves(action.get('data', {})):
+                rendered = str(value)
+                if isinstance(value, str) and len(rendered.strip()) < 2:
+                    continue
+                
+                name = values.get(rendered.lower())
+                if name is None:
+                    match = re.search(r'(?<!\w)' + re.escape(rendered) + r'(?!\w)', text, re.IGNORECASE)
+                    if not match or any(match.start() < end and start < match.end() for start, end, _ in spans):
+                        continue
+                    name = f"s{len(slots)}"
+                    slots[name] = cls._slot_type(value)
+                    spans.append((match.start(), match.end(), name))
+                    values[rendered.lower()] = name
+                
+                target = template_plan[index]['data']
+                for key in path[:-1]:
+                    target = target[key]
+                target[path[-1]] = {'$slot': name}
+        
+        # Запрос, состоящий в основном из слотов, слишком общий для шаблона
+        spans.sort()
+        literal = text
+        for start, end, _ in reversed(spans):
+            literal = literal[:start] + ' ' + literal[end:]
+        if not cls._literal_share_ok(literal, text):
+            return None
+        
+        parts = []
+        position = 0
+        for start, end, name in spans:
+            parts.append(cls._literal_pattern(text[position:start]))
+            pattern = cls.SLOT_PATTERNS[slots[name]]
+            if slots[name] == 'str':
+                pattern = pattern.format(extra=2 * len(text[start:end].split()) - 1)
+            parts.append(f"(?P<{name}>{pattern})")
+            position = end
+        parts.append(cls._literal_pattern(text[position:]))
+        
+        return {
+            'pattern': ''.join(parts),
+            'slots': slots,
+            'plan': template_plan,
+            'example': text,
+            'hits': 0,
+            'created': time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    @classmethod
+    def _literal_share_ok(cls, literal: str, text: str) -> bool:
+        literal_words = re.findall(r'\w+', literal)
+        return bool(literal_words) and len(literal_words) >= cls.MIN_LITERAL_SHARE * len(re.findall(r'\w+', text))
+    
+    @staticmethod
+    def _literal_pattern(text: str) -> str:
+        return r'\s+'.join(re.escape(word) for word in text.split(' ')) if text else ''
+    
+    @staticmethod
+    def _bucket(pattern: str) -> str:
+        """Первое постоянное слово шаблона или '*' для шаблонов, начинающихся со слота"""
+        match = re.match(r'(\w+)', pattern)
+        return match.group(1).lower() if match else '*'
+    
+    def _register(self, template: Dict):
+        pattern = template['pattern']
+        if pattern not in self.templates:
+            self._buckets.setdefault(self._bucket(pattern), []).append(pattern)
+        self.templates[pattern] = template
+        self._compiled[pattern] = re.compile(pattern, re.IGNORECASE)
+    
+    def add(self, prompt: str, plan: List[Dict]) -> Optional[Dict]:
+        """Добавление шаблона из успешного плана"""
+        template = self.compile(prompt, plan)
+        if template is None:
+            return None
+        existing = self.templates.get(template['pattern'])
+        if existing:
+            template['hits'] = existing['hits']
+        self._register(template)
+        self._save()
+        return template
+    
+    def match(self, request: str) -> Optional[List[Dict]]:
+        """Заполнение плана по подходящему шаблону или None"""
+        text = self.normalize(request)
+        words = text.split(' ', 1)
+        candidates = self._buckets.get(words[0].lower(), []) + self._buckets.get('*', [])
+        
+        # Предпочтение самым конкретным шаблонам (больше постоянного текста)
+        best = None
+        for pattern in candidates:
+            match = self._compiled[pattern].fullmatch(text)
+            if not match or not self._match_is_specific(match, text):
+                continue
+            specificity = len(text) - sum(len(value) for value in match.groupdict().values())
+            if best is None or specificity > best[0]:
+                best = (specificity, pattern, match)
+        
+        if best is None:
+            self.stats['misses'] += 1
+            return None
+        
+        _, pattern, match = best
+        template = self.templates[pattern]
+        try:
+            values = {name: self._convert(match.group(name), slot_type)
+                      for name, slot_type in template['slots'].items()}
+        except ValueError:
+            self.stats['misses'] += 1
+            return None
+        
+        template['hits'] += 1
+        self.stats['hits'] += 1
+        self._unsaved_hits += 1
+        if self._unsaved_hits >= self.SAVE_HITS_EVERY:
+            self._save()
+        return self._fill(template['plan'], values)
+    
+    def _match_is_specific(self, match, text: str) -> bool:
+        """Совпадение, где слоты не поглощают запрос целиком"""
+        values = [value for value in match.groupdict().values() if value]
+        if any(len(value) > self.MAX_SLOT_SHARE * len(text) for value in values):
+            return False
+        literal = text
+        for name in sorted(match.groupdict(), key=lambda n: match.start(n), reverse=True):
+            if match.group(name):
+                literal = literal[:match.start(name)] + ' ' + literal[match.end(name):]
+        return self._literal_share_ok(literal, text)
+    
+    @staticmethod
+    def _convert(value: str, slot_type: str) -> Any:
+        if slot_type == 'int':
+            return int(value)
+        if slot_type == 'float':
+            return float(value)
+        return value
+    
+    @classmethod
+    def _fill(cls, value: Any, values: Dict[str, Any]) -> Any:
+        if isinstance(value, dict):
+            if set(value) == {'$slot'}:
+                return values[value['$slot']]
+            return {key: cls._fill(item, values) for key, item in value.items()}
+        if isinstance(value, list):
+            return [cls._fill(item, values) for item in value]
+        return value
+    
+    def bootstrap(self, logger: 'PlanLogger', limit: int = 500) -> int:
+        """Первичное наполнение индекса из логов успешных планов"""
+        added = 0
+        for entry in reversed(logger.get_recent_logs('plan', limit=limit)):
+            if entry.get('type') != 'successful_plan':
+                continue
+            template = self.compile(entry.get('prompt', ''), entry.get('plan'))
+            if template:
+                self._register(template)
+                added += 1
+        if added:
+            self._save()
+        return added
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for template in json.load(f):
+                    self._register(template)
+        except Exception as e:
+            print(f"⚠️ Ошибка загрузки шаблонов планов: {e}")
+    
+    def flush(self):
+        """Сохранение несохраненных счетчиков попаданий"""
+        if self._unsaved_hits:
+            self._save()
+    
+    def _save(self):
+        self._unsaved_hits = 0
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self.templates.values()), f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения шаблонов планов: {e}")
+
+
+class PlanVectorIndex:
+    """Векторный индекс прошлых запросов для подбора few-shot примеров
+    
+    Запрос представляется хэшированными признаками (слова и символьные
+    триграммы) фиксированной размерности; поиск - косинусная близость
+    одним матричным умножением NumPy, без NumPy - по разреженным векторам.
+    Индекс дописывается по одному плану и хранится в plan_index.jsonl;
+    строки замененных записей убираются при следующей загрузке.
+    """
+    
+    MODULE_NAME = "Plan Index"
+    MODULE_VERSION = "1.0.0"
+    MODULE_DESCRIPTION = "Модуль поиска похожих прошлых планов для few-shot примеров"
+    
+    def __init__(self, data_dir: str = "./data", dim: int = 1024, filename: str = "plan_index.jsonl"):
+        self.path = os.path.join(data_dir, filename)
+        self.dim = dim
+        self.entries: List[Dict] = []  # [{'prompt', 'plan'}]
+        self._positions: Dict[str, int] = {}  # {нормализованный запрос: строка матрицы}
+        self._matrix = None  # NumPy: матрица (емкость, dim), заполнено len(entries) строк
+        self._vectors: List[Dict[int, float]] = []  # без NumPy: разреженные векторы
+        self._load()
+    
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.lower().split())
+    
+    def features(self, text: str) -> Dict[int, float]:
+        """Хэшированные признаки текста, нормированные по L2"""
+        text = self.normalize(text)
+        features: Dict[int, float] = {}
+        for word in re.findall(r'\w+', text):
+            index = zlib.crc32(b'w:' + word.encode('utf-8')) % self.dim
+            features[index] = features.get(index, 0.0) + 1.0
+        padded = f" {text} "
+        for i in range(len(padded) - 2):
+            index = zlib.crc32(b'c:' + padded[i:i + 3].encode('utf-8')) % self.dim
+            features[index] = features.get(index, 0.0) + 0.5
+        
+        norm = sum(value * value for value in features.values()) ** 0.5
+        return {index: value / norm for index, value in features.items()} if norm else {}
+    
+    def _dense(self, features: Dict[int, float]):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for index, value in features.items():
+            vector[index] = value
+        return vector
+    
+    def add(self, prompt: str, plan: List[Dict], persist: bool = True):
+        """Инкрементальное добавление плана (повтор запроса заменяет запись)"""
+        key = self.normalize(prompt)
+        if not key or not PlanParser.validate_plan(plan):
+            return
+        features = self.features(prompt)
+        position = self._positions.get(key)
+        
+        if position is None:
+            position = len(self.entries)
+            self._positions[key] = position
+            self.entries.append({'prompt': prompt, 'plan': plan})
+            if np is not None:
+                if self._matrix is None or position == len(self._matrix):
+                    # Емкость удваивается: добавление - амортизированно O(dim)
+                    grown = np.zeros((max(64, 2 * position), self.dim), dtype=np.float32)
+                    if self._matrix is not None:
+                        grown[:position] = self._matrix[:position]
+                    self._matrix = grown
+            else:
+                self._vectors.append({})
+        else:
+            self.entries[position] = {'prompt': prompt, 'plan': plan}
+        
+        if np is not None:
+            self._matrix[position] = self._dense(features)
+        else:
+            self._vectors[position] = features
+        
+        if persist:
+            self._append(prompt, plan)
+    
+    def search(self, query: str, k: int = 3, min_score: float = 0.3) -> List[tuple]:
+        """Ближайшие прошлые планы: [(сходство, запись)]"""
+        if not self.entries or k <= 0:
+            return []
+        features = self.features(query)
+        count = len(self.entries)
+        
+        if np is not None:
+            scores = self._matrix[:count] @ self._dense(features)
+            top = np.argsort(-scores)[:k] if count <= k else np.argpartition(-scores, k)[:k]
+            ranked = sorted(((float(scores[i]), int(i)) for i in top), reverse=True)
+        else:
+            scores = [sum(value * vector.get(index, 0.0) for index, value in features.items())
+                      for vector in self._vectors]
+            ranked = sorted(((score, i) for i, score in enumerate(scores)), reverse=True)[:k]
+        
+        return [(score, self.entries[i]) for score, i in ranked if score >= min_score]
+    
+    @staticmethod
+    def format_examples(examples: List[tuple]) -> str:
+        """Блок few-shot примеров для промпта"""
+        if not examples:
+            return ""
+        lines = ["", "", "Examples of similar requests that were planned successfully:"]
+        for _, entry in examples:
+            lines.append(f"User request: {entry['prompt']}")
+            lines.append(f"Answer (JSON): {json.dumps(entry['plan'], ensure_ascii=False)}")
+        return "\n".join(lines)
+    
+    def bootstrap(self, logger: 'PlanLogger', limit: int = 1000) -> int:
+        """Первичное наполнение из логов успешных планов (число новых записей)"""
+        count = len(self.entries)
+        for entry in reversed(logger.get_recent_logs('plan', limit=limit)):
+            if entry.get('type') == 'successful_plan':
+                self.add(entry.get('prompt', ''), entry.get('plan'))
+        # Повторы запросов и невалидные планы не добавляют записей
+        return len(self.entries) - count
+    
+    def _append(self, prompt: str, plan: List[Dict]):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'prompt': prompt, 'plan': plan}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения индекса планов: {e}")
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        lines += 1
+                        entry = json.loads(line)
+                        self.add(entry['prompt'], entry['plan'], persist=False)
+        except Exception as e:
+            print(f"⚠️ Ошибка загрузки индекса планов: {e}")
+            return
+        if lines > len(self.entries):
+            self._compact()
+    
+    def _compact(self):
+        """Перезапись файла без устаревших строк повторенных запросов"""
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ Ошибка сжатия индекса планов: {e}")
+
+
 # ===========================================================================
 # МОДУЛЬ: LLM (Управление языковыми моделями)
 # ===========================================================================
@@ -273,6 +754,105 @@ class ModelScanner:
         return filtered
 
 
+class ModelServerClient:
+    """Клиент общего сервера моделей (ModelServerPlugin) с интерфейсом вызова Llama"""
+    
+    PARAMS = {'max_tokens', 'temperature', 'top_k', 'top_p', 'min_p', 'repeat_penalty',
+              'stop', 'echo', 'seed', 'presence_penalty', 'frequency_penalty', 'grammar'}
+    
+    def __init__(self, address: str, model_path: str, load_params: Dict[str, Any]):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self.model_path = os.path.abspath(model_path)
+        self.load_params = load_params
+        self.sock = socket.create_connection(self.address)
+        self.reader = self.sock.makefile('r', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.request_id = None  # id текущего запроса (для op "cancel")
+        self.interrupted = False
+    
+    def _send(self, request: Dict[str, Any]):
+        self.sock.sendall((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+    
+    def _receive(self) -> Dict[str, Any]:
+        try:
+            line = self.reader.readline()
+        except OSError:
+            line = ''
+        if not line:
+            if self.interrupted:
+                # Теперь читатель никем не занят и его можно закрыть
+                self.close()
+                raise ConnectionError("Запрос к серверу моделей прерван")
+            raise ConnectionError("Сервер моделей закрыл соединение")
+        return json.loads(line)
+    
+    def __call__(self, prompt: str, stream: bool = False, **params):
+        self.request_id = uuid.uuid4().hex
+        request = {
+            'op': 'completion',
+            'id': self.request_id,
+            'model': self.model_path,
+            'load': self.load_params,
+            'prompt': prompt,
+            'params': {k: v for k, v in params.items() if k in self.PARAMS and v is not None},
+            'stream': stream
+        }
+        if stream:
+            return self._stream(request)
+        
+        with self.lock:
+            self._send(request)
+            reply = self._receive()
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+    
+    def _stream(self, request: Dict[str, Any]):
+        with self.lock:
+            self._send(request)
+            while True:
+                reply = self._receive()
+                if 'chunk' in reply:
+                    yield reply['chunk']
+                elif 'error' in reply:
+                    raise RuntimeError(reply['error'])
+                else:
+                    return
+    
+    def cancel(self):
+        """Остановка декодирования текущего запроса на сервере (отдельным соединением)"""
+        if not self.request_id:
+            return
+        try:
+            with socket.create_connection(self.address, timeout=5) as sock:
+                sock.sendall((json.dumps({'op': 'cancel', 'id': self.request_id}) + '\n').encode('utf-8'))
+                sock.makefile('r', encoding='utf-8').readline()
+        except OSError:
+            pass
+    
+    def interrupt(self):
+        """Отмена запроса и разрыв соединения без ожидания ответа
+        
+        Поток, ждущий ответ в readline, сразу получает конец потока;
+        буферизованный читатель не трогаем - его закрытие ждало бы сервер.
+        """
+        self.cancel()
+        self.interrupted = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def close(self):
+        """Закрытие соединения (сервер освобождает ссылку на модель)"""
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
 class LLMManager:
     """Менеджер для работы с одной LLM моделью"""
     
@@ -280,15 +860,36 @@ class LLMManager:
     MODULE_VERSION = "1.1.0"
     MODULE_DESCRIPTION = "Модуль управления языковой моделью с таймаутами"
     
+    # local_fix - исправление JSON без модели, continuation - дописывание
+    # оборванного ответа, repair - запрос на исправление поверх ответа,
+    # resample - новая генерация с нуля
+    RETRY_STRATEGIES = ('local_fix', 'continuation', 'repair', 'resample')
+    
     def __init__(self, model_path: str, config: AppConfig):
         self.config = config
         self.model_path = model_path
         self.llm = None
         self.is_initialized = False
         self._generation_timeout = config.generation_timeout
+        self.drafter = None
+        self._draft_version = None  # состояние логов планов, по которому построен корпус
+        # Отмена текущей генерации: проверяется после каждого токена
+        self._cancel_event = threading.Event()
+        self._generation_lock = threading.Lock()
+        # Учет сгенерированных токенов (для оценки сэкономленного декодирования)
+        self.generation_stats = {'requests': 0, 'completion_tokens': 0, 'early_stops': 0, 'time': 0.0}
+        # Стратегии повторов: сколько раз применены, успешны и сколько времени
+        # сэкономили по сравнению с полной генерацией
+        self.retry_stats = {
+            strategy: {'used': 0, 'succeeded': 0, 'time': 0.0, 'saved': 0.0}
+            for strategy in self.RETRY_STRATEGIES
+        }
         
     def initialize_llm(self) -> bool:
         """Инициализация LLM модели"""
+        if self.config.model_server_address:
+            return self._connect_model_server()
+        
         if not LLAMA_AVAILABLE:
             print("❌ llama-cpp-python не установлен")
             return False
@@ -299,13 +900,16 @@ class LLMManager:
                 return False
                 
             print(f"⏳ Загрузка модели: {os.path.basename(self.model_path)}...")
+            self.drafter = self._create_drafter() if self.config.speculative else None
             self.llm = Llama(
                 model_path=self.model_path,
                 n_ctx=self.config.n_ctx,
                 n_gpu_layers=self.config.n_gpu_layers,
                 n_batch=self.config.n_batch,
+                n_threads=self.config.n_threads or None,
                 seed=self.config.seed,
-                verbose=self.config.verbose
+                verbose=self.config.verbose,
+                draft_model=self.drafter
             )
             self.is_initialized = True
             print(f"✓ Модель загружена: {os.path.basename(self.model_path)}")
@@ -315,78 +919,382 @@ class LLMManager:
             self.is_initialized = False
             return False
     
-    def _generate_with_timeout(self, prompt: str, max_tokens: Optional[int] = None,
-                              temperature: Optional[float] = None) -> Dict[str, Any]:
-        """Генерация ответа с таймаутом"""
-        result = {"error": "Таймаут генерации"}
+    def _create_drafter(self) -> Optional[PlanDraftModel]:
+        """Создание черновика для спекулятивного декодирования"""
+        if not SPECULATIVE_AVAILABLE:
+            print("⚠ Спекулятивное декодирование недоступно в этой версии llama-cpp-python")
+            return None
         
-        def generate():
-            nonlocal result
-            try:
-                result = self.llm(
-                    prompt,
-                    max_tokens=max_tokens or self.config.max_tokens,
-                    temperature=temperature or self.config.temperature,
-                    top_k=self.config.top_k,
-                    top_p=self.config.top_p,
-                    repeat_penalty=self.config.repeat_penalty,
-                    echo=False
+        draft_llm = None
+        if self.config.draft_model_path:
+            if os.path.exists(self.config.draft_model_path):
+                # Малая модель должна иметь тот же словарь, что и основная
+                draft_llm = Llama(
+                    model_path=self.config.draft_model_path,
+                    n_ctx=self.config.n_ctx,
+                    n_gpu_layers=self.config.n_gpu_layers,
+                    verbose=self.config.verbose
                 )
-            except Exception as e:
-                result = {"error": f"Ошибка генерации: {str(e)}"}
+                print(f"✓ Черновая модель загружена: {os.path.basename(self.config.draft_model_path)}")
+            else:
+                print(f"⚠ Черновая модель не найдена: {self.config.draft_model_path}")
+        return PlanDraftModel(num_pred_tokens=self.config.draft_tokens, draft_llm=draft_llm)
+    
+    def _update_draft_corpus(self):
+        """Корпус черновика: недавние успешные планы
         
-        thread = threading.Thread(target=generate)
-        thread.start()
-        thread.join(timeout=self._generation_timeout)
+        Системный промпт черновик и так видит во входе модели. Логи
+        перечитываются и токенизируются, только когда появился новый план.
+        """
+        if self.drafter is None:
+            return
+        self.drafter.reset()
+        try:
+            names = sorted(name for name in os.listdir(self.config.data_dir) if name.startswith('plan'))
+        except OSError:
+            names = []
+        version = (len(names), names[-1] if names else None)
+        if self._draft_version == version:
+            return
         
-        if thread.is_alive():
-            print(f"⚠️  Таймаут генерации ({self._generation_timeout} сек), прерывание...")
-            return {"error": f"Таймаут генерации ({self._generation_timeout} секунд)"}
-            
-        return result
+        texts = []
+        for entry in PlanLogger(self.config.data_dir).get_recent_logs('plan', limit=20):
+            if entry.get('type') == 'successful_plan':
+                texts.append(json.dumps(entry['plan'], ensure_ascii=False))
+        tokens = self.llm.tokenize('\n'.join(texts).encode('utf-8'), add_bos=False) if texts else []
+        self.drafter.set_corpus(plan_tokens=tokens)
+        self._draft_version = version
+    
+    def _connect_model_server(self) -> bool:
+        """Подключение к общему серверу моделей вместо локальной загрузки"""
+        try:
+            print(f"⏳ Подключение к серверу моделей {self.config.model_server_address}: {os.path.basename(self.model_path)}...")
+            self.llm = ModelServerClient(self.config.model_server_address, self.model_path, {
+                'n_ctx': self.config.n_ctx,
+                'n_gpu_layers': self.config.n_gpu_layers,
+                'n_batch': self.config.n_batch
+            })
+            self.is_initialized = True
+            print(f"✓ Модель доступна через сервер: {os.path.basename(self.model_path)}")
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка подключения к серверу моделей: {e}")
+            self.is_initialized = False
+            return False
     
-    def generate_response(self, prompt: str, max_tokens: Optional[int] = None,
+    def _sampling_params(self, max_tokens: Optional[int] = None,
                          temperature: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            'max_tokens': max_tokens or self.config.max_tokens,
+            'temperature': temperature or self.config.temperature,
+            'top_k': self.config.top_k,
+            'top_p': self.config.top_p,
+            'repeat_penalty': self.config.repeat_penalty,
+            'echo': False
+        }
+    
+    def stream_response(self, prompt: str, max_tokens: Optional[int] = None,
+                        temperature: Optional[float] = None):
+        """Потоковая генерация фрагментов текста
+        
+        Как и _generate_with_timeout: не пересекается с другими генерациями
+        этой модели, останавливается по таймауту и cancel(). Закрытие
+        итератора тоже останавливает генерацию; недочитанный поток сервера
+        моделей отменяется на сервере, а соединение заменяется новым.
+        """
+        with self._generation_lock:
+            self._cancel_event.clear()
+            deadline = time.monotonic() + self._generation_timeout
+            chunks = self.llm(prompt, stream=True, **self._sampling_params(max_tokens, temperature))
+            completed = False
+            try:
+                for chunk in chunks:
+                    if self._cancel_event.is_set():
+                        return
+                    if time.monotonic() > deadline:
+                        print(f"⚠️  Таймаут генерации ({self._generation_timeout} сек), генерация остановлена")
+                        return
+                    yield chunk['choices'][0]['text']
+                completed = True
+            finally:
+                chunks.close()
+                if not completed and isinstance(self.llm, ModelServerClient):
+                    stale = self.llm
+                    self._reconnect_model_server()
+                    stale.close()
+    
+    def cached_prefix(self, prompt: str) -> tuple:
+        """(токенов промпта в KV-кэше модели, всего токенов промпта)"""
+        input_ids = getattr(self.llm, '_input_ids', None)
+        if input_ids is None:
+            return 0, 0  # Сервер моделей: кэш на его стороне
+        tokens = self.llm.tokenize(prompt.encode('utf-8'))
+        # Последний токен llama.cpp всегда вычисляет заново
+        return Llama.longest_token_prefix(list(input_ids), tokens[:-1]), len(tokens)
+    
+    def set_threads(self, n_threads: Optional[int] = None):
+        """Число потоков CPU для генерации (None - значение по умолчанию)"""
+        ctx = getattr(self.llm, '_ctx', None)
+        if ctx is None or not hasattr(ctx, 'set_n_threads'):
+            return  # Сервер моделей или старая версия llama-cpp-python
+        if n_threads:
+            ctx.set_n_threads(n_threads, n_threads)
+        else:
+            ctx.set_n_threads(self.llm.n_threads, self.llm.n_threads_batch)
+    
+    def cancel(self):
+        """Прерывание текущей генерации на следующем токене"""
+        self._cancel_event.set()
+    
+    def _plan_end_criterion(self, tracker: 'JsonArrayTracker'):
+        """Критерий остановки: закрылся JSON-массив плана
+        
+        llama.cpp передает уже вычисленные токены (при первом вызове - только
+        промпт), поэтому на вход трекера подаются лишь новые токены.
+        """
+        seen = None
+        
+        def plan_closed(input_ids, logits) -> bool:
+            nonlocal seen
+            if seen is not None and len(input_ids) > seen:
+                piece = self.llm.detokenize(list(input_ids[seen:]))
+                tracker.feed(piece.decode('utf-8', errors='ignore'))
+            seen = len(input_ids)
+            return tracker.closed
+        
+        return plan_closed
+    
+    def _generate_with_timeout(self, prompt: str, max_tokens: Optional[int] = None,
+                              temperature: Optional[float] = None,
+                              stop_on_plan_end: bool = False,
+                              plan_prefix: str = "") -> Dict[str, Any]:
+        """Генерация ответа с таймаутом и настоящей остановкой вычислений
+        
+        Таймаут и отмена проверяются критерием остановки после каждого
+        токена, поэтому по возврату генерация гарантированно завершена
+        и следующая попытка не накладывается на предыдущую.
+        """
+        with self._generation_lock:
+            self._cancel_event.clear()
+            deadline = time.monotonic() + self._generation_timeout
+            stopped = {'reason': None}
+            
+            def should_stop(input_ids, logits) -> bool:
+                if self._cancel_event.is_set():
+                    stopped['reason'] = 'cancel'
+                elif time.monotonic() > deadline:
+                    stopped['reason'] = 'timeout'
+                return stopped['reason'] is not None
+            
+            params = self._sampling_params(max_tokens, temperature)
+            tracker = JsonArrayTracker() if stop_on_plan_end else None
+            if tracker and plan_prefix:
+                tracker.feed(plan_prefix)  # Продолжение уже начатого массива
+            llm = self.llm
+            on_server = isinstance(llm, ModelServerClient)
+            if not on_server:
+                criteria = [should_stop]
+                if tracker:
+                    criteria.append(self._plan_end_criterion(tracker))
+                params['stopping_criteria'] = StoppingCriteriaList(criteria)
+            result = {"error": "Генерация не выполнена"}
+            stream_complete = True
+            started = time.perf_counter()
+            # Event вместо join: прерванный Ctrl+C join может вернуться раньше времени
+            finished = threading.Event()
+            
+            def stream_until_plan_end():
+                """Сервер моделей: критерий остановки не передать, поэтому
+                ответ читается потоком и обрывается на закрытии массива"""
+                nonlocal stream_complete
+                text, pieces = "", 0
+                stream_complete = False
+                chunks = llm(prompt, stream=True, **params)
+                try:
+                    for chunk in chunks:
+                        piece = chunk['choices'][0]['text']
+                        text += piece
+                        pieces += 1
+                        if tracker.feed(piece) or stopped['reason']:
+                            break
+                    else:
+                        stream_complete = True
+                finally:
+                    chunks.close()
+                # Фрагмент потока - один токен
+                return {'choices': [{'text': text, 'index': 0, 'finish_reason': 'stop'}],
+                        'usage': {'completion_tokens': pieces}}
+            
+            def generate():
+                nonlocal result
+                try:
+                    result = stream_until_plan_end() if on_server and tracker else llm(prompt, **params)
+                except Exception as e:
+                    result = {"error": f"Ошибка генерации: {str(e)}"}
+                finally:
+                    finished.set()
+            
+            thread = threading.Thread(target=generate)
+            thread.start()
+            try:
+                while not finished.wait(timeout=0.5):
+                    if on_server and not stopped['reason']:
+                        should_stop(None, None)
+                        if stopped['reason']:
+                            # Генерацию на сервере не прервать - перестаем ждать ответ
+                            self._reconnect_model_server()
+            except KeyboardInterrupt:
+                stopped['reason'] = 'cancel'
+                self.cancel()
+                if on_server:
+                    self._reconnect_model_server()
+                finished.wait()
+            
+            if not stream_complete and self.llm is llm:
+                # Поток оборван раньше конца: сервер еще декодирует, соединение занято
+                self._reconnect_model_server()
+                llm.close()
+            
+            if stopped['reason'] == 'timeout':
+                print(f"⚠️  Таймаут генерации ({self._generation_timeout} сек), генерация остановлена")
+                return {"error": f"Таймаут генерации ({self._generation_timeout} секунд)", "timeout": True}
+            if stopped['reason'] == 'cancel':
+                print("⚠️  Генерация отменена")
+                return {"error": "Генерация отменена", "cancelled": True}
+            
+            usage = result.get('usage') if isinstance(result, dict) else None
+            if usage:
+                elapsed = time.perf_counter() - started
+                stats = self.generation_stats
+                stats['requests'] += 1
+                stats['completion_tokens'] += usage.get('completion_tokens', 0)
+                stats['time'] += elapsed
+                if tracker and tracker.closed:
+                    stats['early_stops'] += 1
+                if self.config.verbose or tracker:
+                    reason = " (остановка на закрытии JSON)" if tracker and tracker.closed else ""
+                    print(f"🔢 Сгенерировано токенов: {usage.get('completion_tokens', 0)} за {elapsed:.1f} сек{reason}")
+            return result
+    
+    def _reconnect_model_server(self):
+        """Отмена запроса на сервере и новое соединение вместо занятого"""
+        self.llm.interrupt()
+        try:
+            self.llm = ModelServerClient(self.config.model_server_address, self.model_path, self.llm.load_params)
+        except OSError as e:
+            print(f"❌ Ошибка подключения к серверу моделей: {e}")
+            self.is_initialized = False
+    
+    def generate_response(self, prompt: str, max_tokens: Optional[int] = None,
+                         temperature: Optional[float] = None,
+                         stop_on_plan_end: bool = False,
+                         plan_prefix: str = "") -> Dict[str, Any]:
         """Генерация ответа от модели с обработкой таймаутов"""
         if not self.is_available():
             return {"error": "Модель не инициализирована"}
             
         try:
-            return self._generate_with_timeout(prompt, max_tokens, temperature)
+            return self._generate_with_timeout(prompt, max_tokens, temperature, stop_on_plan_end, plan_prefix)
         except Exception as e:
             return {"error": f"Ошибка генерации: {str(e)}"}
     
     def generate_plan(self, system_prompt: str, user_request: str) -> Optional[Dict]:
-        """Генерация плана выполнения задачи с повторными попытками"""
+        """Генерация плана выполнения задачи с адаптивными повторами
+        
+        Неудачный ответ сначала исправляется локально (PlanParser.try_fix_json),
+        затем оборванный массив дописывается, а испорченный - исправляется
+        коротким запросом поверх ответа; общий префикс при этом берется из
+        KV-кэша модели. Генерация с нуля - последний вариант, без пауз.
+        """
         full_prompt = f"{system_prompt}\n\nUser request: {user_request}\n\nAnswer (JSON):"
+        self._update_draft_corpus()
+        
+        text = None  # Последний ответ модели
+        strategy = None  # Стратегия текущей попытки (None - первая генерация)
+        fresh_time = None  # Время полной генерации - база для оценки экономии
         
         for attempt in range(self.config.max_retries):
-            print(f"⏳ Попытка генерации плана {attempt + 1}/{self.config.max_retries}...")
-            
-            response = self.generate_response(full_prompt)
+            if self.drafter is not None:
+                # Черновик прошлой попытки не относится к новой генерации
+                self.drafter.reset()
+            prompt, prefix = full_prompt, ""
+            temperature = None
+            if strategy == 'continuation':
+                prompt, prefix = full_prompt + text, text
+            elif strategy == 'repair':
+                prompt = (f"{full_prompt}{text}\n\nThe answer above is not a valid plan: "
+                          f"{PlanParser.describe_error(text)}.\nWrite the corrected JSON array only.\n\nAnswer (JSON):")
+            elif strategy == 'resample':
+                # Тот же промпт дал негодный ответ - немного больше разнообразия
+                temperature = min(1.0, self.config.temperature + 0.2)
+            
+            label = f" ({strategy})" if strategy else ""
+            print(f"⏳ Попытка генерации плана {attempt + 1}/{self.config.max_retries}{label}...")
+            started = time.perf_counter()
+            response = self.generate_response(prompt, temperature=temperature,
+                                              stop_on_plan_end=True, plan_prefix=prefix)
+            elapsed = time.perf_counter() - started
+            if strategy:
+                self.retry_stats[strategy]['used'] += 1
+                self.retry_stats[strategy]['time'] += elapsed
+            if self.drafter is not None:
+                stats = self.drafter.stats
+                print(f"🎯 Спекулятивное декодирование: принято {self.drafter.acceptance_rate():.0%} "
+                      f"черновых токенов ({stats['accepted']}/{stats['drafted']})")
             
             if "error" in response:
                 print(f"❌ Ошибка генерации плана: {response['error']}")
-                if attempt < self.config.max_retries - 1:
-                    time.sleep(2)
+                if response.get('cancelled'):
+                    return None
+                text, strategy = None, 'resample'
                 continue
-                
-            try:
-                response_text = response['choices'][0]['text']
-                plan = PlanParser.parse_plan(response_text)
-                if plan:
-                    return plan
-                else:
-                    print(f"⚠️  Попытка {attempt + 1}: не удалось распарсить план")
-            except Exception as e:
-                print(f"❌ Ошибка парсинга плана: {e}")
             
-            if attempt < self.config.max_retries - 1:
-                time.sleep(2)
+            response_text = response['choices'][0]['text']
+            text = text + response_text if strategy == 'continuation' else response_text
+            if strategy in (None, 'resample'):
+                fresh_time = elapsed if fresh_time is None else fresh_time
+            
+            plan = PlanParser.check_plan(text)
+            if plan:
+                self._record_retry_success(strategy, elapsed, fresh_time)
+                return plan
+            
+            # Дешевое локальное исправление до обращения к модели
+            self.retry_stats['local_fix']['used'] += 1
+            plan = PlanParser.repair_plan(text)
+            if plan:
+                print("✓ JSON исправлен автоматически")
+                self._record_retry_success('local_fix', 0.0, fresh_time)
+                return plan
+            
+            print(f"⚠️  Попытка {attempt + 1}: не удалось распарсить план ({PlanParser.describe_error(text)})")
+            strategy = self._next_retry_strategy(text, strategy)
         
         print("❌ Все попытки генерации плана завершились неудачно")
         return None
     
+    @staticmethod
+    def _next_retry_strategy(text: str, previous: Optional[str]) -> str:
+        """Выбор стратегии повтора по виду неудачного ответа"""
+        tracker = JsonArrayTracker()
+        tracker.feed(text)
+        if tracker.depth and not tracker.closed:
+            return 'continuation'  # Массив начат, но оборван
+        if previous != 'repair':
+            return 'repair'
+        return 'resample'  # Исправление поверх ответа уже не помогло
+    
+    def _record_retry_success(self, strategy: Optional[str], elapsed: float, fresh_time: Optional[float]):
+        if not strategy:
+            return
+        stats = self.retry_stats[strategy]
+        stats['succeeded'] += 1
+        if strategy != 'resample' and fresh_time is not None:
+            saved = max(fresh_time - elapsed, 0.0)
+            stats['saved'] += saved
+            print(f"🔧 План восстановлен ({strategy}) за {elapsed:.1f} сек, "
+                  f"сэкономлено ≈{saved:.1f} сек по сравнению с повторной генерацией")
+    
     def self_reflect(self, initial_prompt: str, initial_response: str) -> str:
         """Самоанализ: модель читает свой ответ и улучшает его"""
         reflection_prompt = f"""Original request: {initial_prompt}
@@ -402,6 +1310,12 @@ Review this response and provide an improved version, correcting errors and addi
     
     def unload_llm(self):
         """Выгрузка модели из памяти"""
+        if isinstance(self.llm, ModelServerClient):
+            self.llm.close()
+            self.llm = None
+            self.is_initialized = False
+            print(f"✓ Отключено от сервера моделей: {os.path.basename(self.model_path)}")
+            return
         if self.llm:
             del self.llm
             self.llm = None
@@ -415,13 +1329,201 @@ Review this response and provide an improved version, correcting errors and addi
         return self.is_initialized and self.llm is not None
 
 
+class ModelPool:
+    """Пул загруженных моделей, переживающих отдельные запросы
+    
+    Модели держатся в памяти в пределах бюджета RAM (оценка - размер GGUF);
+    при нехватке выгружаются давно не использованные модели без активных
+    пользователей (LRU), простаивающие дольше idle_timeout выгружаются фоном.
+    """
+    
+    MODULE_NAME = "Model Pool"
+    MODULE_VERSION = "1.0.0"
+    MODULE_DESCRIPTION = "Модуль резидентных моделей с бюджетом памяти и LRU-вытеснением"
+    
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.budget = config.model_pool_ram_mb * 1024 * 1024 or self._default_budget()
+        self.idle_timeout = config.model_idle_timeout
+        self.models: 'OrderedDict[str, Dict]' = OrderedDict()  # от давно использованных к недавним
+        self.lock = threading.RLock()
+        self._loading: Dict[str, threading.Lock] = {}  # {путь: блокировка загрузки}
+        self._reserved: Dict[str, int] = {}  # {путь: размер загружаемой модели}
+        self.stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'load_time': 0.0}
+        
+        self._stop = threading.Event()
+        self._reaper = None
+        if self.idle_timeout and self.idle_timeout > 0:
+            self._reaper = threading.Thread(target=self._reaper_loop, daemon=True)
+            self._reaper.start()
+    
+    @staticmethod
+    def _default_budget() -> int:
+        """80% доступной памяти (без /proc/meminfo - без ограничения)"""
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(int(line.split()[1]) * 1024 * 0.8)
+        except (OSError, ValueError):
+            pass
+        return 0
+    
+    def _model_size(self, model_path: str) -> int:
+        if self.config.model_server_address:
+            return 0  # Модель держит сервер
+        try:
+            return os.path.getsize(model_path)
+        except OSError:
+            return 0
+    
+    def used_memory(self) -> int:
+        return sum(entry['size'] for entry in self.models.values()) + sum(self._reserved.values())
+    
+    def acquire(self, model_path: str) -> Optional[LLMManager]:
+        """Получение загруженной модели (загрузка и вытеснение при необходимости)
+        
+        Место в бюджете резервируется под блокировкой, а сама загрузка идет
+        вне ее, чтобы /pool и другие модели не ждали чтения GGUF; одинаковые
+        загрузки ждут друг друга.
+        """
+        path = os.path.abspath(model_path)
+        with self.lock:
+            manager = self._take(path)
+            if manager is not None:
+                return manager
+            loading = self._loading.setdefault(path, threading.Lock())
+        
+        with loading:
+            with self.lock:
+                manager = self._take(path)
+                if manager is not None:
+                    return manager
+                size = self._model_size(path)
+                self._make_room(size)
+                self._reserved[path] = size
+            try:
+                manager = LLMManager(model_path, self.config)
+                started = time.perf_counter()
+                if not manager.initialize_llm():
+                    return None
+                load_time = time.perf_counter() - started
+                with self.lock:
+                    self.stats['loads'] += 1
+                    self.stats['load_time'] += load_time
+                    self.models[path] = {
+                        'manager': manager,
+                        'size': size,
+                        'refs': 1,
+                        'last_used': time.time(),
+                        'load_time': load_time
+                    }
+                    return manager
+            finally:
+                with self.lock:
+                    self._reserved.pop(path, None)
+                    self._loading.pop(path, None)
+    
+    def _take(self, path: str) -> Optional[LLMManager]:
+        """Увеличение счетчика ссылок загруженной модели (под self.lock)"""
+        entry = self.models.get(path)
+        if entry is None:
+            return None
+        self.models.move_to_end(path)
+        entry['refs'] += 1
+        entry['last_used'] = time.time()
+        self.stats['hits'] += 1
+        return entry['manager']
+    
+    def release(self, manager: LLMManager):
+        """Возврат модели в пул (модель остается загруженной)"""
+        with self.lock:
+            entry = self.models.get(os.path.abspath(manager.model_path))
+            if entry and entry['manager'] is manager and entry['refs'] > 0:
+                entry['refs'] -= 1
+                entry['last_used'] = time.time()
+    
+    def _make_room(self, size: int):
+        """LRU-вытеснение свободных моделей, пока новая не помещается в бюджет"""
+        if not self.budget:
+            return
+        for path in list(self.models.keys()):
+            if self.used_memory() + size <= self.budget:
+                return
+            if self.models[path]['refs'] == 0:
+                self._unload(path)
+                self.stats['evictions'] += 1
+        if self.used_memory() + size > self.budget:
+            print(f"⚠️  Бюджет памяти пула превышен: {(self.used_memory() + size) / 2**30:.1f} "
+                  f"из {self.budget / 2**30:.1f} ГБ (все модели заняты)")
+    
+    def _unload(self, path: str):
+        entry = self.models.pop(path)
+        entry['manager'].unload_llm()
+    
+    def preload(self, model_paths: List[str]):
+        """Предзагрузка моделей, помещающихся в бюджет"""
+        for model_path in model_paths:
+            if self.budget and self.used_memory() + self._model_size(model_path) > self.budget:
+                print(f"⚠️  Предзагрузка пропущена (бюджет памяти): {os.path.basename(model_path)}")
+                continue
+            manager = self.acquire(model_path)
+            if manager:
+                self.release(manager)
+    
+    def unload_idle(self) -> List[str]:
+        """Выгрузка свободных моделей, простаивающих дольше idle_timeout"""
+        unloaded = []
+        with self.lock:
+            for path, entry in list(self.models.items()):
+                if entry['refs'] == 0 and time.time() - entry['last_used'] > self.idle_timeout:
+                    self._unload(path)
+                    unloaded.append(path)
+        return unloaded
+    
+    def _reaper_loop(self):
+        interval = max(1, min(60, self.idle_timeout // 4))
+        while not self._stop.wait(interval):
+            self.unload_idle()
+    
+    def unload_all(self):
+        self._stop.set()
+        with self.lock:
+            for path in list(self.models.keys()):
+                self._unload(path)
+    
+    def show_status(self):
+        """Вывод состояния пула"""
+        budget = f"{self.budget / 2**30:.1f} ГБ" if self.budget else "без ограничения"
+        print(f"\n🗄 Пул моделей: {len(self.models)} загружено, "
+              f"{self.used_memory() / 2**30:.1f} ГБ из {budget}")
+        print(f"   Загрузок: {self.stats['loads']} ({self.stats['load_time']:.1f} сек), "
+              f"повторных использований: {self.stats['hits']}, вытеснений: {self.stats['evictions']}")
+        for path, entry in reversed(self.models.items()):
+            idle = time.time() - entry['last_used']
+            print(f"  {os.path.basename(path)}: {entry['size'] / 2**30:.1f} ГБ, "
+                  f"загрузка {entry['load_time']:.1f} сек, занята: {entry['refs']}, простой {idle:.0f} сек")
+            stats = entry['manager'].generation_stats
+            if stats['requests']:
+                print(f"    генераций: {stats['requests']}, токенов: {stats['completion_tokens']} "
+                      f"({stats['completion_tokens'] / max(stats['time'], 1e-9):.1f} ток/сек), "
+                      f"остановлено на закрытии JSON: {stats['early_stops']}")
+            retries = {name: r for name, r in entry['manager'].retry_stats.items() if r['used']}
+            if retries:
+                print("    повторы: " + ", ".join(
+                    f"{name} {r['succeeded']}/{r['used']} (сэкономлено {r['saved']:.1f} сек)"
+                    for name, r in retries.items()))
+
+
 class MultiModelManager:
     """Менеджер для работы с несколькими моделями одновременно"""
     
-    def __init__(self, paths_to_models: List[str], config: AppConfig):
+    def __init__(self, paths_to_models: List[str], config: AppConfig, pool: Optional[ModelPool] = None):
         self.config = config
         self.paths_to_models = paths_to_models
+        self.pool = pool
         self.llms_for_use: List[LLMManager] = []
+        self.latencies: Dict[str, float] = {}
         
     def initialize_multiple_llms(self) -> bool:
         """Инициализация нескольких моделей"""
@@ -431,6 +1533,13 @@ class MultiModelManager:
             
         success = True
         for model_path in self.paths_to_models:
+            if self.pool:
+                llm = self.pool.acquire(model_path)
+                if llm:
+                    self.llms_for_use.append(llm)
+                else:
+                    success = False
+                continue
             llm = LLMManager(model_path, self.config)
             if llm.initialize_llm():
                 self.llms_for_use.append(llm)
@@ -444,18 +1553,140 @@ class MultiModelManager:
         return success
     
     def generate_multiple_responses(self, prompt: str) -> Dict[str, Any]:
-        """Генерация ответов от всех загруженных моделей"""
+        """Параллельная генерация ответов от всех загруженных моделей
+        
+        Каждая модель генерирует в своем потоке (llama.cpp отпускает GIL),
+        ядра CPU делятся между моделями поровну, чтобы потоки не вытесняли
+        друг друга. Время ответа каждой модели - в self.latencies.
+        """
         responses = {}
+        self.latencies = {}
+        if not self.llms_for_use:
+            return responses
+        
+        threads_per_model = self._split_threads()
+        
+        def timed(llm: LLMManager):
+            started = time.perf_counter()
+            response = llm.generate_response(prompt, stop_on_plan_end=True)
+            return response, time.perf_counter() - started
+        
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.llms_for_use)) as pool:
+                futures = {pool.submit(timed, llm): llm for llm in self.llms_for_use}
+                for future in as_completed(futures):
+                    model_name = os.path.basename(futures[future].model_path)
+                    response, latency = future.result()
+                    responses[model_name] = response
+                    self.latencies[model_name] = latency
+                    status = "ошибка" if "error" in response else "готово"
+                    print(f"  ⏱ {model_name}: {latency:.1f} сек ({status})")
+        finally:
+            for llm in self.llms_for_use:
+                llm.set_threads()
+        
+        wall = time.perf_counter() - started
+        print(f"⏱ Multi-режим: {wall:.1f} сек на {len(self.llms_for_use)} моделей "
+              f"(сумма последовательно: {sum(self.latencies.values()):.1f} сек, потоков на модель: {threads_per_model})")
+        return responses
+    
+    def _split_threads(self) -> int:
+        """Поровну делит ядра CPU между моделями"""
+        threads_per_model = max(1, (os.cpu_count() or 1) // len(self.llms_for_use))
         for llm in self.llms_for_use:
+            llm.set_threads(threads_per_model)
+        return threads_per_model
+    
+    def race_for_plan(self, prompt: str) -> Optional[Dict[str, Any]]:
+        """Гонка моделей: побеждает первый корректный план
+        
+        Потоки ответов проверяются по мере генерации; как только один из
+        них содержит валидный план, остальные генерации прерываются на
+        следующем токене. Возвращает {'model', 'plan', 'latency'} или None.
+        """
+        if not self.llms_for_use:
+            return None
+        
+        cancel = threading.Event()
+        winner: Dict[str, Any] = {}
+        winner_lock = threading.Lock()
+        texts: Dict[str, str] = {}
+        
+        def run(llm: LLMManager):
             model_name = os.path.basename(llm.model_path)
-            response = llm.generate_response(prompt)
-            responses[model_name] = response
-        return responses
+            started = time.perf_counter()
+            text = ""
+            tracker = JsonArrayTracker()
+            stream = llm.stream_response(prompt)
+            try:
+                for piece in stream:
+                    if cancel.is_set():
+                        return
+                    text += piece
+                    # Проверяем, когда закрылся массив; дальше генерировать незачем
+                    if tracker.feed(piece):
+                        plan = PlanParser.check_plan(text)
+                        if plan:
+                            with winner_lock:
+                                if not winner:
+                                    winner.update(model=model_name, plan=plan,
+                                                  latency=time.perf_counter() - started)
+                                    cancel.set()
+                        return
+            except Exception as e:
+                print(f"  ❌ {model_name}: {e}")
+            finally:
+                stream.close()
+                texts[model_name] = text
+        
+        self._split_threads()
+        started = time.perf_counter()
+        interrupted = False
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.llms_for_use)) as pool:
+                futures = [pool.submit(run, llm) for llm in self.llms_for_use]
+                try:
+                    while wait(futures, timeout=0.5)[1]:
+                        pass
+                except KeyboardInterrupt:
+                    interrupted = True
+                finally:
+                    # Победитель, Ctrl+C или ошибка - остальные генерации больше не нужны
+                    cancel.set()
+                    for llm in self.llms_for_use:
+                        llm.cancel()
+                    wait(futures)
+        finally:
+            for llm in self.llms_for_use:
+                llm.set_threads()
+        
+        if interrupted and not winner:
+            print("⚠️  Гонка отменена")
+            return None
+        
+        if winner:
+            cancelled = len(self.llms_for_use) - 1
+            print(f"🏁 Победила модель {winner['model']}: {winner['latency']:.1f} сек "
+                  f"(прервано генераций: {cancelled})")
+            return winner
+        
+        # Ни один поток не дал чистого плана - пробуем исправить готовые ответы
+        for model_name, text in texts.items():
+            plan = PlanParser.parse_plan(text)
+            if plan:
+                print(f"🏁 План получен из ответа {model_name} после исправления "
+                      f"({time.perf_counter() - started:.1f} сек)")
+                return {'model': model_name, 'plan': plan, 'latency': time.perf_counter() - started}
+        return None
     
     def unload_multiple_llms(self):
-        """Выгрузка всех моделей"""
+        """Выгрузка всех моделей (модели из пула возвращаются в пул)"""
         for llm in self.llms_for_use:
-            llm.unload_llm()
+            if self.pool:
+                self.pool.release(llm)
+            else:
+                llm.unload_llm()
         self.llms_for_use.clear()
     
     def is_available(self) -> bool:
@@ -475,9 +1706,10 @@ class ModelRole(Enum):
 class ModelOrchestrator:
     """Оркестратор для координации работы нескольких моделей"""
     
-    def __init__(self, paths_to_models: List[str], config: AppConfig):
+    def __init__(self, paths_to_models: List[str], config: AppConfig, pool: Optional[ModelPool] = None):
         self.config = config
         self.paths_to_models = paths_to_models
+        self.pool = pool
         self.model_roles: Dict[str, ModelRole] = {}
         
     def assign_role(self, model_path: str, role: ModelRole):
@@ -489,30 +1721,52 @@ class ModelOrchestrator:
         accumulated_responses = []
         current_prompt = prompt
         
-        for i in range(iterations):
-            print(f"\n⏳ Итерация {i+1}/{iterations}...")
-            
-            # Используем одиночные ответы для экономии памяти
-            responses = {}
-            for model_path in self.paths_to_models:
-                llm = LLMManager(model_path, self.config)
-                if llm.initialize_llm():
-                    response = llm.generate_response(current_prompt)
+        # Модели остаются в пуле между итерациями (в пределах бюджета памяти),
+        # поэтому общий префикс промпта берется из их KV-кэша
+        pool = self.pool or ModelPool(self.config)
+        timing = {'load': 0.0, 'generate': 0.0, 'prompt_tokens': 0, 'cached_tokens': 0}
+        
+        try:
+            for i in range(iterations):
+                print(f"\n⏳ Итерация {i+1}/{iterations}...")
+                
+                responses = {}
+                for model_path in self.paths_to_models:
+                    started = time.perf_counter()
+                    llm = pool.acquire(model_path)
+                    timing['load'] += time.perf_counter() - started
+                    if not llm:
+                        continue
+                    try:
+                        cached, total = llm.cached_prefix(current_prompt)
+                        timing['cached_tokens'] += cached
+                        timing['prompt_tokens'] += total
+                        
+                        started = time.perf_counter()
+                        response = llm.generate_response(current_prompt, stop_on_plan_end=True)
+                        timing['generate'] += time.perf_counter() - started
+                    finally:
+                        pool.release(llm)
+                    
                     model_name = os.path.basename(model_path)
                     if "error" not in response:
                         responses[model_name] = response['choices'][0]['text']
-                    llm.unload_llm()
-            
-            accumulated_responses.append(responses)
-            
-            # Формирование нового промпта с учетом предыдущих ответов
-            if i < iterations - 1 and responses:
-                responses_text = "\n\n".join([
-                    f"Model {model}: {resp[:500]}..." 
-                    for model, resp in responses.items()
-                ])
-                current_prompt = f"{prompt}\n\nPrevious answer options:\n{responses_text}\n\nImprove your answer considering these options:"
+                
+                accumulated_responses.append(responses)
+                
+                # Формирование нового промпта с учетом предыдущих ответов
+                if i < iterations - 1 and responses:
+                    responses_text = "\n\n".join([
+                        f"Model {model}: {resp[:500]}..." 
+                        for model, resp in responses.items()
+                    ])
+                    current_prompt = f"{prompt}\n\nPrevious answer options:\n{responses_text}\n\nImprove your answer considering these options:"
+        finally:
+            if self.pool is None:
+                pool.unload_all()
         
+        reuse = f", из KV-кэша {timing['cached_tokens']}/{timing['prompt_tokens']} токенов промпта" if timing['cached_tokens'] else ""
+        print(f"⏱ Кросс-мышление: загрузка {timing['load']:.1f} сек, генерация {timing['generate']:.1f} сек{reuse}")
         return self._synthesize_best_response(accumulated_responses)
     
     def _synthesize_best_response(self, all_responses: List[Dict[str, str]]) -> str:
@@ -614,6 +1868,68 @@ IMPORTANT: Respond ONLY with valid JSON array, no markdown, no extra text."""
         return prompt
 
 
+class JsonArrayTracker:
+    """Отслеживание потока ответа до закрытия JSON-массива верхнего уровня
+    
+    Массив начинается с '[', за которой (после пробелов) идет '{' или ']';
+    текст до него ("Plan [draft]:") пропускается. Скобки внутри строк
+    (с учетом экранирования) не считаются. start и end - границы массива
+    в поданном тексте.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.closed = False
+        self.candidate = None  # позиция '[', которая еще может начать массив
+        self.start = None
+        self.end = None
+        self.position = 0
+    
+    def feed(self, text: str) -> bool:
+        """Добавление фрагмента; True, когда массив закрыт"""
+        for char in text:
+            if self.closed:
+                break
+            self.position += 1
+            if not self.depth:
+                self._seek_start(char)
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char in '[{':
+                self.depth += 1
+            elif char == '"':
+                self.in_string = True
+            elif char in ']}':
+                self.depth -= 1
+                if not self.depth:
+                    self.closed = True
+                    self.end = self.position
+        return self.closed
+    
+    def _seek_start(self, char: str):
+        """Поиск начала массива: '[' и первый значимый символ после нее"""
+        if self.candidate is not None:
+            if char.isspace():
+                return
+            if char == '{':
+                self.start, self.depth = self.candidate, 2
+            elif char == ']':
+                self.start, self.end, self.closed = self.candidate, self.position, True
+            self.candidate = None
+            if self.start is not None:
+                return
+        if char == '[':
+            self.candidate = self.position - 1
+
+
 class PlanParser:
     """Парсер планов из ответов LLM"""
     
@@ -641,6 +1957,49 @@ class PlanParser:
                     pass
             return None
     
+    @staticmethod
+    def check_plan(text: str) -> Optional[List[Dict]]:
+        """Тихая проверка частичного ответа: план без исправлений или None"""
+        json_text = PlanParser.extract_json_from_text(text)
+        if not json_text:
+            return None
+        try:
+            plan = json.loads(json_text)
+        except json.JSONDecodeError:
+            return None
+        return plan if PlanParser.validate_plan(plan) else None
+    
+    @staticmethod
+    def repair_plan(text: str) -> Optional[List[Dict]]:
+        """Тихая попытка исправить ответ без модели (try_fix_json)
+        
+        Только для закрытого массива: в оборванном ответе последняя ']'
+        может закрывать вложенный массив, и исправление дало бы усеченный план.
+        """
+        tracker = JsonArrayTracker()
+        if not tracker.feed(text):
+            return None
+        fixed_json = PlanParser.try_fix_json(text)
+        if not fixed_json:
+            return None
+        try:
+            plan = json.loads(fixed_json)
+        except json.JSONDecodeError:
+            return None
+        return plan if PlanParser.validate_plan(plan) else None
+    
+    @staticmethod
+    def describe_error(text: str) -> str:
+        """Краткое (англоязычное, для промпта) описание, почему ответ не план"""
+        json_text = PlanParser.extract_json_from_text(text)
+        if not json_text:
+            return "no complete JSON array found"
+        try:
+            json.loads(json_text)
+        except json.JSONDecodeError as e:
+            return f"invalid JSON ({e})"
+        return 'every action must be an object with "event" and "data" fields'
+    
     @staticmethod
     def validate_plan(plan: Any) -> bool:
         """Валидация структуры плана"""
@@ -661,26 +2020,10 @@ class PlanParser:
         # Удаление markdown форматирования
         text = text.replace('```json', '').replace('```', '')
         
-        # Поиск JSON массива
-        start = text.find('[')
-        if start == -1:
-            return None
-            
-        # Поиск парной закрывающей скобки
-        bracket_count = 0
-        end = -1
-        
-        for i, char in enumerate(text[start:]):
-            if char == '[':
-                bracket_count += 1
-            elif char == ']':
-                bracket_count -= 1
-                if bracket_count == 0:
-                    end = start + i + 1
-                    break
-        
-        if end > start:
-            return text[start:end]
+        # Поиск JSON массива и парной закрывающей скобки (скобки внутри строк не считаются)
+        tracker = JsonArrayTracker()
+        if tracker.feed(text):
+            return text[tracker.start:tracker.end]
         
         return None
     
@@ -688,10 +2031,12 @@ class PlanParser:
     def try_fix_json(text: str) -> Optional[str]:
         """Попытка исправить распространенные ошибки в JSON"""
         # Удаляем лишний текст до и после JSON
-        start = text.find('[')
-        end = text.rfind(']') + 1
+        tracker = JsonArrayTracker()
+        tracker.feed(text)
+        start = tracker.start if tracker.start is not None else text.find('[')
+        end = tracker.end if tracker.closed else text.rfind(']') + 1
         
-        if start == -1 or end == 0:
+        if start == -1 or end <= start:
             return None
             
         json_candidate = text[start:end]
@@ -725,28 +2070,51 @@ class CommandExecutor:
         self.execution_log = []
     
     def execute_plan(self, plan: List[Dict]) -> List[Dict[str, Any]]:
-        """Выполнение плана действий с логированием"""
-        results = []
+        """Выполнение плана действий по графу зависимостей с логированием.
         
-        for i, action in enumerate(plan, 1):
-            print(f"\n[{i}/{len(plan)}] Выполнение: {action.get('description', 'No description')}")
-            result = self.execute_action(action)
-            results.append(result)
-            
+        Независимые действия (например, чтение разных файлов) выполняются
+        параллельно, результаты возвращаются в порядке плана.
+        """
+        def on_result(index: int, result: Dict[str, Any]):
+            if result.get('skipped'):
+                print(f"\n[{index + 1}/{len(plan)}] ⏭ Пропуск: {result['error']}")
+                return
             # Логируем результат
             self.execution_log.append({
-                'action': action,
+                'action': plan[index],
                 'result': result,
                 'timestamp': time.time()
             })
-            
             # Прерывание при критической ошибке
             if not result.get('success', False) and result.get('critical', False):
                 print("❌ Критическая ошибка, выполнение прервано")
-                break
         
+        started = time.perf_counter()
+        results = run_graph(
+            plan, lambda index: self._execute_timed(index, plan),
+            max_workers=self.config.max_parallel_actions,
+            on_result=on_result,
+            skip_messages=("действие {} не выполнено", "выполнение прервано")
+        )
+        
+        elapsed = time.perf_counter() - started
+        total = sum(r.get('duration', 0.0) for r in results)
+        print(f"\n⏱  План выполнен за {elapsed:.2f} сек (сумма действий {total:.2f} сек)")
         return results
     
+    def _execute_timed(self, index: int, plan: List[Dict]) -> Dict[str, Any]:
+        """Выполнение одного действия с замером времени"""
+        action = plan[index]
+        print(f"\n[{index + 1}/{len(plan)}] Выполнение: {action.get('description', 'No description')}")
+        started = time.perf_counter()
+        try:
+            result = self.execute_action(action)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        result["duration"] = time.perf_counter() - started
+        print(f"   ⏱  [{index + 1}] {action.get('event')}: {result['duration']:.2f} сек")
+        return result
+    
     def execute_action(self, action: Dict) -> Dict[str, Any]:
         """Выполнение одного действия с подробным логированием"""
         event = action.get('event')
@@ -944,11 +2312,31 @@ class ControlModule:
         self.model_paths = model_paths  # Сохраняем все модели
         self.current_plan = None
         self.llm_manager = None
+        # Модели остаются загруженными между запросами
+        self.model_pool = ModelPool(config)
+        if config.preload_models:
+            self.model_pool.preload(model_paths)
         self.executor = CommandExecutor(config)
         self.current_mode = "single"
         self.cross_iterations = 2
         # Инициализируем логгер
         self.logger = PlanLogger(config.data_dir)
+        # Шаблоны планов (при первом запуске компилируются из логов)
+        self.templates = None
+        if config.use_plan_templates:
+            self.templates = PlanTemplateIndex(config.data_dir)
+            if not os.path.exists(self.templates.path):
+                added = self.templates.bootstrap(self.logger)
+                if added:
+                    print(f"✓ Скомпилировано шаблонов планов из логов: {added}")
+        # Индекс прошлых планов для few-shot примеров
+        self.plan_index = None
+        if config.plan_examples > 0:
+            self.plan_index = PlanVectorIndex(config.data_dir)
+            if not os.path.exists(self.plan_index.path):
+                added = self.plan_index.bootstrap(self.logger)
+                if added:
+                    print(f"✓ Проиндексировано прошлых планов: {added}")
 
     def show_info(self, module_name: Optional[str] = None):
         """Вывод информации о командах или модуле"""
@@ -958,7 +2346,10 @@ class ControlModule:
                 'collector': (SystemDataCollector.MODULE_NAME, SystemDataCollector.MODULE_VERSION, SystemDataCollector.MODULE_DESCRIPTION),
                 'executor': (CommandExecutor.MODULE_NAME, CommandExecutor.MODULE_VERSION, CommandExecutor.MODULE_DESCRIPTION),
                 'control': (ControlModule.MODULE_NAME, ControlModule.MODULE_VERSION, ControlModule.MODULE_DESCRIPTION),
-                'logger': (PlanLogger.MODULE_NAME, PlanLogger.MODULE_VERSION, PlanLogger.MODULE_DESCRIPTION)
+                'logger': (PlanLogger.MODULE_NAME, PlanLogger.MODULE_VERSION, PlanLogger.MODULE_DESCRIPTION),
+                'templates': (PlanTemplateIndex.MODULE_NAME, PlanTemplateIndex.MODULE_VERSION, PlanTemplateIndex.MODULE_DESCRIPTION),
+                'index': (PlanVectorIndex.MODULE_NAME, PlanVectorIndex.MODULE_VERSION, PlanVectorIndex.MODULE_DESCRIPTION),
+                'pool': (ModelPool.MODULE_NAME, ModelPool.MODULE_VERSION, ModelPool.MODULE_DESCRIPTION)
             }
             if module_name in modules:
                 name, version, desc = modules[module_name]
@@ -974,10 +2365,12 @@ class ControlModule:
             print("  /show -d           - Показать план в JSON формате")
             print("  /execute           - Выполнить текущий план")
             print("  /mode              - Показать текущий режим работы")
-            print("  /mode <single|multi|cross> [iterations] - Сменить режим")
+            print("  /mode <single|multi|cross|race> [iterations] - Сменить режим")
             print("  /models            - Показать доступные модели")
+            print("  /pool              - Показать загруженные модели")
             print("  /logs              - Показать последние логи")
             print("  /logs <type>       - Показать логи определенного типа")
+            print("  /templates         - Показать шаблоны планов")
             print("  /info              - Показать эту справку")
             print("  /info <module>     - Информация о модуле")
             print("  /exit              - Выход из программы")
@@ -989,20 +2382,20 @@ class ControlModule:
             current_indicator = ""
             if self.current_mode == "single" and i == 1:
                 current_indicator = " (текущая для single)"
-            elif self.current_mode in ["multi", "cross"]:
+            elif self.current_mode in ["multi", "cross", "race"]:
                 current_indicator = " (активна)"
             print(f"  {i}. {os.path.basename(path)}{current_indicator}")
         
         print(f"\n📊 Текущий режим: {self.current_mode}")
         if self.current_mode == "cross":
             print(f"   Итераций: {self.cross_iterations}")
-        if self.current_mode in ["multi", "cross"]:
+        if self.current_mode in ["multi", "cross", "race"]:
             print(f"   Используется моделей: {len(self.model_paths)}")
     
     def change_mode(self, mode: str, iterations: Optional[int] = None):
         """Смена режима работы"""
-        if mode not in ["single", "multi", "cross"]:
-            print("❌ Неизвестный режим. Доступные: single, multi, cross")
+        if mode not in ["single", "multi", "cross", "race"]:
+            print("❌ Неизвестный режим. Доступные: single, multi, cross, race")
             return
         
         self.current_mode = mode
@@ -1021,27 +2414,40 @@ class ControlModule:
         # Логируем исходный промпт
         self.logger.log_prompt(task, self.current_mode, self.model_paths)
         
+        # Запрос знакомой формы заполняется по шаблону без генерации
+        if self.templates:
+            plan = self.templates.match(task)
+            if plan:
+                self.current_plan = plan
+                print(f"⚡ План заполнен по шаблону ({len(plan)} действий)")
+                self.show_plan(detailed=False)
+                return
+        
+        winner_model = None  # Модель, чей план принят (пишется в лог)
         if self.current_mode == "single":
             # Используем первую модель
             model_path = self.model_paths[0]
-            self.llm_manager = LLMManager(model_path, self.config)
-            if not self.llm_manager.initialize_llm():
+            self.llm_manager = self.model_pool.acquire(model_path)
+            if not self.llm_manager:
                 print("❌ Не удалось инициализировать модель")
                 return
             
-            system_prompt = SystemDataCollector.generate_system_prompt(self.config)
-            self.current_plan = self.llm_manager.generate_plan(system_prompt, task)
-            self.llm_manager.unload_llm()
+            system_prompt = self.build_system_prompt(task)
+            try:
+                self.current_plan = self.llm_manager.generate_plan(system_prompt, task)
+            finally:
+                self.model_pool.release(self.llm_manager)
+            winner_model = os.path.basename(model_path)
             
         elif self.current_mode == "multi":
             # Используем ВСЕ модели параллельно
             print(f"🤖 Использование {len(self.model_paths)} моделей в multi-режиме")
-            multi_manager = MultiModelManager(self.model_paths, self.config)
+            multi_manager = MultiModelManager(self.model_paths, self.config, self.model_pool)
             if not multi_manager.initialize_multiple_llms():
                 print("❌ Не удалось инициализировать модели")
                 return
             
-            system_prompt = SystemDataCollector.generate_system_prompt(self.config)
+            system_prompt = self.build_system_prompt(task)
             full_prompt = f"{system_prompt}\n\nUser request: {task}\n\nAnswer (JSON):"
             
             responses = multi_manager.generate_multiple_responses(full_prompt)
@@ -1054,6 +2460,7 @@ class ControlModule:
                     text = response['choices'][0]['text']
                     if not best_response or len(text) > len(best_response):
                         best_response = text
+                        winner_model = model_name
                         print(f"✓ Выбрана модель: {model_name}")
             
             if best_response:
@@ -1062,11 +2469,33 @@ class ControlModule:
                 print("❌ Все модели вернули ошибки")
                 self.current_plan = None
                 
+        elif self.current_mode == "race":
+            # Модели генерируют одновременно, побеждает первый корректный план
+            print(f"🤖 Гонка {len(self.model_paths)} моделей")
+            race_manager = MultiModelManager(self.model_paths, self.config, self.model_pool)
+            if not race_manager.initialize_multiple_llms():
+                print("❌ Не удалось инициализировать модели")
+                return
+            
+            system_prompt = self.build_system_prompt(task)
+            full_prompt = f"{system_prompt}\n\nUser request: {task}\n\nAnswer (JSON):"
+            try:
+                result = race_manager.race_for_plan(full_prompt)
+            finally:
+                race_manager.unload_multiple_llms()
+            
+            if result:
+                self.current_plan = result['plan']
+                winner_model = result['model']
+            else:
+                print("❌ Ни одна модель не вернула корректный план")
+                self.current_plan = None
+        
         elif self.current_mode == "cross":
             # Используем кросс-мышление со ВСЕМИ моделями
             print(f"🤖 Использование {len(self.model_paths)} моделей в cross-режиме")
-            orchestrator = ModelOrchestrator(self.model_paths, self.config)
-            system_prompt = SystemDataCollector.generate_system_prompt(self.config)
+            orchestrator = ModelOrchestrator(self.model_paths, self.config, self.model_pool)
+            system_prompt = self.build_system_prompt(task)
             full_prompt = f"{system_prompt}\n\nUser request: {task}\n\nAnswer (JSON):"
             
             result = orchestrator.llms_cross_thinking(full_prompt, iterations=self.cross_iterations)
@@ -1076,12 +2505,48 @@ class ControlModule:
             print(f"✓ План создан ({len(self.current_plan)} действий)")
             self.show_plan(detailed=False)
             # Логируем успешный план
-            self.logger.log_successful_plan(task, self.current_plan)
+            self.logger.log_successful_plan(task, self.current_plan, model=winner_model)
+            if self.templates:
+                template = self.templates.add(task, self.current_plan)
+                if template and template['slots']:
+                    print(f"📐 Шаблон плана сохранен (слотов: {len(template['slots'])})")
+            if self.plan_index:
+                self.plan_index.add(task, self.current_plan)
         else:
             print("❌ Не удалось создать план")
             # Логируем неудачную попытку
             self.logger.log_failed_plan(task)
     
+    def build_system_prompt(self, task: str) -> str:
+        """Системный промпт с ближайшими прошлыми планами в качестве примеров"""
+        system_prompt = SystemDataCollector.generate_system_prompt(self.config)
+        if not self.plan_index:
+            return system_prompt
+        
+        examples = self.plan_index.search(task, k=self.config.plan_examples)
+        if examples:
+            print(f"📚 Примеры из прошлых планов: {len(examples)} (сходство {examples[0][0]:.2f})")
+        return system_prompt + PlanVectorIndex.format_examples(examples)
+    
+    def shutdown(self):
+        """Выгрузка моделей пула и сохранение счетчиков шаблонов"""
+        if self.templates:
+            self.templates.flush()
+        self.model_pool.unload_all()
+    
+    def show_templates(self, limit: int = 10):
+        """Показать шаблоны планов"""
+        if not self.templates:
+            print("❌ Шаблоны планов отключены (use_plan_templates)")
+            return
+        
+        templates = sorted(self.templates.templates.values(), key=lambda t: t['hits'], reverse=True)
+        stats = self.templates.stats
+        print(f"\n📐 Шаблоны планов: {len(templates)} (попаданий {stats['hits']}, промахов {stats['misses']})")
+        for template in templates[:limit]:
+            slots = ', '.join(f"{name}:{slot_type}" for name, slot_type in template['slots'].items()) or 'без слотов'
+            print(f"  [{template['hits']}] {template['example']} ({slots})")
+    
     def show_plan(self, detailed: bool = False):
         """Показать текущий план"""
         if not self.current_plan:
@@ -1151,6 +2616,14 @@ def parse_arguments():
                        help='Путь к конкретной модели')
     parser.add_argument('-d', '--models-dir', type=str,
                        help='Директория с моделями')
+    parser.add_argument('--model-server', type=str, metavar='HOST:PORT',
+                       help='Использовать общий сервер моделей (ModelServerPlugin)')
+    parser.add_argument('--speculative', action='store_true',
+                       help='Спекулятивное декодирование (n-граммы промпта и примеров)')
+    parser.add_argument('--draft-model', type=str, metavar='PATH',
+                       help='Малая GGUF-модель для черновиков (тот же словарь, что у основной)')
+    parser.add_argument('--preload', action='store_true',
+                       help='Загрузить выбранные модели при старте (в пределах бюджета памяти)')
     
     # Флаги для LLM модуля
     parser.add_argument('-f', '--full', action='store_true',
@@ -1159,6 +2632,8 @@ def parse_arguments():
                        help='Использовать N моделей одновременно')
     parser.add_argument('--cross-thinking', action='store_true',
                        help='Включить кросс-мышление моделей')
+    parser.add_argument('--race', action='store_true',
+                       help='Гонка моделей: первый корректный план побеждает')
     parser.add_argument('--iterations', type=int, default=2,
                        help='Количество итераций для кросс-мышления (по умолчанию: 2)')
     
@@ -1242,6 +2717,8 @@ def interactive_mode(config: AppConfig, model_paths: List[str], args):
     # Применяем аргументы командной строки к начальному режиму
     if args.cross_thinking:
         control.change_mode("cross", args.iterations)
+    elif args.race and len(model_paths) > 1:
+        control.change_mode("race")
     elif args.multi and len(model_paths) > 1:
         control.change_mode("multi")
     
@@ -1304,6 +2781,12 @@ def interactive_mode(config: AppConfig, model_paths: List[str], args):
                     status = log.get('status', '')
                     print(f"  {timestamp} [{status}]: {prompt}")
             
+            elif user_input == "/templates":
+                control.show_templates()
+            
+            elif user_input == "/pool":
+                control.model_pool.show_status()
+            
             elif user_input.startswith("/plan "):
                 task = user_input.split(maxsplit=1)[1]
                 control.handle_plan(task)
@@ -1325,6 +2808,8 @@ def interactive_mode(config: AppConfig, model_paths: List[str], args):
             break
         except Exception as e:
             print(f"❌ Ошибка: {e}")
+    
+    control.shutdown()
 
 
 def direct_task_mode(config: AppConfig, model_paths: List[str], args):
@@ -1340,6 +2825,8 @@ def direct_task_mode(config: AppConfig, model_paths: List[str], args):
     # Применяем аргументы командной строки к режиму
     if args.cross_thinking:
         control.change_mode("cross", args.iterations)
+    elif args.race and len(model_paths) > 1:
+        control.change_mode("race")
     elif args.multi and len(model_paths) > 1:
         control.change_mode("multi")
     
@@ -1374,6 +2861,8 @@ def direct_task_mode(config: AppConfig, model_paths: List[str], args):
                     print(f"    Ошибки: {result['stderr'][:200]}")
     else:
         print("❌ Не удалось создать план")
+    
+    control.shutdown()
 
 
 def main():
@@ -1398,6 +2887,14 @@ def main():
     # Применение флагов к конфигурации
     if args.verbose:
         config.verbose = True
+    if args.model_server:
+        config.model_server_address = args.model_server
+    if args.speculative or args.draft_model:
+        config.speculative = True
+    if args.draft_model:
+        config.draft_model_path = args.draft_model
+    if args.preload:
+        config.preload_models = True
     
     # Выбор моделей
     model_paths = select_models(config, args)
@@ -0,0 +1,149 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class DependencyGraph:
+    """Граф зависимостей между действиями плана.
+
+    Общий для CommandExecutor (auto2.py) и PlanExecutor (TaskPlannerPlugin),
+    как и планировщик выполнения run_graph.
+    Зависимости берутся из поля depends_on (номера действий с 1 или id)
+    или выводятся консервативно по ресурсам: устройства ввода и UI
+    выполняются строго по порядку, команды оболочки - тоже, чтение файлов
+    конфликтует только с записью того же файла. Команды из реестра
+    сериализуются в пределах своего источника (плагина), неизвестные
+    события выполняются как барьер.
+    """
+
+    INPUT_PREFIXES = ('mouse_', 'keyboard_')
+    UI_EVENTS = {'system_launch', 'system_open'}
+    # open_terminal - и окно, и команда оболочки
+    SHELL_EVENTS = {'system_command', 'system_shell', 'open_terminal'}
+
+    @classmethod
+    def resources(cls, action, sources=None):
+        """[(ресурс, 'r'|'w')] действия; None - барьер
+
+        sources - {событие: источник} зарегистрированных команд.
+        """
+        event = action.get('event', '')
+        data = action.get('data', {}) if isinstance(action.get('data'), dict) else {}
+
+        if event in cls.SHELL_EVENTS:
+            # Команда оболочки может затронуть любой файл
+            resources = [('shell', 'w'), ('fs', 'w')]
+            if event == 'open_terminal':
+                resources.append(('input', 'w'))
+            return resources
+        if event.startswith(cls.INPUT_PREFIXES) or event in cls.UI_EVENTS:
+            return [('input', 'w')]
+        if event == 'file_read':
+            return [('fs', 'r'), (f"file:{data.get('path')}", 'r')]
+        if event == 'file_write':
+            return [('fs', 'r'), (f"file:{data.get('path')}", 'w')]
+        if sources and event in sources:
+            return [(f"source:{sources[event]}", 'w')]
+        return None
+
+    @classmethod
+    def build(cls, plan, sources=None):
+        """Список множеств зависимостей (индексы с 0) для каждого действия"""
+        ids = {action.get('id'): i for i, action in enumerate(plan) if action.get('id') is not None}
+        resources = [cls.resources(action, sources) for action in plan]
+        deps = []
+
+        for i, action in enumerate(plan):
+            explicit = action.get('depends_on')
+            if explicit is not None:
+                refs = explicit if isinstance(explicit, list) else [explicit]
+                found = set()
+                for ref in refs:
+                    if isinstance(ref, int) and 1 <= ref <= i:
+                        found.add(ref - 1)
+                    elif ref in ids and ids[ref] < i:
+                        found.add(ids[ref])
+                deps.append(found)
+                continue
+
+            mine = resources[i]
+            found = set()
+            for j in range(i):
+                theirs = resources[j]
+                if mine is None or theirs is None:
+                    found.add(j)
+                    continue
+                for name, mode in mine:
+                    if any(name == other and 'w' in (mode, other_mode) for other, other_mode in theirs):
+                        found.add(j)
+                        break
+            deps.append(found)
+        return deps
+
+
+def run_graph(plan, run_action, max_workers=4, sources=None, on_result=None, should_stop=None,
+              skip_messages=("Skipped: action {} did not run", "Skipped: execution stopped")):
+    """Выполнение плана по графу зависимостей; результаты в порядке плана.
+
+    run_action(index) -> {'success': bool, 'critical': bool, ...} выполняется
+    в пуле потоков. on_result(index, result) вызывается для каждого
+    выполненного или пропущенного действия. После критической ошибки или
+    после should_stop() новые действия не запускаются. skip_messages - тексты
+    пропуска: (из-за невыполненной зависимости {номер}, после остановки).
+    """
+    deps = DependencyGraph.build(plan, sources)
+    remaining = {i: set(d) for i, d in enumerate(deps)}
+    dependents = {i: [] for i in range(len(plan))}
+    for i, found in enumerate(deps):
+        for j in found:
+            dependents[j].append(i)
+
+    results = [None] * len(plan)
+    blocked_message, stopped_message = skip_messages
+
+    def finish(index, result):
+        results[index] = result
+        if on_result:
+            on_result(index, result)
+
+    def skip(index, reason):
+        if results[index] is not None:
+            return
+        remaining.pop(index, None)
+        finish(index, {'index': index + 1, 'event': plan[index].get('event'),
+                       'success': False, 'skipped': True, 'error': reason, 'duration': 0.0})
+        release(index, False)
+
+    def release(index, success):
+        # Выведенные зависимости задают только порядок; при ошибке
+        # пропускаются лишь действия с явным depends_on
+        for dependent in dependents[index]:
+            if dependent not in remaining:
+                continue
+            if success or plan[dependent].get('depends_on') is None:
+                remaining[dependent].discard(index)
+            else:
+                skip(dependent, blocked_message.format(index + 1))
+
+    stop = False
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {}
+        while True:
+            stop = stop or bool(should_stop and should_stop())
+            if not stop:
+                for index in [i for i, found in remaining.items() if not found]:
+                    del remaining[index]
+                    futures[pool.submit(run_action, index)] = index
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                result = future.result()
+                finish(index, result)
+                release(index, result.get('success', False))
+                if not result.get('success', False) and result.get('critical', False):
+                    stop = True
+
+    for index in list(remaining):
+        skip(index, stopped_message)
+    return results
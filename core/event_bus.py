@@ -1,9 +1,12 @@
 from collections import defaultdict
 import threading
+import time
 
 class EventBus:
     def __init__(self):
         self._subscribers = defaultdict(list)  # {event_type: [callbacks]}
+        self._observers = []  # [observer(event_type, callback, cpu, wall)]
+        self._local = threading.local()
 
     def subscribe(self, event_type, callback):
         self._subscribers[event_type].append(callback)
@@ -12,9 +15,47 @@ class EventBus:
         if callback in self._subscribers[event_type]:
             self._subscribers[event_type].remove(callback)
 
+    def add_observer(self, observer):
+        """Наблюдатель за вызовами обработчиков (профилирование)."""
+        if observer not in self._observers:
+            self._observers.append(observer)
+
+    def remove_observer(self, observer):
+        if observer in self._observers:
+            self._observers.remove(observer)
+
     def publish(self, event_type, data=None, async_mode=False):
         for callback in self._subscribers.get(event_type, []):
             if async_mode:
-                threading.Thread(target=callback, args=(data,)).start()
+                threading.Thread(
+                    target=self._dispatch,
+                    args=(event_type, callback, data),
+                    name=f"bus:{event_type}"
+                ).start()
             else:
-                callback(data)
\ No newline at end of file
+                self._dispatch(event_type, callback, data)
+
+    def _dispatch(self, event_type, callback, data):
+        if not self._observers:
+            callback(data)
+            return
+
+        # Собственное CPU-время обработчика: вложенные publish вычитаются
+        stack = self._local.__dict__.setdefault('stack', [])
+        frame = [0.0]
+        stack.append(frame)
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        try:
+            callback(data)
+        finally:
+            cpu = time.thread_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+            stack.pop()
+            if stack:
+                stack[-1][0] += cpu
+            for observer in list(self._observers):
+                try:
+                    observer(event_type, callback, cpu - frame[0], wall)
+                except Exception:
+                    pass
@@ -0,0 +1,96 @@
+try:
+    import numpy as np
+    from llama_cpp.llama_speculative import LlamaDraftModel
+    SPECULATIVE_AVAILABLE = True
+except ImportError:
+    np = None
+    LlamaDraftModel = object
+    SPECULATIVE_AVAILABLE = False
+
+
+class PlanDraftModel(LlamaDraftModel):
+    """Черновые токены для спекулятивного декодирования планов.
+
+    Общий для auto2.py и TaskPlannerPlugin. Продолжение ищется по последней
+    n-грамме во входе и в корпусе (промпт с каталогом команд и прошлые
+    планы); без совпадения черновик жадно строит малая модель с тем же
+    словарем, если она задана. Основная модель проверяет черновик пакетом;
+    принятые токены учитываются при следующем вызове - llama-cpp-python
+    передает вход, продолженный проверенными токенами.
+    """
+
+    def __init__(self, num_pred_tokens=8, max_ngram_size=3, draft_llm=None):
+        self.num_pred_tokens = num_pred_tokens
+        self.max_ngram_size = max_ngram_size
+        self.draft_llm = draft_llm
+        # Корпус из двух частей, обновляемых независимо
+        self.prompt_corpus = []
+        self.plan_corpus = []
+        self.last = None  # (длина входа, черновик)
+        self.stats = {'drafts': 0, 'drafted': 0, 'accepted': 0, 'ngram': 0, 'model': 0}
+
+    def set_corpus(self, prompt_tokens=None, plan_tokens=None):
+        """Замена части корпуса; None оставляет часть без изменений"""
+        if prompt_tokens is not None:
+            self.prompt_corpus = list(prompt_tokens)
+        if plan_tokens is not None:
+            self.plan_corpus = list(plan_tokens)
+
+    def reset(self):
+        """Начало новой генерации: прошлый черновик больше не проверяется"""
+        self.last = None
+
+    @staticmethod
+    def lookup(tokens, ngram, limit, exclude_tail=False):
+        """Продолжение после последнего вхождения ngram в tokens"""
+        size = len(ngram)
+        for start in range(len(tokens) - size - (1 if exclude_tail else 0), -1, -1):
+            if tokens[start:start + size] == ngram:
+                continuation = tokens[start + size:start + size + limit]
+                if continuation:
+                    return continuation
+        return []
+
+    def account(self, tokens):
+        """Учет принятых основной моделью токенов прошлого черновика"""
+        if self.last is None:
+            return
+        length, draft = self.last
+        self.last = None
+        for drafted, actual in zip(draft, tokens[length:]):
+            if drafted != actual:
+                break
+            self.stats['accepted'] += 1
+
+    def draft(self, tokens):
+        for size in range(min(self.max_ngram_size, len(tokens) - 1), 0, -1):
+            ngram = tokens[-size:]
+            draft = (self.lookup(tokens, ngram, self.num_pred_tokens, exclude_tail=True)
+                     or self.lookup(self.prompt_corpus, ngram, self.num_pred_tokens)
+                     or self.lookup(self.plan_corpus, ngram, self.num_pred_tokens))
+            if draft:
+                self.stats['ngram'] += 1
+                return draft
+
+        if self.draft_llm is None:
+            return []
+        draft = []
+        for token in self.draft_llm.generate(tokens, top_k=1, temp=0.0):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        self.stats['model'] += 1
+        return draft
+
+    def __call__(self, input_ids, **kwargs):
+        tokens = input_ids.tolist()
+        self.account(tokens)
+        draft = self.draft(tokens)
+        if draft:
+            self.stats['drafts'] += 1
+            self.stats['drafted'] += len(draft)
+            self.last = (len(tokens), draft)
+        return np.array(draft, dtype=np.intc)
+
+    def acceptance_rate(self):
+        return self.stats['accepted'] / self.stats['drafted'] if self.stats['drafted'] else 0.0
@@ -0,0 +1,702 @@
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from core.plugin_base import PluginBase
+
+try:
+    from llama_cpp import Llama
+    LLAMA_AVAILABLE = True
+except ImportError:
+    LLAMA_AVAILABLE = False
+
+
+class HostPool:
+    """Keep-alive соединения и ограничение параллельных запросов к одному хосту"""
+
+    RETRYABLE = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+    def __init__(self, base_url, max_connections=2, timeout=60.0):
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or (443 if self.scheme == 'https' else 80)
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections': 0, 'reused': 0, 'errors': 0, 'wait': 0.0}
+
+    def connect(self):
+        """Свободное соединение из пула или новое; возвращает (соединение, переиспользовано)"""
+        with self.lock:
+            if self.idle:
+                self.stats['reused'] += 1
+                return self.idle.pop(), True
+            self.stats['connections'] += 1
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection, response):
+        """Возврат соединения в пул, если ответ прочитан полностью"""
+        if response is not None and response.isclosed() and not response.will_close:
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+
+    def stream_json(self, method, path, payload=None, timeout=None):
+        """Запрос с ответом в формате JSON lines; строки отдаются по мере получения"""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=timeout or self.timeout):
+            raise TimeoutError(f"{self.base_url}: no free connection slot")
+        self.stats['wait'] += time.monotonic() - started
+        self.stats['requests'] += 1
+
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        connection = response = None
+        try:
+            for attempt in range(2):
+                connection, reused = self.connect()
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    break
+                except self.RETRYABLE:
+                    # Сервер закрыл простаивающее соединение - повтор на новом
+                    connection.close()
+                    connection = None
+                    if not reused or attempt:
+                        raise
+
+            if response.status >= 400:
+                detail = response.read().decode('utf-8', errors='replace')
+                raise RuntimeError(f"{self.base_url}{path}: HTTP {response.status} {detail[:200]}")
+
+            while True:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{self.base_url}{path}: request timed out")
+                line = response.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield json.loads(line)
+            response.read()
+        except Exception:
+            self.stats['errors'] += 1
+            if connection is not None:
+                connection.close()
+                connection = None
+            raise
+        finally:
+            if connection is not None:
+                self.release(connection, response)
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for connection in self.idle:
+                connection.close()
+            self.idle.clear()
+
+
+class OllamaBackend:
+    """Бэкенд Ollama HTTP API (/api/generate) поверх общего пула хоста"""
+
+    name = 'ollama'
+
+    def __init__(self, pool, model, options=None, keep_alive=None):
+        self.pool = pool
+        self.model = model
+        self.options = options or {}
+        self.keep_alive = keep_alive
+
+    def generate(self, prompt, system=None, on_token=None, timeout=None, **options):
+        payload = {
+            'model': self.model,
+            'prompt': prompt,
+            'stream': on_token is not None,
+            'options': dict(self.options, **options)
+        }
+        if system:
+            payload['system'] = system
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+
+        parts = []
+        for message in self.pool.stream_json('POST', '/api/generate', payload, timeout=timeout):
+            if 'error' in message:
+                raise RuntimeError(message['error'])
+            text = message.get('response', '')
+            if text:
+                parts.append(text)
+                if on_token:
+                    on_token(text)
+            # Сообщение done последнее: поток дочитывается, чтобы соединение вернулось в пул
+        return ''.join(parts)
+
+    def count_tokens(self, text):
+        # Токенизатор удаленной модели недоступен: ~4 символа на токен
+        return len(text) // 4 + 1
+
+    def describe(self):
+        return f"ollama {self.model} @ {self.pool.base_url}"
+
+    def close(self):
+        pass
+
+
+class LlamaCppBackend:
+    """Локальный бэкенд llama.cpp (общая модель ModelServerPlugin или своя копия)"""
+
+    name = 'llama_cpp'
+
+    def __init__(self, core, model_path, n_ctx=2048, n_gpu_layers=0, max_tokens=512, timeout=None):
+        self.core = core
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_gpu_layers = n_gpu_layers
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.llm = None
+        self.hosted = None  # HostedModel общей модели ModelServerPlugin
+        self.shared = False
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()  # одна загрузка на несколько рабочих потоков
+
+    def load(self):
+        """Ленивая загрузка модели при первом запросе"""
+        if self.llm is not None:
+            return self.llm
+        with self.load_lock:
+            if self.llm is not None:
+                return self.llm
+            model_server = self.core.plugins.get('ModelServerPlugin')
+            if model_server is not None:
+                hosted = model_server.host.acquire(self.model_path, n_ctx=self.n_ctx, n_gpu_layers=self.n_gpu_layers)
+                self.hosted, self.lock, self.shared = hosted, hosted.lock, True
+                self.llm = hosted.llm
+                return self.llm
+            if not LLAMA_AVAILABLE:
+                raise RuntimeError("llama-cpp-python not installed")
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(f"Model file not found: {self.model_path}")
+            self.llm = Llama(model_path=self.model_path, n_ctx=self.n_ctx,
+                             n_gpu_layers=self.n_gpu_layers, verbose=False)
+            return self.llm
+
+    def generate(self, prompt, system=None, on_token=None, timeout=None, **options):
+        full_prompt = f"{system}\n\n{prompt}" if system else prompt
+        deadline = time.monotonic() + (timeout or self.timeout or 1e9)
+        options.setdefault('max_tokens', self.max_tokens)
+
+        llm = self.load()
+        parts = []
+        with self.lock:
+            for chunk in llm(full_prompt, stream=True, **options):
+                text = chunk['choices'][0]['text']
+                parts.append(text)
+                if on_token:
+                    on_token(text)
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{os.path.basename(self.model_path)}: generation timed out")
+        return ''.join(parts)
+
+    def count_tokens(self, text):
+        if self.llm is None:
+            return len(text) // 4 + 1
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False))
+
+    def describe(self):
+        return f"llama_cpp {os.path.basename(self.model_path)}{' (shared)' if self.shared else ''}"
+
+    def close(self):
+        with self.load_lock:
+            if self.hosted is not None:
+                model_server = self.core.plugins.get('ModelServerPlugin')
+                if model_server is not None:
+                    model_server.host.release(self.hosted)
+                self.hosted = None
+            self.llm = None
+
+
+class Agent:
+    """Агент: бэкенд и системный промпт"""
+
+    def __init__(self, name, backend, system_prompt=''):
+        self.name = name
+        self.backend = backend
+        self.system_prompt = system_prompt
+        self.stats = {'requests': 0, 'errors': 0, 'time': 0.0}
+
+    def ask(self, prompt, on_token=None, system=None, **options):
+        started = time.perf_counter()
+        self.stats['requests'] += 1
+        try:
+            return self.backend.generate(prompt, system=system or self.system_prompt,
+                                         on_token=on_token, **options)
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self.stats['time'] += time.perf_counter() - started
+
+
+class ConversationMemory:
+    """Память диалога с бюджетом токенов.
+
+    Контекст: сводка старых реплик и последние реплики дословно. Реплики
+    только дописываются, поэтому начало промпта стабильно между ходами и
+    бэкенд переиспользует KV-кэш префикса. При превышении бюджета старшие
+    реплики сворачиваются в сводку фоновым запросом; пока сводки нет,
+    промпт не меняется, а жесткий предел отбрасывает самые старые реплики.
+    """
+
+    def __init__(self, count_tokens, budget=2048, summary_threshold=0.75, keep_ratio=0.4):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.summary_threshold = summary_threshold
+        self.keep_ratio = keep_ratio
+        self.summary = ''
+        self.summary_tokens = 0
+        self.turns = []  # [(роль, текст, токены)]
+        self.summarizing = False
+        self.generation = 0  # меняется при сбросе: устаревшая сводка не применяется
+        self.lock = threading.Lock()
+        self.stats = {'summaries': 0, 'truncated': 0}
+
+    @staticmethod
+    def render_turn(role, text):
+        return f"{'User' if role == 'user' else 'Assistant'}: {text}\n"
+
+    def add(self, role, text):
+        line = self.render_turn(role, text)
+        with self.lock:
+            self.turns.append((role, text, self.count_tokens(line)))
+            self.enforce_limit()
+
+    def tokens(self):
+        return self.summary_tokens + sum(turn[2] for turn in self.turns)
+
+    def build_prompt(self, message):
+        """Промпт хода: сводка, последние реплики и новое сообщение"""
+        with self.lock:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation:\n{self.summary}\n\n")
+            parts.extend(self.render_turn(role, text) for role, text, _ in self.turns)
+        parts.append(self.render_turn('user', message))
+        parts.append("Assistant:")
+        return ''.join(parts)
+
+    def enforce_limit(self):
+        """Жесткий предел: самые старые реплики отбрасываются без сводки"""
+        while len(self.turns) > 1 and self.tokens() > self.budget:
+            self.turns.pop(0)
+            self.stats['truncated'] += 1
+
+    def take_for_summary(self):
+        """Старшие реплики для сворачивания или None, если бюджет не исчерпан"""
+        with self.lock:
+            if self.summarizing or self.tokens() < self.budget * self.summary_threshold:
+                return None
+            keep = self.budget * self.keep_ratio
+            count = 0
+            remaining = sum(turn[2] for turn in self.turns)
+            while count < len(self.turns) - 1 and remaining > keep:
+                remaining -= self.turns[count][2]
+                count += 1
+            if not count:
+                return None
+            self.summarizing = True
+            return self.generation, self.summary, list(self.turns[:count])
+
+    def apply_summary(self, generation, summary, folded):
+        """Замена свернутых реплик сводкой (одно изменение префикса на сворачивание)"""
+        with self.lock:
+            self.summarizing = False
+            if generation != self.generation or summary is None:
+                return
+            # Часть свернутых реплик могла быть уже отброшена жестким пределом
+            while self.turns and self.turns[0] in folded:
+                self.turns.pop(0)
+            self.summary = summary.strip()
+            self.summary_tokens = self.count_tokens(self.summary)
+            self.stats['summaries'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.summary = ''
+            self.summary_tokens = 0
+            self.turns = []
+            self.summarizing = False
+            self.generation += 1
+
+
+class StandInOllamaHandler(BaseHTTPRequestHandler):
+    """Локальная замена Ollama для офлайн-тестов и замеров: детерминированные ответы"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.send_json({'models': [{'name': name} for name in sorted(self.server.models)]})
+        else:
+            self.send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.send_json({'error': 'invalid JSON'}, status=400)
+            return
+        if self.path != '/api/generate':
+            self.send_json({'error': 'not found'}, status=404)
+            return
+
+        model = request.get('model', '')
+        self.server.models.add(model)
+        words = f"stand-in {model} reply to: {request.get('prompt', '')[:80]}".split(' ')
+        tokens = [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+        if not request.get('stream', True):
+            time.sleep(self.server.delay * len(tokens))
+            self.send_json({'model': model, 'response': ''.join(tokens), 'done': True})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in tokens:
+            time.sleep(self.server.delay)
+            self.write_chunk({'model': model, 'response': token, 'done': False})
+        self.write_chunk({'model': model, 'response': '', 'done': True, 'eval_count': len(tokens)})
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def write_chunk(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, message, status=200):
+        data = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, delay=0.01):
+        super().__init__(address, StandInOllamaHandler)
+        self.delay = delay
+        self.models = set()
+
+
+class AgentsPlugin(PluginBase):
+    """Среда выполнения агентов из data/agents.json с общими бэкендами
+
+    Отключен по умолчанию: свободный ввод консоли уходит бэкендам агентов
+    (Ollama и др.). Включается добавлением "AgentsPlugin" в plugins config.json.
+    """
+
+    def init(self, core):
+        self.core = core
+        self.agents_config = core.config.get('agents', {})
+        self.agents_file = self.agents_config.get('file', 'data/agents.json')
+        self.timeout = self.agents_config.get('timeout', 120)
+        self.max_per_host = self.agents_config.get('max_per_host', 2)
+        self.pools = {}  # {базовый URL: HostPool}
+        self.agents = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.agents_config.get('workers', 4), thread_name_prefix="plugin:AgentsPlugin")
+
+        # Локальная замена Ollama: все HTTP-агенты направляются на нее
+        self.stand_in = None
+        if self.agents_config.get('stand_in', False):
+            self.start_stand_in()
+
+        self.load_agents()
+
+        # Диалог с агентом общего назначения по сообщениям пользователя
+        self.chat_agent = self.agents_config.get('chat_agent', 'BaseAgent')
+        self.memory = None
+        if self.chat_agent in self.agents:
+            memory_config = self.agents_config.get('memory', {})
+            self.memory = ConversationMemory(
+                self.agents[self.chat_agent].backend.count_tokens,
+                budget=memory_config.get('budget', 2048),
+                summary_threshold=memory_config.get('summary_threshold', 0.75),
+                keep_ratio=memory_config.get('keep_ratio', 0.4)
+            )
+        # Один поток: реплики обрабатываются строго по порядку
+        self.chat_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plugin:AgentsPlugin")
+        self.chat_stats = {'turns': 0, 'time': 0.0, 'prompt_tokens': 0, 'max_prompt_tokens': 0, 'max_time': 0.0}
+
+        core.event_bus.subscribe('user_message', self.handle_user_message)
+        core.event_bus.subscribe('agent_request', self.handle_agent_request)
+        core.event_bus.subscribe('user_input', self.handle_input)
+        core.event_bus.subscribe('system_shutdown', self.on_shutdown)
+
+        self.core.event_bus.publish('output', f"🤖 AgentsPlugin initialized ({len(self.agents)} agents)")
+
+    def start_stand_in(self):
+        port = self.agents_config.get('stand_in_port', 11435)
+        try:
+            self.stand_in = StandInOllamaServer(('127.0.0.1', port), delay=self.agents_config.get('stand_in_delay', 0.01))
+        except OSError as e:
+            self.core.event_bus.publish('output', f"⚠ Stand-in server could not listen on port {port}: {e}")
+            return
+        thread = threading.Thread(target=self.stand_in.serve_forever, name="plugin:AgentsPlugin")
+        thread.daemon = True
+        thread.start()
+        self.core.event_bus.publish('output', f"🤖 Stand-in Ollama server on http://127.0.0.1:{port}")
+
+    def get_pool(self, base_url):
+        """Общий пул соединений на хост (лимит параллельности - на хост, а не на агента)"""
+        base_url = base_url.rstrip('/')
+        if base_url not in self.pools:
+            self.pools[base_url] = HostPool(base_url, self.max_per_host, self.timeout)
+        return self.pools[base_url]
+
+    def create_backend(self, definition):
+        backend = definition.get('backend', 'ollama')
+        if backend == 'ollama':
+            host = definition.get('host', 'http://localhost:11434')
+            if self.stand_in is not None:
+                host = f"http://127.0.0.1:{self.stand_in.server_address[1]}"
+            return OllamaBackend(self.get_pool(host), definition.get('model', ''),
+                                 options=definition.get('options'), keep_alive=definition.get('keep_alive'))
+        if backend == 'llama_cpp':
+            return LlamaCppBackend(
+                self.core, definition.get('model_path', ''),
+                n_ctx=definition.get('n_ctx', 2048),
+                n_gpu_layers=definition.get('n_gpu_layers', 0),
+                max_tokens=definition.get('max_tokens', 512),
+                timeout=self.timeout
+            )
+        raise ValueError(f"unknown backend '{backend}'")
+
+    def load_agents(self):
+        """Загрузка описаний агентов"""
+        if not os.path.exists(self.agents_file):
+            self.core.event_bus.publish('output', f"⚠ Agents file not found: {self.agents_file}")
+            return
+        try:
+            with open(self.agents_file, 'r', encoding='utf-8') as f:
+                definitions = json.load(f)
+        except Exception as e:
+            self.core.event_bus.publish('output', f"Error loading {self.agents_file}: {e}")
+            return
+
+        for name, definition in definitions.items():
+            if definition.get('type', 'llm') != 'llm':
+                continue
+            try:
+                self.agents[name] = Agent(name, self.create_backend(definition), definition.get('system_prompt', ''))
+            except Exception as e:
+                self.core.event_bus.publish('output', f"⚠ Agent {name} skipped: {e}")
+
+    def ask(self, name, prompt, on_token=None, **options):
+        """Синхронный запрос к агенту для других плагинов"""
+        agent = self.agents.get(name)
+        if agent is None:
+            raise KeyError(f"Unknown agent: {name}")
+        options.setdefault('timeout', self.timeout)
+        return agent.ask(prompt, on_token=on_token, **options)
+
+    def handle_agent_request(self, data):
+        """Асинхронный запрос: ответ публикуется событием agent_response"""
+        name = data.get('agent')
+        if name not in self.agents:
+            self.core.event_bus.publish('output', f"❌ Unknown agent: {name}")
+            return
+        self.executor.submit(self.run_request, data)
+
+    def run_request(self, data):
+        name = data.get('agent')
+        prompt = data.get('prompt', '')
+        request_id = data.get('id')
+        on_token = None
+        if data.get('stream', False):
+            def on_token(text):
+                self.core.event_bus.publish('agent_token', {'agent': name, 'id': request_id, 'text': text})
+
+        started = time.perf_counter()
+        response = {'agent': name, 'id': request_id, 'prompt': prompt}
+        try:
+            response['response'] = self.ask(name, prompt, on_token=on_token)
+        except Exception as e:
+            response['error'] = str(e)
+            self.core.event_bus.publish('output', f"❌ Agent {name} failed: {e}")
+        response['duration'] = time.perf_counter() - started
+        self.core.event_bus.publish('agent_response', response)
+
+    def handle_user_message(self, data):
+        """Свободный текст пользователя - ход диалога с агентом"""
+        text = (data or {}).get('text', '').strip()
+        if text and self.memory is not None:
+            self.chat_executor.submit(self.chat, text)
+
+    def chat(self, text):
+        prompt = self.memory.build_prompt(text)
+        prompt_tokens = self.agents[self.chat_agent].backend.count_tokens(prompt)
+
+        def on_token(chunk):
+            self.core.event_bus.publish('agent_token', {'agent': self.chat_agent, 'id': 'chat', 'text': chunk})
+
+        started = time.perf_counter()
+        try:
+            response = self.ask(self.chat_agent, prompt, on_token=on_token).strip()
+        except Exception as e:
+            self.core.event_bus.publish('output', f"❌ {self.chat_agent} failed: {e}")
+            return
+        elapsed = time.perf_counter() - started
+
+        stats = self.chat_stats
+        stats['turns'] += 1
+        stats['time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        stats['prompt_tokens'] += prompt_tokens
+        stats['max_prompt_tokens'] = max(stats['max_prompt_tokens'], prompt_tokens)
+
+        self.memory.add('user', text)
+        self.memory.add('assistant', response)
+        self.core.event_bus.publish('agent_response', {
+            'agent': self.chat_agent, 'id': 'chat', 'prompt': text,
+            'response': response, 'duration': elapsed, 'prompt_tokens': prompt_tokens
+        })
+        self.core.event_bus.publish('output', f"💬 {self.chat_agent}: {response}")
+
+        job = self.memory.take_for_summary()
+        if job is not None:
+            self.executor.submit(self.summarize, *job)
+
+    def summarize(self, generation, summary, folded):
+        """Фоновое сворачивание старших реплик в сводку"""
+        conversation = ''.join(ConversationMemory.render_turn(role, text) for role, text, _ in folded)
+        prompt = (f"Previous summary:\n{summary or '(none)'}\n\nNew conversation turns:\n{conversation}\n"
+                  "Update the summary with the new turns. Keep facts, names, decisions and open questions. "
+                  "Answer with the summary only, at most 150 words.")
+        try:
+            result = self.ask(self.chat_agent, prompt,
+                              system="You compress conversation history into short factual summaries.")
+        except Exception as e:
+            result = None
+            self.core.event_bus.publish('output', f"⚠ Conversation summary failed: {e}")
+        self.memory.apply_summary(generation, result, folded)
+
+    def show_memory(self):
+        if self.memory is None:
+            self.core.event_bus.publish('output', f"No conversation memory (agent {self.chat_agent} not loaded)")
+            return
+        stats = self.chat_stats
+        turns = stats['turns'] or 1
+        self.core.event_bus.publish('output',
+            f"Conversation with {self.chat_agent}: {stats['turns']} turns, latency avg "
+            f"{stats['time'] / turns:.2f}s / max {stats['max_time']:.2f}s, prompt tokens avg "
+            f"{stats['prompt_tokens'] // turns} / max {stats['max_prompt_tokens']}; memory "
+            f"{self.memory.tokens()}/{self.memory.budget} tokens ({len(self.memory.turns)} turns, "
+            f"summary {self.memory.summary_tokens}), summaries {self.memory.stats['summaries']}, "
+            f"truncated {self.memory.stats['truncated']}")
+
+    def handle_input(self, user_input):
+        parts = user_input.split()
+        if not parts or parts[0] != 'agents':
+            return
+        if len(parts) > 1 and parts[1] == 'bench':
+            self.executor.submit(self.benchmark, *parts[2:5])
+        elif len(parts) > 1 and parts[1] == 'memory':
+            self.show_memory()
+        elif len(parts) > 1 and parts[1] == 'reset':
+            if self.memory is not None:
+                self.memory.clear()
+            self.core.event_bus.publish('output', "🗑 Conversation memory cleared")
+        else:
+            self.show_agents()
+
+    def show_agents(self):
+        lines = ["Agents:"]
+        for name, agent in self.agents.items():
+            stats = agent.stats
+            avg = stats['time'] / stats['requests'] if stats['requests'] else 0.0
+            lines.append(f"  {name}: {agent.backend.describe()}, requests={stats['requests']}, "
+                         f"errors={stats['errors']}, avg {avg:.2f}s")
+        for base_url, pool in self.pools.items():
+            stats = pool.stats
+            lines.append(f"  pool {base_url}: limit {pool.max_connections}, requests={stats['requests']}, "
+                         f"connections={stats['connections']}, reused={stats['reused']}, "
+                         f"errors={stats['errors']}, waited {stats['wait']:.2f}s")
+        self.core.event_bus.publish('output', "\n".join(lines))
+
+    def benchmark(self, requests='20', concurrency='4', name=None):
+        """Замер задержки и пропускной способности агента (agents bench [N] [C] [агент])"""
+        name = name or next(iter(self.agents), None)
+        if name not in self.agents:
+            self.core.event_bus.publish('output', f"❌ Unknown agent: {name}")
+            return
+        requests, concurrency = int(requests), int(concurrency)
+
+        def one(index):
+            started = time.perf_counter()
+            first = []
+            self.ask(name, f"benchmark request {index}",
+                     on_token=lambda text: first or first.append(time.perf_counter() - started))
+            return time.perf_counter() - started, first[0] if first else None
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(one, range(requests)))
+        except Exception as e:
+            self.core.event_bus.publish('output', f"❌ Benchmark failed: {e}")
+            return
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _ in results)
+        ttfts = sorted(ttft for _, ttft in results if ttft is not None)
+        percentile = lambda values, q: values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+        self.core.event_bus.publish('output',
+            f"Benchmark {name}: {requests} requests, concurrency {concurrency}, {elapsed:.2f}s "
+            f"({requests / elapsed:.1f} req/s); latency p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+            f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms; first token p50 {percentile(ttfts, 0.5) * 1000:.0f} ms")
+        self.show_agents()
+
+    def on_shutdown(self, event_data):
+        self.shutdown()
+
+    def shutdown(self):
+        """Очистка ресурсов"""
+        self.chat_executor.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+        for agent in self.agents.values():
+            agent.backend.close()
+        for pool in self.pools.values():
+            pool.close()
+        if self.stand_in is not None:
+            self.stand_in.shutdown()
+            self.stand_in.server_close()
+            self.stand_in = None
+        self.core.event_bus.publish('output', "🤖 AgentsPlugin shutdown")
+
+
+# Для совместимости с загрузчиком
+Plugin = AgentsPlugin
@@ -20,7 +20,9 @@ class InputHandlerPlugin(PluginBase):
             user_input.startswith('add '),
             user_input.startswith('rm '),
             user_input.startswith('remove '),
-            user_input in ['exit', 'help', 'status']
+            user_input.startswith('agents '),
+            user_input.startswith('logtail '),
+            user_input in ['exit', 'help', 'status', 'resources', 'models', 'agents', 'logtail']
         ]):
             self.core.event_bus.publish('user_message', {
                 'text': user_input,
@@ -65,6 +67,16 @@ class InputHandlerPlugin(PluginBase):
                 'auto_execute': True
             })
             
+        elif cmd == '/cancel':
+            self.core.event_bus.publish('task_plan_cancel', {})
+            
+        elif cmd == '/cache':
+            action = 'clear' if args.strip() == 'clear' else 'stats'
+            self.core.event_bus.publish('task_plan_cache', {'action': action})
+            
+        elif cmd == '/stats':
+            self.core.event_bus.publish('task_planner_stats', {})
+            
         elif cmd == '/help':
             self.show_help()
             
@@ -95,6 +107,9 @@ Task Planner Commands:
   /execute            - Execute the last generated plan
   /show               - Show the current plan
   /autoexec <request> - Create and immediately execute plan
+  /cancel             - Cancel plan generation and drop queued requests
+  /cache [clear]      - Show plan cache statistics or clear the cache
+  /stats              - Show fast-path and plan cache statistics
   /help               - Show this help
 
 Examples:
@@ -0,0 +1,439 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import queue
+import re
+import select
+import struct
+import threading
+import time
+from collections import OrderedDict
+from core.plugin_base import PluginBase
+
+
+class InotifyWatcher:
+    """Ожидание изменений файлов через inotify (Linux, ctypes)"""
+
+    IN_MODIFY = 0x002
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # {wd: каталог}
+        # watch() вызывается из консоли, wait() - из потока слежения
+        self.lock = threading.Lock()
+
+    def watch(self, directory):
+        """Наблюдение за каталогом: ловит и дозапись, и ротацию файлов"""
+        with self.lock:
+            if directory in self.directories.values():
+                return
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                             self.IN_MODIFY | self.IN_CREATE | self.IN_MOVED_TO)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.directories[wd] = directory
+
+    def wait(self, timeout):
+        """Пути измененных файлов за время ожидания"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        with self.lock:
+            while offset + self.EVENT.size <= len(data):
+                wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if wd in self.directories and name:
+                    changed.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileFollower:
+    """Чтение новых строк файла с учетом усечения и ротации"""
+
+    def __init__(self, path, from_start=False):
+        self.path = os.path.abspath(path)
+        self.file = None
+        self.inode = None
+        self.partial = b''
+        self.open(seek_end=not from_start)
+
+    def open(self, seek_end=False):
+        try:
+            self.file = open(self.path, 'rb')
+        except OSError:
+            self.file = None
+            return
+        stat = os.fstat(self.file.fileno())
+        self.inode = stat.st_ino
+        if seek_end:
+            self.file.seek(0, os.SEEK_END)
+
+    def read_lines(self):
+        """Новые полные строки с момента прошлого чтения"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return []
+        if self.file is None or stat.st_ino != self.inode:
+            # Файл ротирован или появился впервые - читаем новый с начала
+            if self.file is not None:
+                self.file.close()
+            self.partial = b''
+            self.open()
+            if self.file is None:
+                return []
+        elif stat.st_size < self.file.tell():
+            # Файл усечен
+            self.file.seek(0)
+            self.partial = b''
+
+        data = self.file.read()
+        if not data:
+            return []
+        data = self.partial + data
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        return [line.decode('utf-8', errors='replace').rstrip('\r') for line in lines]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class LineClassifier:
+    """Предфильтр строк: серьезность по скомпилированным выражениям, include/exclude"""
+
+    LEVELS = {'debug': 0, 'info': 1, 'warning': 2, 'error': 3, 'critical': 4}
+    PATTERNS = [
+        ('critical', r'\b(?:CRITICAL|FATAL|PANIC|EMERG(?:ENCY)?|ALERT)\b|Kernel panic|Segmentation fault|Out of memory'),
+        ('error', r'\b(?:ERROR|ERR|FAIL(?:ED|URE)?|EXCEPTION)\b|Traceback \(most recent call last\)|\bdenied\b'),
+        ('warning', r'\b(?:WARN(?:ING)?|DEPRECATED|TIMEOUT|TIMED OUT|RETRY(?:ING)?)\b'),
+        ('debug', r'\b(?:DEBUG|TRACE)\b'),
+    ]
+
+    def __init__(self, min_severity='warning', include=None, exclude=None):
+        self.min_level = self.LEVELS.get(min_severity, 2)
+        # Одно выражение с именованными группами - один проход по строке
+        self.severity_re = re.compile(
+            '|'.join(f"(?P<{name}>{pattern})" for name, pattern in self.PATTERNS), re.IGNORECASE)
+        self.include_re = re.compile('|'.join(include)) if include else None
+        self.exclude_re = re.compile('|'.join(exclude)) if exclude else None
+
+    def severity(self, line):
+        level = 'info'
+        for match in self.severity_re.finditer(line):
+            name = match.lastgroup
+            if self.LEVELS[name] > self.LEVELS[level] or level == 'info':
+                level = name
+            if level == 'critical':
+                break
+        return level
+
+    def classify(self, line):
+        """Серьезность строки или None, если строка отбрасывается"""
+        if self.exclude_re and self.exclude_re.search(line):
+            return None
+        level = self.severity(line)
+        if self.include_re and self.include_re.search(line):
+            return level
+        return level if self.LEVELS[level] >= self.min_level else None
+
+
+class TemplateDeduper:
+    """Дедупликация по шаблону строки: переменные части заменяются на <*>"""
+
+    MASKS = [
+        re.compile(r'\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'),
+        re.compile(r'\b[A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2}\b'),
+        re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'),
+        re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'),
+        re.compile(r'\b0x[0-9a-fA-F]+\b|\b[0-9a-fA-F]{12,}\b'),
+        re.compile(r'"[^"]*"|\'[^\']*\''),
+        re.compile(r'(?<![A-Za-z])[-+]?\d+(?:\.\d+)?'),
+    ]
+
+    def __init__(self, window=300.0, max_templates=10000):
+        self.window = window
+        self.max_templates = max_templates
+        self.seen = OrderedDict()  # {шаблон: время последней отправки}
+
+    def template(self, line):
+        for mask in self.MASKS:
+            line = mask.sub('<*>', line)
+        return line
+
+    def is_duplicate(self, template, now):
+        """True, если такой шаблон уже отправлялся в пределах окна"""
+        sent = self.seen.get(template)
+        if sent is not None and now - sent < self.window:
+            return True
+        self.seen[template] = now
+        self.seen.move_to_end(template)
+        while len(self.seen) > self.max_templates:
+            self.seen.popitem(last=False)
+        return False
+
+
+class LogBatch:
+    """Пакет строк для агента с бюджетом по токенам"""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # {шаблон: [серьезность, пример, повторы, файл]}
+        self.tokens = 0
+        self.started = time.monotonic()
+
+    @staticmethod
+    def estimate_tokens(text):
+        # Грубая оценка без токенизатора: ~4 символа на токен
+        return len(text) // 4 + 1
+
+    def add(self, template, level, line, path):
+        entry = self.entries.get(template)
+        if entry is not None:
+            entry[2] += 1
+            return
+        self.entries[template] = [level, line, 1, path]
+        self.tokens += self.estimate_tokens(line) + 4
+
+    def render(self):
+        lines = []
+        for level, line, count, path in self.entries.values():
+            repeat = f" (x{count})" if count > 1 else ""
+            lines.append(f"[{level.upper()}] {os.path.basename(path)}: {line}{repeat}")
+        return "\n".join(lines)
+
+    def line_count(self):
+        return sum(entry[2] for entry in self.entries.values())
+
+
+class LogTailPlugin(PluginBase):
+    """Слежение за логами и отправка аномалий агенту LogAnalyzer"""
+
+    def init(self, core):
+        self.core = core
+        self.tail_config = core.config.get('log_tail', {})
+        self.agent = self.tail_config.get('agent', 'LogAnalyzer')
+        self.poll_interval = self.tail_config.get('poll_interval', 1.0)
+        self.token_budget = self.tail_config.get('token_budget', 1024)
+        self.flush_interval = self.tail_config.get('flush_interval', 10.0)
+        self.max_line_length = self.tail_config.get('max_line_length', 500)
+
+        self.classifier = LineClassifier(
+            self.tail_config.get('min_severity', 'warning'),
+            include=self.tail_config.get('include'),
+            exclude=self.tail_config.get('exclude')
+        )
+        self.deduper = TemplateDeduper(window=self.tail_config.get('dedup_window', 300))
+        self.followers = {}  # {путь: FileFollower}
+        self.polled = set()  # пути без inotify-наблюдения, читаются по таймауту
+        self.batch = LogBatch()
+        self.lock = threading.Lock()
+        self.stats = {'ingested': 0, 'filtered': 0, 'duplicates': 0, 'batched': 0,
+                      'sent': 0, 'batches': 0, 'dropped': 0, 'send_time': 0.0}
+        self.started = time.monotonic()
+
+        self.watcher = None
+        if self.tail_config.get('inotify', True):
+            try:
+                self.watcher = InotifyWatcher()
+            except (OSError, AttributeError):
+                self.watcher = None
+
+        for pattern in self.tail_config.get('files', []):
+            self.follow(pattern, from_start=self.tail_config.get('from_start', False))
+
+        core.event_bus.subscribe('user_input', self.handle_input)
+        core.event_bus.subscribe('system_shutdown', self.on_shutdown)
+
+        # Чтение и отправка разделены: медленный агент не тормозит прием строк
+        self.send_queue = queue.Queue(maxsize=self.tail_config.get('max_pending_batches', 8))
+        self.stop_event = threading.Event()
+        self.tail_thread = threading.Thread(target=self.tail_loop, name="plugin:LogTailPlugin")
+        self.tail_thread.daemon = True
+        self.tail_thread.start()
+        self.send_thread = threading.Thread(target=self.send_loop, name="plugin:LogTailPlugin")
+        self.send_thread.daemon = True
+        self.send_thread.start()
+
+        mode = 'inotify' if self.watcher else f'polling {self.poll_interval}s'
+        self.core.event_bus.publish('output',
+            f"📜 LogTailPlugin initialized ({len(self.followers)} files, {mode})")
+
+    def follow(self, pattern, from_start=False):
+        """Добавление файлов (путь или glob) к отслеживаемым"""
+        paths = glob.glob(pattern) or [pattern]
+        added = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self.followers:
+                continue
+            with self.lock:
+                self.followers[path] = FileFollower(path, from_start=from_start)
+            if self.watcher:
+                try:
+                    self.watcher.watch(os.path.dirname(path))
+                except OSError as e:
+                    with self.lock:
+                        self.polled.add(path)
+                    self.core.event_bus.publish('output', f"⚠ inotify watch failed, polling {path}: {e}")
+            added += 1
+        return added
+
+    def tail_loop(self):
+        while not self.stop_event.is_set():
+            if self.watcher:
+                changed = self.watcher.wait(self.poll_interval)
+                with self.lock:
+                    followers = [f for path, f in self.followers.items()
+                                 if path in changed or path in self.polled]
+            else:
+                self.stop_event.wait(self.poll_interval)
+                with self.lock:
+                    followers = list(self.followers.values())
+
+            for follower in followers:
+                lines = follower.read_lines()
+                if lines:
+                    self.ingest(follower.path, lines)
+            self.maybe_flush()
+
+    def ingest(self, path, lines):
+        """Фильтрация, дедупликация и накопление строк в пакет"""
+        now = time.monotonic()
+        stats = self.stats
+        stats['ingested'] += len(lines)
+        for line in lines:
+            if not line.strip():
+                stats['filtered'] += 1
+                continue
+            level = self.classifier.classify(line)
+            if level is None:
+                stats['filtered'] += 1
+                continue
+            line = line[:self.max_line_length]
+            template = self.deduper.template(line)
+            if template in self.batch.entries:
+                self.batch.add(template, level, line, path)
+                stats['duplicates'] += 1
+                continue
+            if self.deduper.is_duplicate(template, now):
+                stats['duplicates'] += 1
+                continue
+            self.batch.add(template, level, line, path)
+            stats['batched'] += 1
+            if self.batch.tokens >= self.token_budget:
+                self.flush()
+
+    def maybe_flush(self):
+        if self.batch.entries and time.monotonic() - self.batch.started >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        batch, self.batch = self.batch, LogBatch()
+        try:
+            self.send_queue.put_nowait(batch)
+        except queue.Full:
+            self.stats['dropped'] += batch.line_count()
+
+    def send_loop(self):
+        while True:
+            batch = self.send_queue.get()
+            if batch is None:
+                break
+            self.send_batch(batch)
+
+    def send_batch(self, batch):
+        agents = self.core.plugins.get('AgentsPlugin')
+        if agents is None:
+            self.stats['dropped'] += batch.line_count()
+            return
+        text = batch.render()
+        started = time.perf_counter()
+        try:
+            response = agents.ask(self.agent, text)
+        except Exception as e:
+            self.stats['dropped'] += batch.line_count()
+            self.core.event_bus.publish('output', f"⚠ Log analysis failed: {e}")
+            return
+        self.stats['send_time'] += time.perf_counter() - started
+        self.stats['sent'] += len(batch.entries)
+        self.stats['batches'] += 1
+        self.core.event_bus.publish('log_analysis', {
+            'agent': self.agent,
+            'lines': text,
+            'count': batch.line_count(),
+            'response': response
+        })
+        self.core.event_bus.publish('output', f"📜 {self.agent}: {response.strip()}")
+
+    def handle_input(self, user_input):
+        parts = user_input.split(maxsplit=2)
+        if not parts or parts[0] != 'logtail':
+            return
+        if len(parts) > 2 and parts[1] == 'follow':
+            added = self.follow(parts[2])
+            self.core.event_bus.publish('output', f"📜 Following {added} new file(s)")
+        else:
+            self.show_stats()
+
+    def show_stats(self):
+        stats = self.stats
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        ratio = stats['sent'] / stats['ingested'] if stats['ingested'] else 0.0
+        self.core.event_bus.publish('output', "\n".join([
+            f"Log tail: {len(self.followers)} files, {'inotify' if self.watcher else 'polling'}",
+            f"  ingested {stats['ingested']} lines ({stats['ingested'] / elapsed:.1f} lines/s), "
+            f"filtered {stats['filtered']}, duplicates {stats['duplicates']}",
+            f"  sent {stats['sent']} lines in {stats['batches']} batches "
+            f"({ratio:.2%} of ingested, {stats['sent'] / elapsed:.2f} lines/s), "
+            f"dropped {stats['dropped']}, agent time {stats['send_time']:.1f}s"
+        ]))
+
+    def on_shutdown(self, event_data):
+        self.shutdown()
+
+    def shutdown(self):
+        """Очистка ресурсов"""
+        self.stop_event.set()
+        if self.tail_thread.is_alive() and self.tail_thread is not threading.current_thread():
+            self.tail_thread.join(timeout=self.poll_interval + 1.0)
+        try:
+            self.send_queue.put_nowait(None)
+        except queue.Full:
+            pass
+        with self.lock:
+            for follower in self.followers.values():
+                follower.close()
+            self.followers.clear()
+            self.polled.clear()
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+        self.core.event_bus.publish('output', "📜 LogTailPlugin shutdown")
+
+
+# Для совместимости с загрузчиком
+Plugin = LogTailPlugin
@@ -0,0 +1,405 @@
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from core.plugin_base import PluginBase
+
+try:
+    from llama_cpp import Llama, StoppingCriteriaList
+    LLAMA_AVAILABLE = True
+    try:
+        from llama_cpp import LlamaGrammar
+    except ImportError:
+        LlamaGrammar = None
+except ImportError:
+    LLAMA_AVAILABLE = False
+    LlamaGrammar = None
+
+# Параметры генерации, которые принимаются от удаленных клиентов
+COMPLETION_PARAMS = {
+    'max_tokens', 'temperature', 'top_k', 'top_p', 'min_p', 'repeat_penalty',
+    'stop', 'echo', 'seed', 'presence_penalty', 'frequency_penalty'
+}
+
+# Параметры загрузки, которые принимаются от удаленных клиентов
+REMOTE_LOAD_PARAMS = {'n_ctx', 'n_gpu_layers', 'n_batch', 'n_threads', 'seed'}
+
+
+def is_deterministic(params):
+    """Одинаковые запросы дают одинаковый ответ: жадная выборка или фиксированный seed"""
+    seed = params.get('seed')
+    return params.get('temperature', 0.8) == 0 or (seed is not None and seed != -1)
+
+
+class HostedModel:
+    """Загруженная модель: счетчик ссылок, блокировка и очередь запросов"""
+
+    def __init__(self, key, path, llm):
+        self.key = key
+        self.path = path
+        self.llm = llm
+        self.refs = 0
+        self.last_used = time.time()
+        self.lock = threading.RLock()  # держат и очередь, и локальные клиенты
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self.work_loop, name=f"plugin:ModelServerPlugin:{os.path.basename(path)}")
+        self.worker.daemon = True
+        self.worker.start()
+        self.stats = {'requests': 0, 'coalesced': 0, 'busy': 0.0}
+
+    def submit(self, prompt, params, stream=False, cancel=None):
+        """Постановка запроса в очередь модели; возвращает очередь ответа
+
+        cancel - threading.Event, по которому генерация прерывается на
+        следующем токене (op "cancel" от клиента).
+        """
+        replies = queue.Queue()
+        self.jobs.put((prompt, params, stream, replies, cancel or threading.Event()))
+        return replies
+
+    def work_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            prompt, params, stream, replies, cancel = job
+
+            # Одинаковые детерминированные запросы из очереди обслуживаются одной
+            # генерацией; при случайной выборке каждый получает свой ответ
+            followers = []
+            cancels = [cancel]
+            if not stream and is_deterministic(params):
+                pending = []
+                while True:
+                    try:
+                        other = self.jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    if other is not None and not other[2] and other[0] == prompt and other[1] == params:
+                        followers.append(other[3])
+                        cancels.append(other[4])
+                    else:
+                        pending.append(other)
+                for other in pending:
+                    self.jobs.put(other)
+
+            # Общая генерация прерывается, только когда ее отменили все получатели
+            def cancelled(*args):
+                return all(event.is_set() for event in cancels)
+
+            started = time.perf_counter()
+            with self.lock:
+                try:
+                    kwargs = dict(params)
+                    if 'grammar' in kwargs and LlamaGrammar is not None:
+                        kwargs['grammar'] = LlamaGrammar.from_string(kwargs['grammar'], verbose=False)
+                    if cancelled():
+                        raise RuntimeError("cancelled")
+                    if stream:
+                        chunks = self.llm(prompt, stream=True, **kwargs)
+                        for chunk in chunks:
+                            if cancelled():
+                                chunks.close()  # Останавливает декодирование
+                                break
+                            replies.put(('chunk', chunk))
+                        replies.put(('done', None))
+                    else:
+                        kwargs['stopping_criteria'] = StoppingCriteriaList([cancelled])
+                        result = self.llm(prompt, **kwargs)
+                        if cancelled():
+                            raise RuntimeError("cancelled")
+                        for target in [replies] + followers:
+                            target.put(('result', result))
+                except Exception as e:
+                    for target in [replies] + followers:
+                        target.put(('error', str(e)))
+            self.stats['requests'] += 1 + len(followers)
+            self.stats['coalesced'] += len(followers)
+            self.stats['busy'] += time.perf_counter() - started
+            self.last_used = time.time()
+
+    def close(self):
+        self.jobs.put(None)
+
+
+class ModelHost:
+    """Реестр загруженных моделей: одна копия GGUF на процесс"""
+
+    def __init__(self, load_params, idle_timeout=600):
+        self.load_params = load_params
+        self.idle_timeout = idle_timeout
+        self.models = {}  # {(абсолютный путь, параметры загрузки): HostedModel}
+        self.loading = {}  # {ключ: блокировка загрузки}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def model_key(path, params):
+        """Ключ модели: путь и параметры загрузки (объекты - по идентичности)"""
+        items = []
+        for name, value in sorted(params.items()):
+            if not isinstance(value, (int, float, str, bool, type(None))):
+                value = ('id', id(value))
+            items.append((name, value))
+        return path, tuple(items)
+
+    def acquire(self, model_path, **load_params):
+        """Получение модели с увеличением счетчика ссылок (загрузка при необходимости)
+
+        Загрузка идет вне общей блокировки, чтобы другие клиенты и команда
+        models не ждали чтения GGUF; одинаковые загрузки ждут друг друга.
+        """
+        path = os.path.abspath(model_path)
+        params = dict(self.load_params, **load_params)
+        key = self.model_key(path, params)
+        with self.lock:
+            hosted = self.take(key)
+            if hosted is not None:
+                return hosted
+            loading = self.loading.setdefault(key, threading.Lock())
+
+        with loading:
+            with self.lock:
+                hosted = self.take(key)
+                if hosted is not None:
+                    return hosted
+            try:
+                if not LLAMA_AVAILABLE:
+                    raise RuntimeError("llama-cpp-python not installed")
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"Model file not found: {model_path}")
+                llm = Llama(model_path=path, use_mmap=True, verbose=False, **params)
+                hosted = HostedModel(key, path, llm)
+                with self.lock:
+                    self.models[key] = hosted
+                    return self.take(key)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+
+    def take(self, key):
+        """Увеличение счетчика ссылок загруженной модели (под self.lock)"""
+        hosted = self.models.get(key)
+        if hosted is not None:
+            hosted.refs += 1
+            hosted.last_used = time.time()
+        return hosted
+
+    def release(self, hosted):
+        with self.lock:
+            if self.models.get(hosted.key) is hosted and hosted.refs > 0:
+                hosted.refs -= 1
+                hosted.last_used = time.time()
+
+    def unload_idle(self):
+        """Выгрузка моделей без ссылок, простаивающих дольше idle_timeout"""
+        unloaded = []
+        with self.lock:
+            for key, hosted in list(self.models.items()):
+                if hosted.refs == 0 and hosted.jobs.empty() and time.time() - hosted.last_used > self.idle_timeout:
+                    hosted.close()
+                    del self.models[key]
+                    unloaded.append(hosted.path)
+        return unloaded
+
+    def unload_all(self):
+        with self.lock:
+            for hosted in self.models.values():
+                hosted.close()
+            self.models.clear()
+
+
+class ModelRequestHandler(socketserver.StreamRequestHandler):
+    """JSON-lines протокол: по одному запросу на строку.
+
+    {"op": "completion", "model": path, "prompt": str, "params": {...}, "stream": bool, "id": str}
+    {"op": "cancel", "id": str}  - прерывание запроса с этим id (с другого соединения)
+    {"op": "models"}
+    """
+
+    def handle(self):
+        host = self.server.host
+        held = {}  # {ключ модели: HostedModel}
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    self.handle_request(host, request, held)
+                except (BrokenPipeError, ConnectionResetError):
+                    break
+                except Exception as e:
+                    self.send({'error': str(e)})
+        finally:
+            # Соединение держит ссылки на использованные модели до отключения
+            for hosted in held.values():
+                host.release(hosted)
+
+    def handle_request(self, host, request, held):
+        op = request.get('op', 'completion')
+        if op == 'cancel':
+            event = self.server.active.get(request.get('id'))
+            if event is not None:
+                event.set()
+            self.send({'cancelled': event is not None})
+            return
+        if op == 'models':
+            self.send({'models': [
+                {'path': hosted.path, 'refs': hosted.refs, 'queued': hosted.jobs.qsize(), **hosted.stats}
+                for hosted in list(host.models.values())
+            ]})
+            return
+
+        model_path = self.server.resolve_model(request['model'])
+        load_params = {k: v for k, v in request.get('load', {}).items() if k in REMOTE_LOAD_PARAMS}
+        key = host.model_key(model_path, dict(host.load_params, **load_params))
+        hosted = held.get(key)
+        if hosted is None:
+            hosted = host.acquire(model_path, **load_params)
+            held[hosted.key] = hosted
+
+        params = {k: v for k, v in request.get('params', {}).items() if k in COMPLETION_PARAMS or k == 'grammar'}
+        stream = request.get('stream', False)
+        request_id = request.get('id')
+        cancel = threading.Event()
+        if request_id:
+            self.server.active[request_id] = cancel
+        try:
+            replies = hosted.submit(request.get('prompt', ''), params, stream, cancel)
+            self.relay(replies)
+        except (BrokenPipeError, ConnectionResetError):
+            cancel.set()  # Клиент ушел - генерация для него больше не нужна
+            raise
+        finally:
+            if request_id:
+                self.server.active.pop(request_id, None)
+
+    def relay(self, replies):
+        while True:
+            kind, payload = replies.get()
+            if kind == 'chunk':
+                self.send({'chunk': payload})
+                continue
+            if kind == 'result':
+                self.send({'result': payload})
+            elif kind == 'error':
+                self.send({'error': payload})
+            else:
+                self.send({'done': True})
+            break
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+
+class ThreadingModelServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = {}  # {id запроса: Event отмены}
+
+    def resolve_model(self, model_path):
+        """Путь модели удаленного клиента: только .gguf внутри разрешенных директорий"""
+        path = os.path.realpath(model_path)
+        for directory in self.models_dirs:
+            root = os.path.realpath(directory)
+            if path.endswith('.gguf') and os.path.commonpath([root, path]) == root:
+                return path
+        raise PermissionError(f"Model path outside allowed directories: {model_path}")
+
+
+class ModelServerPlugin(PluginBase):
+    """Общий хостинг LLM для всех потребителей (в процессе и по сокету)
+
+    Отключен по умолчанию; включается добавлением "ModelServerPlugin"
+    в plugins config.json перед TaskPlannerPlugin.
+    """
+
+    def init(self, core):
+        self.core = core
+        self.server_config = core.config.get('model_server', {})
+        self.host = ModelHost(
+            {
+                'n_ctx': self.server_config.get('n_ctx', 2048),
+                'n_gpu_layers': self.server_config.get('n_gpu_layers', 0),
+                'n_batch': self.server_config.get('n_batch', 512)
+            },
+            idle_timeout=self.server_config.get('idle_timeout', 600)
+        )
+        self.server = None
+        self.server_thread = None
+        self.stop_event = threading.Event()
+
+        core.event_bus.subscribe('user_input', self.handle_input)
+        core.event_bus.subscribe('system_shutdown', self.on_shutdown)
+
+        # Сокет без аутентификации открывается только по явному разрешению
+        if self.server_config.get('listen', False):
+            self.start_server()
+
+        # Поток выгрузки простаивающих моделей
+        self.reaper_thread = threading.Thread(target=self.reaper_loop, name="plugin:ModelServerPlugin")
+        self.reaper_thread.daemon = True
+        self.reaper_thread.start()
+
+        self.core.event_bus.publish('output', "🗄 ModelServerPlugin initialized")
+
+    def start_server(self):
+        address = (self.server_config.get('host', '127.0.0.1'), self.server_config.get('port', 8765))
+        try:
+            self.server = ThreadingModelServer(address, ModelRequestHandler)
+            self.server.host = self.host
+            models_dirs = self.server_config.get('models_dirs', ['data/models', 'models'])
+            self.server.models_dirs = [models_dirs] if isinstance(models_dirs, str) else list(models_dirs)
+            self.server_thread = threading.Thread(target=self.server.serve_forever, name="plugin:ModelServerPlugin")
+            self.server_thread.daemon = True
+            self.server_thread.start()
+            self.core.event_bus.publish('output', f"🗄 Model server listening on {address[0]}:{address[1]}")
+        except OSError as e:
+            self.server = None
+            self.core.event_bus.publish('output', f"⚠ Model server could not listen on {address}: {e}")
+
+    def reaper_loop(self):
+        interval = max(1, min(60, self.host.idle_timeout // 4 or 1))
+        while not self.stop_event.wait(interval):
+            for path in self.host.unload_idle():
+                self.core.event_bus.publish('output', f"🗄 Unloaded idle model: {os.path.basename(path)}")
+
+    def handle_input(self, user_input):
+        if user_input == 'models':
+            self.show_models()
+
+    def show_models(self):
+        if not self.host.models:
+            self.core.event_bus.publish('output', "No models loaded")
+            return
+        lines = ["Loaded models:"]
+        for hosted in list(self.host.models.values()):
+            lines.append(
+                f"  {os.path.basename(hosted.path)}: refs={hosted.refs}, queued={hosted.jobs.qsize()}, "
+                f"requests={hosted.stats['requests']} (coalesced {hosted.stats['coalesced']}), "
+                f"busy {hosted.stats['busy']:.1f}s"
+            )
+        self.core.event_bus.publish('output', "\n".join(lines))
+
+    def on_shutdown(self, event_data):
+        self.shutdown()
+
+    def shutdown(self):
+        """Очистка ресурсов"""
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.host.unload_all()
+        self.core.event_bus.publish('output', "🗄 ModelServerPlugin shutdown")
+
+
+# Для совместимости с загрузчиком
+Plugin = ModelServerPlugin
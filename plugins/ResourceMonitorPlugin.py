@@ -0,0 +1,234 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from core.plugin_base import PluginBase
+
+
+class ResourceMonitorPlugin(PluginBase):
+    """Учет CPU, памяти и потоков по плагинам"""
+
+    def init(self, core):
+        self.core = core
+        self.lock = threading.Lock()
+
+        # Загружаем конфигурацию
+        self.monitor_config = core.config.get('resource_monitor', {})
+        self.interval = self.monitor_config.get('interval', 30)
+        self.use_tracemalloc = self.monitor_config.get('tracemalloc', True)
+        self.tracemalloc_frames = self.monitor_config.get('tracemalloc_frames', 8)
+
+        # Статистика обработчиков: {plugin: {'calls', 'cpu', 'wall'}}
+        self.handler_stats = defaultdict(lambda: {'calls': 0, 'cpu': 0.0, 'wall': 0.0})
+        # CPU обработчиков, выполненных в чужих потоках: {thread_ident: cpu}
+        self.handler_cpu_by_thread = defaultdict(float)
+
+        # Память на прошлом снимке отдельно для каждого вызывающего:
+        # {'periodic' | 'command': {plugin: bytes}}
+        self.last_memory = {}
+        self.started_tracemalloc = False
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self.started_tracemalloc = True
+
+        core.event_bus.add_observer(self.on_handler_call)
+        core.event_bus.subscribe('user_input', self.handle_input)
+        core.event_bus.subscribe('system_shutdown', self.on_shutdown)
+
+        # Поток периодических снимков
+        self.stop_event = threading.Event()
+        self.snapshot_thread = None
+        if self.interval and self.interval > 0:
+            self.snapshot_thread = threading.Thread(target=self.snapshot_loop, name="plugin:ResourceMonitorPlugin")
+            self.snapshot_thread.daemon = True
+            self.snapshot_thread.start()
+
+        self.core.event_bus.publish('output', "📊 ResourceMonitorPlugin initialized (type 'resources')")
+
+    def on_handler_call(self, event_type, callback, cpu, wall):
+        """Наблюдатель EventBus: учет времени обработчика"""
+        owner = self.resolve_owner(callback)
+        with self.lock:
+            stats = self.handler_stats[owner]
+            stats['calls'] += 1
+            stats['cpu'] += cpu
+            stats['wall'] += wall
+            self.handler_cpu_by_thread[threading.get_ident()] += cpu
+
+    def resolve_owner(self, obj):
+        """Определение плагина-владельца обработчика или цели потока"""
+        instance = getattr(obj, '__self__', None)
+        if instance is not None:
+            for name, plugin in list(self.core.plugins.items()):
+                if plugin is instance:
+                    return name
+        module = getattr(obj, '__module__', '') or ''
+        if module.startswith('plugins.'):
+            return module.split('.', 1)[1]
+        if module.startswith('core.'):
+            return 'core'
+        return 'other'
+
+    def thread_owner(self, thread):
+        """Определение плагина, которому принадлежит поток"""
+        if thread is threading.main_thread():
+            return 'core'
+        target = getattr(thread, '_target', None)
+        if target is not None:
+            # Асинхронные обработчики EventBus запускаются через _dispatch
+            if getattr(target, '__name__', '') == '_dispatch':
+                args = getattr(thread, '_args', ())
+                if len(args) > 1:
+                    return self.resolve_owner(args[1])
+            return self.resolve_owner(target)
+        if thread.name.startswith('plugin:'):
+            return thread.name.split(':', 1)[1]
+        return 'other'
+
+    def thread_cpu_time(self, thread):
+        """CPU-время потока (только POSIX)"""
+        if not hasattr(time, 'pthread_getcpuclockid') or thread.ident is None:
+            return None
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+        except (OSError, OverflowError):
+            return None
+
+    def collect_thread_stats(self):
+        """Живые потоки и их собственное CPU-время по плагинам"""
+        threads = defaultdict(lambda: {'count': 0, 'cpu': 0.0})
+        alive = threading.enumerate()
+        idents = {thread.ident for thread in alive}
+        with self.lock:
+            # Идентификаторы завершенных потоков переиспользуются новыми
+            for ident in [i for i in self.handler_cpu_by_thread if i not in idents]:
+                del self.handler_cpu_by_thread[ident]
+            handler_cpu = dict(self.handler_cpu_by_thread)
+
+        for thread in alive:
+            owner = self.thread_owner(thread)
+            entry = threads[owner]
+            entry['count'] += 1
+            cpu = self.thread_cpu_time(thread)
+            if cpu is not None:
+                # Время обработчиков в этом потоке уже учтено за их владельцами
+                entry['cpu'] += max(cpu - handler_cpu.get(thread.ident, 0.0), 0.0)
+        return threads
+
+    def plugin_files(self):
+        """Соответствие файлов модулей плагинам"""
+        files = {}
+        for name in list(self.core.plugins.keys()):
+            module = sys.modules.get(f'plugins.{name}')
+            path = getattr(module, '__file__', None)
+            if path:
+                files[os.path.abspath(path)] = name
+        return files
+
+    def collect_memory_stats(self):
+        """Аллокации Python по плагинам (tracemalloc)"""
+        if not tracemalloc.is_tracing():
+            return {}
+
+        files = self.plugin_files()
+        owners_cache = {}
+        memory = defaultdict(int)
+        snapshot = tracemalloc.take_snapshot()
+
+        for stat in snapshot.statistics('traceback'):
+            # Относим аллокацию к ближайшему кадру из файла плагина
+            owner = 'other'
+            for frame in stat.traceback:
+                filename = frame.filename
+                if filename not in owners_cache:
+                    owners_cache[filename] = files.get(os.path.abspath(filename))
+                if owners_cache[filename]:
+                    owner = owners_cache[filename]
+                    break
+            memory[owner] += stat.size
+        return memory
+
+    def take_snapshot(self, baseline='periodic'):
+        """Сводный снимок использования ресурсов
+
+        baseline - с чьим прошлым снимком считается Δmem.
+        """
+        threads = self.collect_thread_stats()
+        memory = self.collect_memory_stats()
+        with self.lock:
+            handlers = {name: dict(stats) for name, stats in self.handler_stats.items()}
+
+        last_memory = self.last_memory.get(baseline, {})
+        snapshot = {}
+        names = set(handlers) | set(threads) | set(memory) | set(self.core.plugins.keys())
+        for name in names:
+            handler = handlers.get(name, {'calls': 0, 'cpu': 0.0, 'wall': 0.0})
+            thread = threads.get(name, {'count': 0, 'cpu': 0.0})
+            mem = memory.get(name, 0)
+            snapshot[name] = {
+                'handler_calls': handler['calls'],
+                'handler_cpu': handler['cpu'],
+                'handler_wall': handler['wall'],
+                'thread_cpu': thread['cpu'],
+                'cpu_total': handler['cpu'] + thread['cpu'],
+                'threads': thread['count'],
+                'memory': mem,
+                'memory_delta': mem - last_memory.get(name, 0)
+            }
+        self.last_memory[baseline] = memory
+
+        return {
+            'timestamp': time.time(),
+            'tracemalloc': tracemalloc.is_tracing(),
+            'plugins': snapshot
+        }
+
+    def snapshot_loop(self):
+        while not self.stop_event.wait(self.interval):
+            if not self.core.running:
+                continue
+            try:
+                self.core.event_bus.publish('resource_snapshot', self.take_snapshot())
+            except Exception as e:
+                self.core.event_bus.publish('output', f"Resource snapshot error: {e}")
+
+    def handle_input(self, user_input):
+        if user_input == 'resources':
+            self.show_resources()
+
+    def show_resources(self):
+        """Вывод таблицы ресурсов по плагинам"""
+        snapshot = self.take_snapshot(baseline='command')
+        rows = sorted(
+            snapshot['plugins'].items(),
+            key=lambda item: (item[1]['cpu_total'], item[1]['memory']),
+            reverse=True
+        )
+
+        lines = [f"{'plugin':<28}{'cpu,s':>9}{'handlers':>10}{'threads':>9}{'mem,KiB':>11}{'Δmem,KiB':>11}"]
+        for name, stats in rows:
+            lines.append(
+                f"{name:<28}{stats['cpu_total']:>9.2f}{stats['handler_calls']:>10}"
+                f"{stats['threads']:>9}{stats['memory'] / 1024:>11.1f}{stats['memory_delta'] / 1024:>11.1f}"
+            )
+        if not snapshot['tracemalloc']:
+            lines.append("(tracemalloc disabled: memory columns are empty)")
+        self.core.event_bus.publish('output', "\n".join(lines))
+
+    def on_shutdown(self, event_data):
+        self.shutdown()
+
+    def shutdown(self):
+        """Очистка ресурсов"""
+        self.stop_event.set()
+        self.core.event_bus.remove_observer(self.on_handler_call)
+        if self.started_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        self.core.event_bus.publish('output', "📊 ResourceMonitorPlugin shutdown")
+
+
+# Для совместимости с загрузчиком
+Plugin = ResourceMonitorPlugin
@@ -208,6 +208,7 @@ class SystemCommandPlugin(PluginBase):
 
     def shutdown(self):
         """Очистка ресурсов"""
+        self.core.event_bus.publish('plugin_commands_unregistered', {'plugin_name': 'system_command'})
         self.core.event_bus.publish('output', "💻 SystemCommandPlugin shutdown")
 
 
@@ -27,6 +27,10 @@ class SystemCommandsPlugin(PluginBase):
             "Available commands:",
             "  exit    - Shutdown system",
             "  status  - Show system info",
+            "  resources - Per-plugin CPU/memory/threads (ResourceMonitorPlugin)",
+            "  models  - Models hosted by ModelServerPlugin",
+            "  agents  - Agents and connection pools (agents bench [N] [C] [agent], agents memory, agents reset)",
+            "  logtail - Log tail statistics (logtail follow <path>)",
             "  add X   - Load plugin X",
             "  rm X    - Unload plugin X"
         ])
@@ -1,22 +1,954 @@
+import hashlib
 import json
+import math
 import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
 from pathlib import Path
+from core.dependency_graph import run_graph
 from core.plugin_base import PluginBase
+from core.speculative import PlanDraftModel, SPECULATIVE_AVAILABLE
 
 # Импорт llama-cpp-python
 try:
     from llama_cpp import Llama
     LLAMA_AVAILABLE = True
+    try:
+        from llama_cpp import LlamaGrammar
+    except ImportError:
+        LlamaGrammar = None
+    try:
+        from llama_cpp import StoppingCriteriaList
+    except ImportError:
+        StoppingCriteriaList = None
+    try:
+        from llama_cpp import LlamaState
+    except ImportError:
+        LlamaState = None
+    # Низкоуровневый API (multi-sequence) для пакетного декодирования
+    import llama_cpp as llama_low_level
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
 except ImportError:
+    LlamaGrammar = None
+    StoppingCriteriaList = None
+    LlamaState = None
+    np = None
+    llama_low_level = None
     LLAMA_AVAILABLE = False
     print("Warning: llama-cpp-python not installed. Install with: pip install llama-cpp-python")
 
 
+class PromptStateCache:
+    """Снимки состояния llama.cpp после префилла статического префикса промпта.
+
+    Файл снимка: сигнатура, строка JSON-заголовка с версией формата и
+    размерами, затем сырые байты input_ids, scores и состояния llama.cpp.
+    Ничего не десериализуется как объект Python; на диске хранятся
+    max_disk_entries последних снимков.
+    """
+
+    MAGIC = b'PSTATE\n'
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir, model_path, n_ctx, max_disk_entries=2):
+        self.cache_dir = Path(cache_dir)
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.max_disk_entries = max_disk_entries
+        self.current_key = None
+        self.state = None
+        self.identity = None
+
+    def model_identity(self):
+        """Идентичность модели: путь, размер и время изменения файла"""
+        try:
+            stat = os.stat(self.model_path)
+            return f"{os.path.abspath(self.model_path)}:{stat.st_size}:{int(stat.st_mtime)}:{self.n_ctx}"
+        except OSError:
+            return f"{self.model_path}:{self.n_ctx}"
+
+    def get_identity(self):
+        if self.identity is None:
+            self.identity = self.model_identity()
+        return self.identity
+
+    def key(self, prefix, prefix_hash=None):
+        prefix_hash = prefix_hash or hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        return hashlib.sha256(f"{self.get_identity()}\n{prefix_hash}".encode('utf-8')).hexdigest()[:32]
+
+    @staticmethod
+    def disk_supported():
+        return LlamaState is not None and np is not None
+
+    def write_state(self, path, key, state):
+        input_ids = np.ascontiguousarray(state.input_ids, dtype=np.intc)
+        scores = np.ascontiguousarray(state.scores, dtype=np.single)
+        header = {
+            'version': self.FORMAT_VERSION,
+            'key': key,
+            'n_tokens': int(state.n_tokens),
+            'seed': int(state.seed),
+            'input_ids': len(input_ids),
+            'scores': list(scores.shape),
+            'llama_state': int(state.llama_state_size),
+        }
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(input_ids.tobytes())
+            f.write(scores.tobytes())
+            f.write(bytes(state.llama_state[:state.llama_state_size]))
+        os.replace(tmp_path, path)
+
+    def read_state(self, path, key):
+        """Снимок из файла; ValueError при несовпадении формата или размеров"""
+        with open(path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError("not a prompt state file")
+            header = json.loads(f.readline(4096).decode('utf-8'))
+            if header.get('version') != self.FORMAT_VERSION or header.get('key') != key:
+                raise ValueError("prompt state version mismatch")
+            
+            def read_exact(size):
+                data = f.read(size)
+                if len(data) != size:
+                    raise ValueError("truncated prompt state file")
+                return data
+            
+            rows, cols = (int(n) for n in header['scores'])
+            input_ids = np.frombuffer(read_exact(int(header['input_ids']) * np.dtype(np.intc).itemsize),
+                                      dtype=np.intc).copy()
+            scores = np.frombuffer(read_exact(rows * cols * np.dtype(np.single).itemsize),
+                                   dtype=np.single).reshape(rows, cols).copy()
+            llama_state = read_exact(int(header['llama_state']))
+            if f.read(1):
+                raise ValueError("unexpected data in prompt state file")
+        return LlamaState(input_ids=input_ids, scores=scores, n_tokens=int(header['n_tokens']),
+                          llama_state=llama_state, llama_state_size=len(llama_state),
+                          seed=int(header['seed']))
+
+    def prune(self, keep):
+        """Удаление снимков сверх max_disk_entries; давно не использованные - первыми"""
+        files = [path for path in self.cache_dir.glob('*.state') if path.stem != keep]
+        files.sort(key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in files[max(self.max_disk_entries - 1, 0):]:
+            path.unlink(missing_ok=True)
+
+    def restore(self, llm, prefix, prefix_hash=None):
+        """Восстановление состояния модели для префикса.
+
+        Возвращает 'memory', 'disk' или 'prefill' в зависимости от источника.
+        """
+        key = self.key(prefix, prefix_hash)
+        if self.current_key == key and self.state is not None:
+            llm.load_state(self.state)
+            return 'memory'
+
+        path = self.cache_dir / f"{key}.state"
+        if self.disk_supported() and path.exists():
+            try:
+                self.state = self.read_state(path, key)
+                llm.load_state(self.state)
+                self.current_key = key
+                os.utime(path)
+                return 'disk'
+            except Exception:
+                path.unlink(missing_ok=True)
+
+        # Префилл: вычисляем префикс один раз и сохраняем снимок
+        llm.reset()
+        llm.eval(llm.tokenize(prefix.encode('utf-8')))
+        self.state = llm.save_state()
+        self.current_key = key
+
+        if self.disk_supported() and self.max_disk_entries > 0:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                self.write_state(path, key, self.state)
+                self.prune(key)
+            except Exception:
+                pass
+        return 'prefill'
+
+
+class PlanCache:
+    """Двухуровневый кэш планов: LRU в памяти и JSON-файлы на диске"""
+
+    def __init__(self, cache_dir, max_entries=128, max_disk_entries=1024, ttl=7 * 24 * 3600):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()  # {ключ: запись}
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    @staticmethod
+    def normalize(request):
+        """Нормализация текста запроса: регистр, пробелы, пунктуация по краям"""
+        text = ' '.join(str(request).lower().split())
+        return text.strip(' .,!?;:')
+
+    def expired(self, entry):
+        return bool(self.ttl) and time.time() - entry.get('created', 0) > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if not self.expired(entry):
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry['plan']
+                del self.memory[key]
+
+            path = self.cache_dir / f"{key}.json"
+            if path.exists():
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        entry = json.load(f)
+                    if not self.expired(entry):
+                        self._remember(key, entry)
+                        self.stats['disk_hits'] += 1
+                        return entry['plan']
+                    path.unlink(missing_ok=True)
+                except Exception:
+                    path.unlink(missing_ok=True)
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, request, plan):
+        entry = {'request': request, 'plan': plan, 'created': time.time()}
+        with self.lock:
+            self._remember(key, entry)
+            self.stats['stores'] += 1
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                with open(self.cache_dir / f"{key}.json", 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                self._evict_disk()
+            except Exception:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            for path in self.cache_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _evict_disk(self):
+        """Удаление самых старых файлов сверх лимита"""
+        files = list(self.cache_dir.glob("*.json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda path: path.stat().st_mtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            path.unlink(missing_ok=True)
+            self.stats['evictions'] += 1
+
+
+class IncrementalPlanParser:
+    """Инкрементальный парсер JSON-массива действий из потока токенов"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.closed = False
+        self.object_buffer = []
+
+    def feed(self, text):
+        """Добавление фрагмента текста; возвращает список закрытых объектов"""
+        actions = []
+        for char in text:
+            if self.closed:
+                break
+            if not self.started:
+                # Пропускаем текст до начала массива
+                if char == '[':
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.depth >= 2:
+                self.object_buffer.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+                if self.depth == 2:
+                    self.object_buffer = [char]
+            elif char in ']}':
+                self.depth -= 1
+                if self.depth == 1 and self.object_buffer:
+                    actions.append(self._decode_object(''.join(self.object_buffer)))
+                    self.object_buffer = []
+                elif self.depth == 0:
+                    self.closed = True
+        return actions
+
+    @staticmethod
+    def _decode_object(text):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
+
+
+class PlanGrammarBuilder:
+    """Построение GBNF-грамматики плана из реестра команд"""
+
+    JSON_RULES = r'''ws ::= [ \n]?
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" hex hex hex hex ) )* "\""
+hex ::= [0-9a-fA-F]
+integer ::= "-"? ( [0-9] | [1-9] [0-9]* )
+number ::= integer ( "." [0-9]+ )? ( [eE] [-+]? [0-9]+ )?
+boolean ::= "true" | "false"
+value ::= object | array | string | number | boolean | "null"
+object ::= "{" ws ( string ws ":" ws value ( "," ws string ws ":" ws value )* )? ws "}"
+array ::= "[" ws ( value ( "," ws value )* )? ws "]"'''
+
+    # Тип значения по началу описания параметра
+    TYPE_RULES = [
+        ('int', 'integer'),
+        ('float', 'number'),
+        ('number', 'number'),
+        ('bool', 'boolean'),
+        ('list', 'array'),
+        ('array', 'array'),
+        ('dict', 'object'),
+        ('object', 'object'),
+        ('str', 'string'),
+    ]
+
+    @staticmethod
+    def literal(text):
+        """GBNF-литерал для JSON-представления строки"""
+        encoded = json.dumps(text)
+        return '"' + encoded.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    @classmethod
+    def value_rule(cls, description):
+        description = str(description).strip().lower()
+        if ' or ' in description.split(' - ')[0]:
+            return 'value'
+        for prefix, rule in cls.TYPE_RULES:
+            if description.startswith(prefix):
+                return rule
+        return 'value'
+
+    @classmethod
+    def build(cls, available_commands):
+        """GBNF-грамматика; None, если команд нет"""
+        rules = []
+        action_rules = []
+        index = 0
+
+        for commands in available_commands.values():
+            if not isinstance(commands, list):
+                continue
+            for cmd in commands:
+                if not isinstance(cmd, dict) or not cmd.get('event'):
+                    continue
+                params = cmd.get('parameters', {}) or {}
+
+                key_rules = []
+                for key_index, (key, desc) in enumerate(params.items()):
+                    key_rule = f"kv-{index}-{key_index}"
+                    rules.append(f'{key_rule} ::= {cls.literal(key)} ws ":" ws {cls.value_rule(desc)}')
+                    key_rules.append(key_rule)
+
+                if key_rules:
+                    member = f"member-{index}"
+                    rules.append(f"{member} ::= {' | '.join(key_rules)}")
+                    rules.append(f'data-{index} ::= "{{" ws ( {member} ( "," ws {member} )* )? ws "}}"')
+                else:
+                    rules.append(f'data-{index} ::= "{{" ws "}}"')
+
+                rules.append(
+                    f'action-{index} ::= "{{" ws "\\"event\\"" ws ":" ws {cls.literal(cmd["event"])} ws "," ws '
+                    f'"\\"data\\"" ws ":" ws data-{index} '
+                    f'( "," ws "\\"description\\"" ws ":" ws string )? ws "}}"'
+                )
+                action_rules.append(f"action-{index}")
+                index += 1
+
+        if not action_rules:
+            return None
+
+        header = [
+            'root ::= ws "[" ws ( action ( "," ws action )* )? ws "]"',
+            f"action ::= {' | '.join(action_rules)}",
+        ]
+        return '\n'.join(header + rules + [cls.JSON_RULES])
+
+
+class CommandRegistry:
+    """Версионируемый реестр команд с кэшем отрисованных секций промпта"""
+
+    def __init__(self):
+        self.commands = {}  # {источник: [команды]}
+        self.sections = {}  # {источник: текст секции промпта}
+        self.version = 0
+
+    @staticmethod
+    def is_command_list(commands):
+        return isinstance(commands, list) and all(isinstance(cmd, dict) for cmd in commands)
+
+    def register(self, source, commands):
+        """Регистрация команд источника; True, если реестр изменился"""
+        if not self.is_command_list(commands) or self.commands.get(source) == commands:
+            return False
+        self.commands[source] = commands
+        self.sections[source] = self.render_section(source, commands)
+        self.version += 1
+        return True
+
+    def unregister(self, source):
+        if source not in self.commands:
+            return False
+        del self.commands[source]
+        del self.sections[source]
+        self.version += 1
+        return True
+
+    @staticmethod
+    def render_section(source, commands):
+        """Описание команд одного источника для системного промпта"""
+        commands_desc = [f"\n{source.upper()} COMMANDS:"]
+        for cmd in commands:
+            event = cmd.get('event', '')
+            desc = cmd.get('description', '')
+            params = cmd.get('parameters', {})
+            
+            params_str = ', '.join([f"{k}: {v}" for k, v in params.items()])
+            commands_desc.append(f"  - {event}: {desc}")
+            if params_str:
+                commands_desc.append(f"    Parameters: {params_str}")
+        return ''.join(commands_desc)
+
+    def catalogue(self):
+        return ''.join(self.sections.values())
+
+    def count(self):
+        return sum(len(commands) for commands in self.commands.values())
+
+
+class CommandIndex:
+    """Лексический BM25-индекс по описаниям и примерам команд"""
+
+    TOKEN_RE = re.compile(r'[a-zа-яё0-9]+')
+
+    def __init__(self, available_commands, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = []  # [(источник, команда, {терм: частота}, длина)]
+        self.doc_freq = {}
+
+        for source, commands in available_commands.items():
+            for cmd in commands:
+                terms = self.tokenize(self.command_text(source, cmd))
+                freqs = {}
+                for term in terms:
+                    freqs[term] = freqs.get(term, 0) + 1
+                for term in freqs:
+                    self.doc_freq[term] = self.doc_freq.get(term, 0) + 1
+                self.docs.append((source, cmd, freqs, len(terms)))
+
+        self.avg_len = sum(doc[3] for doc in self.docs) / len(self.docs) if self.docs else 0.0
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls.TOKEN_RE.findall(str(text).lower())
+
+    @staticmethod
+    def command_text(source, cmd):
+        """Текст команды для индексации: имя, описание, параметры, пример"""
+        parts = [source, cmd.get('event', ''), cmd.get('description', '')]
+        for key, desc in (cmd.get('parameters', {}) or {}).items():
+            parts.extend([key, desc])
+        example = cmd.get('example')
+        if example:
+            parts.append(json.dumps(example.get('data', example), ensure_ascii=False))
+        return ' '.join(str(part) for part in parts)
+
+    def search(self, query, top_k):
+        """Top-K команд по релевантности; пустой список, если совпадений нет"""
+        terms = set(self.tokenize(query))
+        n_docs = len(self.docs)
+        scored = []
+
+        for index, (source, cmd, freqs, length) in enumerate(self.docs):
+            score = 0.0
+            for term in terms:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                df = self.doc_freq[term]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (self.avg_len or 1))
+                score += idf * tf * (self.k1 + 1) / norm
+            if score > 0:
+                scored.append((score, index))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(self.docs[index][0], self.docs[index][1]) for _, index in scored[:top_k]]
+
+
+class FastPathMatcher:
+    """Детерминированный разбор простых запросов без LLM.
+
+    Глагол запроса сопоставляется с именем события и описанием команды,
+    аргументы раскладываются по параметрам из data/commands/*.json.
+    """
+
+    NUMBER_RE = re.compile(r'^-?\d+(?:\.\d+)?$')
+    CHOICES_RE = re.compile(r'Available:\s*\[(.*?)\]')
+    # Составные запросы отдаются LLM
+    MULTI_STEP_RE = re.compile(r'\b(and|then|after|before|и|затем|потом)\b|[;\n]', re.IGNORECASE)
+    FILLER_WORDS = {'at', 'to', 'by', 'on', 'x', 'y', ','}
+    POLITE_WORDS = {'please', 'пожалуйста'}
+    PUNCTUATION = '.!,?'  # конец фразы после глагола, числа или имени
+    # Глаголы, которыми также запускают приложения: "open notepad" -> system_launch
+    VERB_ALIASES = {'open': ('launch',), 'start': ('launch',), 'run': ('launch',)}
+
+    def __init__(self, available_commands):
+        self.verbs = {}  # {глагол: [команды]}
+        for commands in available_commands.values():
+            for cmd in commands:
+                for verb in self.command_verbs(cmd):
+                    self.verbs.setdefault(verb, []).append(cmd)
+
+    @staticmethod
+    def command_verbs(cmd):
+        """Глаголы команды: хвост имени события и первое слово описания"""
+        verbs = []
+        event = cmd.get('event', '')
+        if '_' in event:
+            verbs.append(event.split('_', 1)[1].lower())
+        description = cmd.get('description', '').split()
+        if description:
+            verbs.append(description[0].lower())
+        return list(dict.fromkeys(verbs))
+
+    @staticmethod
+    def describe_params(cmd):
+        """[(имя, тип, обязательный, описание)] параметров команды"""
+        params = []
+        for name, desc in (cmd.get('parameters', {}) or {}).items():
+            desc = str(desc)
+            required = '(optional)' not in desc and '(default' not in desc
+            params.append((name, PlanGrammarBuilder.value_rule(desc), required, desc))
+        return params
+
+    def match(self, request):
+        """План из одного действия или None"""
+        text = request.strip()
+        if not text or self.MULTI_STEP_RE.search(text):
+            return None
+
+        # Знаки препинания убираются только для сопоставления слов,
+        # текст параметра ("type Hello!") остается как есть
+        words = text.split()
+        while words and words[0].lower().rstrip(self.PUNCTUATION) in self.POLITE_WORDS:
+            words = words[1:]
+        if not words:
+            return None
+
+        verb, rest = words[0].lower().rstrip(self.PUNCTUATION), words[1:]
+        if not verb:
+            return None
+        candidates = list(self.verbs.get(verb, []))
+        for alias in self.VERB_ALIASES.get(verb, ()):
+            candidates += [cmd for cmd in self.verbs.get(alias, []) if cmd not in candidates]
+        
+        found = None
+        for cmd in candidates:
+            data = self.fill_params(cmd, rest)
+            if data is None:
+                continue
+            # Совпадение со списком допустимых значений (имя приложения) точнее свободной строки
+            if self.has_choices(cmd):
+                found = (cmd, data)
+                break
+            if found is None:
+                found = (cmd, data)
+        if found is None:
+            return None
+        cmd, data = found
+        return [{'event': cmd['event'], 'data': data, 'description': request.strip()}]
+
+    def has_choices(self, cmd):
+        return any(self.CHOICES_RE.search(desc) for _, _, _, desc in self.describe_params(cmd))
+
+    def fill_params(self, cmd, rest):
+        params = self.describe_params(cmd)
+        numeric = [p for p in params if p[1] in ('integer', 'number')]
+        textual = [p for p in params if p[1] in ('string', 'array', 'value')]
+
+        if not rest:
+            return {} if not any(p[2] for p in params) else None
+        # Числа и имена без точки в конце фразы; свободный текст - без изменений
+        words = rest[:-1] + [rest[-1].rstrip(self.PUNCTUATION)]
+        if not words[-1]:
+            words = words[:-1]
+            if not words:
+                return {} if not any(p[2] for p in params) else None
+
+        # Числовые аргументы: "click at 500 300", "scroll 5"
+        tokens = [t for t in words if t.lower() not in self.FILLER_WORDS]
+        if tokens and all(self.NUMBER_RE.match(t) for t in tokens) and not any(p[2] for p in textual):
+            required = [p for p in numeric if p[2]]
+            if not len(required) <= len(tokens) <= len(numeric):
+                return None
+            data = {}
+            for (name, rule, _, _), token in zip(numeric, tokens):
+                data[name] = int(float(token)) if rule == 'integer' else float(token)
+            return data
+
+        # Текстовый аргумент: ровно один обязательный параметр без чисел
+        required = [p for p in params if p[2]]
+        if len(required) != 1 or required[0][1] not in ('string', 'array', 'value'):
+            return None
+
+        name, rule, _, desc = required[0]
+        value = ' '.join(rest)
+        if 'text' not in desc.lower():
+            # Имена клавиш, приложений и т.п. - одно слово или комбинация через '+'
+            if len(words) != 1:
+                return None
+            value = words[0]
+            choices = self.CHOICES_RE.search(desc)
+            if choices:
+                allowed = [c.strip().strip("'\"").lower() for c in choices.group(1).split(',')]
+                if value.lower() not in allowed:
+                    return None
+
+        if rule == 'array':
+            return {name: [part for part in value.split('+') if part]}
+        return {name: value}
+
+
+class BatchPlanDecoder:
+    """Совместное декодирование запросов с общим префиксом промпта.
+
+    Декодер держит собственный контекст llama.cpp поверх весов модели
+    с n_seq_max = max_sequences + 1: префикс вычисляется один раз
+    в последовательности 0, его KV копируется в слот каждого запроса,
+    после чего все активные слоты продвигаются одним llama_decode на токен.
+    Освободившийся слот сразу занимает следующий запрос (continuous batching).
+    Контекст занимает отдельный KV-кэш размером n_ctx.
+    """
+
+    def __init__(self, llm, max_sequences=4, max_tokens=512, temperature=0.7, top_k=40, stop=()):
+        self.llm = llm
+        self.max_sequences = max_sequences
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.stop = [s for s in stop if s]
+        self.ctx = None
+        self.prefix = []  # токены префикса в последовательности 0
+        self.peak = 0
+        self.tokens = 0
+
+    @staticmethod
+    def supported(llm):
+        return (llama_low_level is not None and hasattr(llm, '_model')
+                and hasattr(llama_low_level, 'llama_sampler_chain_init'))
+
+    # Совместимость с разными версиями llama.cpp: KV-кэш, словарь, создание контекста
+
+    def seq_rm(self, seq_id, p0=-1, p1=-1):
+        api = llama_low_level
+        if hasattr(api, 'llama_get_memory'):
+            return api.llama_memory_seq_rm(api.llama_get_memory(self.ctx), seq_id, p0, p1)
+        if hasattr(api, 'llama_kv_self_seq_rm'):
+            return api.llama_kv_self_seq_rm(self.ctx, seq_id, p0, p1)
+        return api.llama_kv_cache_seq_rm(self.ctx, seq_id, p0, p1)
+
+    def seq_cp(self, src, dst, p0, p1):
+        api = llama_low_level
+        if hasattr(api, 'llama_get_memory'):
+            return api.llama_memory_seq_cp(api.llama_get_memory(self.ctx), src, dst, p0, p1)
+        if hasattr(api, 'llama_kv_self_seq_cp'):
+            return api.llama_kv_self_seq_cp(self.ctx, src, dst, p0, p1)
+        return api.llama_kv_cache_seq_cp(self.ctx, src, dst, p0, p1)
+
+    def vocab(self):
+        """Словарь модели (новый API) или сама модель (старый)"""
+        model = self.llm._model.model
+        if hasattr(llama_low_level, 'llama_model_get_vocab'):
+            return llama_low_level.llama_model_get_vocab(model)
+        return model
+
+    def is_eog(self, token):
+        if hasattr(llama_low_level, 'llama_vocab_is_eog'):
+            return llama_low_level.llama_vocab_is_eog(self.vocab(), token)
+        return llama_low_level.llama_token_is_eog(self.vocab(), token)
+
+    def open(self):
+        """Контекст с отдельной последовательностью на каждый слот и префикс"""
+        if self.ctx is not None:
+            return
+        api = llama_low_level
+        params = api.llama_context_default_params()
+        params.n_ctx = self.llm.n_ctx()
+        params.n_batch = self.llm.n_batch
+        params.n_seq_max = self.max_sequences + 1
+        params.n_threads = self.llm.context_params.n_threads
+        params.n_threads_batch = self.llm.context_params.n_threads_batch
+        if hasattr(params, 'kv_unified'):
+            # Общий KV-кэш: длина последовательности не делится на n_seq_max
+            params.kv_unified = True
+        create = getattr(api, 'llama_init_from_model', None) or api.llama_new_context_with_model
+        self.ctx = create(self.llm._model.model, params)
+        if not self.ctx:
+            self.ctx = None
+            raise RuntimeError("failed to create batched llama context")
+        if api.llama_n_seq_max(self.ctx) <= self.max_sequences:
+            self.close()
+            raise RuntimeError(f"llama context supports only {self.max_sequences} sequences")
+
+    def close(self):
+        if self.ctx is not None:
+            llama_low_level.llama_free(self.ctx)
+            self.ctx = None
+            self.prefix = []
+
+    def sampler(self, grammar):
+        """Цепочка сэмплеров слота; грамматика отдельная для каждой последовательности"""
+        api = llama_low_level
+        chain = api.llama_sampler_chain_init(api.llama_sampler_chain_default_params())
+        if grammar:
+            api.llama_sampler_chain_add(chain, api.llama_sampler_init_grammar(
+                self.vocab(), grammar.encode('utf-8'), b'root'))
+        if self.temperature <= 0:
+            api.llama_sampler_chain_add(chain, api.llama_sampler_init_greedy())
+        else:
+            api.llama_sampler_chain_add(chain, api.llama_sampler_init_top_k(self.top_k))
+            api.llama_sampler_chain_add(chain, api.llama_sampler_init_temp(self.temperature))
+            api.llama_sampler_chain_add(chain, api.llama_sampler_init_dist(api.LLAMA_DEFAULT_SEED))
+        return chain
+
+    def run(self, prefix, items, admit, on_start, on_text, on_finish, should_stop, grammar=None):
+        """Генерация для items и запросов, выдаваемых admit().
+
+        prefix - общий текст промпта; items и admit() дают пары (объект, текст
+        суффикса); on_text(объект, текст) возвращает True, когда ответ завершен;
+        on_finish(объект, текст, токены) вызывается для каждого принятого запроса.
+        grammar - текст GBNF, ограничивающий каждую последовательность.
+        Запросы, не поместившиеся в контекст, возвращаются списком.
+        """
+        api = llama_low_level
+        self.open()
+        ctx = self.ctx
+        self.peak = 0
+        self.tokens = 0
+        n_ctx = api.llama_n_ctx(ctx)
+        capacity = max(self.llm.n_batch, self.max_sequences)
+        batch = api.llama_batch_init(capacity, 0, 1)
+        slots = {}  # {seq_id: состояние запроса}
+        free = list(range(self.max_sequences, 0, -1))
+        waiting = list(items)
+        rejected = []
+
+        def decode(entries):
+            # entries: [(токен, позиция, seq_id, нужны ли логиты)]
+            batch.n_tokens = len(entries)
+            for i, (token, pos, seq_id, logits) in enumerate(entries):
+                batch.token[i] = token
+                batch.pos[i] = pos
+                batch.n_seq_id[i] = 1
+                batch.seq_id[i][0] = seq_id
+                batch.logits[i] = logits
+            if api.llama_decode(ctx, batch) != 0:
+                raise RuntimeError("llama_decode failed for batched sequences")
+
+        def feed(tokens, start_pos, seq_id):
+            """Вычисление токенов порциями; логиты только для последнего"""
+            for start in range(0, len(tokens), capacity):
+                chunk = tokens[start:start + capacity]
+                decode([(token, start_pos + start + i, seq_id, start + i == len(tokens) - 1)
+                        for i, token in enumerate(chunk)])
+            return len(chunk) - 1
+
+        prefix_tokens = self.llm.tokenize(prefix.encode('utf-8'))
+        if prefix_tokens != self.prefix:
+            # Префикс изменился (реестр команд): пересчитываем последовательность 0
+            self.seq_rm(-1)
+            self.prefix = []
+            feed(prefix_tokens, 0, 0)
+            self.prefix = prefix_tokens
+        n_prefix = len(prefix_tokens)
+        cells = n_prefix
+
+        def finish(seq_id):
+            nonlocal cells
+            slot = slots.pop(seq_id)
+            api.llama_sampler_free(slot['sampler'])
+            self.seq_rm(seq_id)
+            cells -= slot['reserved']
+            free.append(seq_id)
+            on_finish(slot['item'], slot['text'], slot['generated'])
+
+        def accept(seq_id, index):
+            """Выбор и учет токена; True - последовательность завершена"""
+            slot = slots[seq_id]
+            token = api.llama_sampler_sample(slot['sampler'], ctx, index)
+            slot['generated'] += 1
+            self.tokens += 1
+            if self.is_eog(token):
+                return True
+            slot['next'] = token
+            slot['pending'] += self.llm.detokenize([token])
+            try:
+                text = slot['pending'].decode('utf-8')
+            except UnicodeDecodeError:
+                # Неполный многобайтовый символ - ждем следующий токен
+                return slot['generated'] >= self.max_tokens
+            slot['pending'] = b''
+            
+            combined = slot['text'] + text
+            for stop in self.stop:
+                if stop in combined:
+                    text = combined[:combined.index(stop)][len(slot['text']):]
+                    slot['text'] += text
+                    if text:
+                        on_text(slot['item'], text)
+                    return True
+            slot['text'] = combined
+            if on_text(slot['item'], text):
+                return True
+            return slot['generated'] >= self.max_tokens
+
+        try:
+            while True:
+                # Прием новых запросов в свободные слоты
+                while free and not should_stop():
+                    item = waiting.pop(0) if waiting else admit()
+                    if item is None:
+                        break
+                    obj, suffix = item
+                    tokens = self.llm.tokenize(suffix.encode('utf-8'), add_bos=False)
+                    reserved = len(tokens) + self.max_tokens
+                    if n_prefix + reserved > n_ctx:
+                        rejected.append(obj)
+                        continue
+                    if cells + reserved > n_ctx:
+                        # Ждем освобождения KV-кэша другими последовательностями
+                        waiting.insert(0, item)
+                        break
+                    
+                    seq_id = free.pop()
+                    cells += reserved
+                    slots[seq_id] = {'item': obj, 'pos': n_prefix + len(tokens), 'reserved': reserved,
+                                     'text': '', 'pending': b'', 'generated': 0, 'next': None,
+                                     'sampler': self.sampler(grammar)}
+                    on_start(obj)
+                    self.seq_cp(0, seq_id, 0, n_prefix)
+                    if accept(seq_id, feed(tokens, n_prefix, seq_id)):
+                        finish(seq_id)
+                
+                if not slots:
+                    if waiting and not should_stop():
+                        continue
+                    break
+                self.peak = max(self.peak, len(slots))
+                if should_stop():
+                    for seq_id in list(slots):
+                        finish(seq_id)
+                    break
+                
+                # Один шаг декодирования для всех активных последовательностей
+                order = list(slots)
+                decode([(slots[seq_id]['next'], slots[seq_id]['pos'], seq_id, True) for seq_id in order])
+                for index, seq_id in enumerate(order):
+                    slots[seq_id]['pos'] += 1
+                    if accept(seq_id, index):
+                        finish(seq_id)
+        finally:
+            for seq_id, slot in list(slots.items()):
+                api.llama_sampler_free(slot['sampler'])
+                self.seq_rm(seq_id)
+            api.llama_batch_free(batch)
+        return rejected + [obj for obj, _ in waiting]
+
+
+class PlanExecutor:
+    """Выполнение плана по графу зависимостей между действиями (run_graph).
+
+    Ресурсы зарегистрированных команд выводятся по их источнику:
+    sources() возвращает {событие: источник} текущего реестра.
+    """
+
+    def __init__(self, run_action, max_workers=4, sources=None):
+        # run_action(index, action, total) -> {'success': bool, ...}
+        self.run_action = run_action
+        self.max_workers = max_workers
+        self.sources = sources
+
+    def execute(self, plan, should_stop=None):
+        """Выполнение плана; результаты (с таймингами) в порядке плана"""
+        return run_graph(
+            plan, lambda index: self._run(index, plan[index], len(plan)),
+            max_workers=self.max_workers,
+            sources=self.sources() if self.sources else None,
+            should_stop=should_stop
+        )
+
+    def _run(self, index, action, total):
+        started = time.perf_counter()
+        try:
+            result = dict(self.run_action(index, action, total) or {'success': True})
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        result.update(index=index + 1, event=action.get('event'), duration=time.perf_counter() - started)
+        return result
+
+
 class TaskPlannerPlugin(PluginBase):
+    PLAN_STOP = ["USER REQUEST:", "\n\n\n"]  # стоп-строки генерации плана
+
     def init(self, core):
         self.core = core
         self.llm = None
-        self.available_commands = {}
+        self.llm_lock = threading.RLock()  # модель может быть общей с другими клиентами
+        self.shared_model = None
+        self.command_registry = CommandRegistry()
+        self.available_commands = self.command_registry.commands
+        self.grammar_cache = (None, None, None)  # (версия реестра, грамматика, текст GBNF)
+        self.prompt_cache = None  # {'version', 'prompt', 'hash', 'tokens'}
+        self.index_cache = (None, None)  # (версия реестра, CommandIndex)
+        self.matcher_cache = (None, None)  # (версия реестра, FastPathMatcher)
+        self.sources_cache = (None, None)  # (версия реестра, {событие: источник})
+        self.fast_path_stats = {'hits': 0, 'misses': 0, 'time': 0.0}
         self.data_dir = Path("data")
         
         # Загружаем конфигурацию модели
@@ -26,11 +958,48 @@ class TaskPlannerPlugin(PluginBase):
         self.temperature = self.model_config.get('temperature', 0.7)
         self.n_ctx = self.model_config.get('n_ctx', 2048)
         self.n_gpu_layers = self.model_config.get('n_gpu_layers', 0)  # 0 = CPU only
+        self.stream_enabled = self.model_config.get('stream', True)
+        self.grammar_enabled = self.model_config.get('grammar', True)
+        self.retrieval_top_k = self.model_config.get('retrieval_top_k', 8)  # 0 = всегда полный список
+        self.queue_size = self.model_config.get('queue_size', 4)
+        self.batch_size = self.model_config.get('batch_size', 4)  # 1 = без пакетного декодирования
+        self.batch_supported = True
+        self.batch_decoder = None
+        self.speculative = self.model_config.get('speculative', False)
+        self.draft_model_path = self.model_config.get('draft_model_path', '')
+        self.drafter = None
+        self.drafter_version = (None, None)  # (версия реестра, число сохраненных планов)
+        self.throughput_stats = {'plans': 0, 'busy': 0.0, 'batches': 0, 'batched_plans': 0, 'peak_width': 0}
+        self.plan_executor = PlanExecutor(
+            self.run_plan_action,
+            max_workers=core.config.get('system', {}).get('max_parallel_actions', 4),
+            sources=self.command_sources
+        )
+        self.progress_interval = self.model_config.get('progress_interval', 16)  # токенов
+        self.kv_cache_enabled = self.model_config.get('kv_cache', True)
+        self.fast_path_enabled = self.model_config.get('fast_path', True)
+        self.plan_cache_enabled = self.model_config.get('plan_cache', True)
+        self.plan_cache = PlanCache(
+            self.model_config.get('plan_cache_dir', 'data/plan_cache'),
+            max_entries=self.model_config.get('plan_cache_size', 128),
+            max_disk_entries=self.model_config.get('plan_cache_disk_size', 1024),
+            ttl=self.model_config.get('plan_cache_ttl', 7 * 24 * 3600)
+        )
+        self.prompt_state_cache = PromptStateCache(
+            self.model_config.get('kv_cache_dir', 'data/kv_cache'),
+            self.model_path,
+            self.n_ctx,
+            max_disk_entries=self.model_config.get('kv_cache_disk_size', 2)
+        )
         
         # Подписка на события
         core.event_bus.subscribe('task_plan_request', self.handle_plan_request)
+        core.event_bus.subscribe('task_plan_cancel', self.handle_plan_cancel)
+        core.event_bus.subscribe('task_plan_cache', self.handle_plan_cache)
+        core.event_bus.subscribe('task_planner_stats', self.handle_planner_stats)
         core.event_bus.subscribe('task_execute', self.handle_task_execute)
         core.event_bus.subscribe('plugin_commands_registered', self.register_plugin_commands)
+        core.event_bus.subscribe('plugin_commands_unregistered', self.unregister_plugin_commands)
         core.event_bus.subscribe('system_shutdown', self.on_shutdown)
         
         # Инициализация LLM
@@ -43,6 +1012,21 @@ class TaskPlannerPlugin(PluginBase):
         # Запрос команд от других плагинов
         core.event_bus.publish('request_plugin_commands', {})
         
+        # Префилл системного промпта (или загрузка снимка с диска)
+        if self.llm:
+            with self.llm_lock:
+                self.warm_prompt_state()
+        
+        # Фоновый поток планирования с очередью запросов
+        self.plan_queue = queue.Queue(maxsize=self.queue_size)
+        self.deferred_requests = deque()  # вынуты из очереди, но не подошли к текущему пакету
+        self.deferred_lock = threading.Lock()  # deferred_requests меняют поток планирования и отмена
+        self.cancel_event = threading.Event()
+        self.current_request = None
+        self.plan_worker = threading.Thread(target=self.plan_worker_loop, name="plugin:TaskPlannerPlugin")
+        self.plan_worker.daemon = True
+        self.plan_worker.start()
+        
         self.core.event_bus.publish('output', "🧠 TaskPlannerPlugin initialized")
 
     def initialize_llm(self):
@@ -55,13 +1039,33 @@ class TaskPlannerPlugin(PluginBase):
                 )
                 return
             
+            load_params = {'n_ctx': self.n_ctx, 'n_gpu_layers': self.n_gpu_layers}
+            
+            # Общая модель из ModelServerPlugin вместо собственной копии в памяти
+            model_server = self.core.plugins.get('ModelServerPlugin')
+            if self.model_config.get('use_model_server', True) and model_server is not None:
+                # Черновик не передается общей модели: он включает logits_all
+                # и навязывался бы всем клиентам сервера
+                if self.speculative:
+                    self.core.event_bus.publish('output', 
+                        "⚠ Speculative decoding is disabled for the shared model (set use_model_server to false)")
+                self.shared_model = model_server.host.acquire(self.model_path, **load_params)
+                self.llm = self.shared_model.llm
+                self.llm_lock = self.shared_model.lock
+                self.core.event_bus.publish('output', "✓ Using shared LLM model from ModelServerPlugin")
+                return
+            
+            if self.speculative:
+                self.drafter = self.create_drafter()
+                if self.drafter is not None:
+                    load_params['draft_model'] = self.drafter
+            
             self.core.event_bus.publish('output', f"Loading LLM model from {self.model_path}...")
             
             self.llm = Llama(
                 model_path=self.model_path,
-                n_ctx=self.n_ctx,
-                n_gpu_layers=self.n_gpu_layers,
-                verbose=False
+                verbose=False,
+                **load_params
             )
             
             self.core.event_bus.publish('output', "✓ LLM model loaded successfully")
@@ -70,6 +1074,44 @@ class TaskPlannerPlugin(PluginBase):
             self.core.event_bus.publish('output', f"❌ Failed to load LLM: {e}")
             self.llm = None
 
+    def create_drafter(self):
+        """Черновик для спекулятивного декодирования: n-граммы и малая модель"""
+        if not SPECULATIVE_AVAILABLE:
+            self.core.event_bus.publish('output', 
+                "⚠ Speculative decoding requires llama-cpp-python with llama_speculative")
+            return None
+        
+        draft_llm = None
+        if self.draft_model_path:
+            if os.path.exists(self.draft_model_path):
+                # Малая модель должна иметь тот же словарь, что и основная
+                draft_llm = Llama(model_path=self.draft_model_path, n_ctx=self.n_ctx,
+                                  n_gpu_layers=self.n_gpu_layers, verbose=False)
+                self.core.event_bus.publish('output', f"✓ Draft model loaded: {self.draft_model_path}")
+            else:
+                self.core.event_bus.publish('output', f"⚠ Draft model not found: {self.draft_model_path}")
+        return PlanDraftModel(
+            num_pred_tokens=self.model_config.get('draft_tokens', 8),
+            draft_llm=draft_llm
+        )
+
+    def update_draft_corpus(self):
+        """Корпус черновика: полный промпт (каталог, пример) и закэшированные планы"""
+        if self.drafter is None:
+            return
+        self.drafter.reset()
+        registry_version, stores = self.drafter_version
+        # Промпт и планы токенизируются заново, только когда изменились сами
+        if registry_version != self.command_registry.version:
+            prompt = self.generate_system_prompt()
+            self.drafter.set_corpus(prompt_tokens=self.llm.tokenize(prompt.encode('utf-8'), add_bos=False))
+        if stores != self.plan_cache.stats['stores']:
+            plans = '\n'.join(json.dumps(entry['plan'], ensure_ascii=False)
+                              for entry in list(self.plan_cache.memory.values()))
+            self.drafter.set_corpus(plan_tokens=self.llm.tokenize(plans.encode('utf-8'), add_bos=False)
+                                    if plans else [])
+        self.drafter_version = (self.command_registry.version, self.plan_cache.stats['stores'])
+
     def load_available_commands(self):
         """Загрузка описаний команд из data/commands/"""
         commands_dir = self.data_dir / "commands"
@@ -85,7 +1127,10 @@ class TaskPlannerPlugin(PluginBase):
                 with open(command_file, 'r', encoding='utf-8') as f:
                     commands = json.load(f)
                     plugin_name = command_file.stem
-                    self.available_commands[plugin_name] = commands
+                    # Файлы, не являющиеся списком команд (например, конфиги), пропускаем
+                    if not CommandRegistry.is_command_list(commands):
+                        continue
+                    self.command_registry.register(plugin_name, commands)
                     self.core.event_bus.publish('output', 
                         f"Loaded {len(commands)} commands from {plugin_name}")
             except Exception as e:
@@ -97,31 +1142,44 @@ class TaskPlannerPlugin(PluginBase):
         plugin_name = data.get('plugin_name')
         commands = data.get('commands', [])
         
-        if plugin_name and commands:
-            self.available_commands[plugin_name] = commands
+        # Повторная регистрация тех же команд не меняет версию реестра
+        if plugin_name and commands and self.command_registry.register(plugin_name, commands):
             self.core.event_bus.publish('output', 
                 f"Registered {len(commands)} commands from {plugin_name}")
 
+    def unregister_plugin_commands(self, data):
+        """Удаление команд плагина из реестра"""
+        plugin_name = data.get('plugin_name')
+        if plugin_name and self.command_registry.unregister(plugin_name):
+            self.core.event_bus.publish('output', f"Unregistered commands from {plugin_name}")
+
+    def get_system_prompt_info(self):
+        """Системный промпт, его хэш и длина в токенах (кэш на версию реестра)"""
+        version = self.command_registry.version
+        if self.prompt_cache is None or self.prompt_cache['version'] != version:
+            prompt = self.render_system_prompt(self.command_registry.catalogue())
+            self.prompt_cache = {
+                'version': version,
+                'prompt': prompt,
+                'hash': hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+                'tokens': None
+            }
+        
+        # Длина в токенах считается лениво, только при наличии модели
+        if self.prompt_cache['tokens'] is None and self.llm:
+            self.prompt_cache['tokens'] = len(self.llm.tokenize(self.prompt_cache['prompt'].encode('utf-8')))
+        return self.prompt_cache
+
     def generate_system_prompt(self):
         """Генерация системного промпта с доступными командами"""
-        commands_desc = []
-        
-        for plugin_name, commands in self.available_commands.items():
-            commands_desc.append(f"\n{plugin_name.upper()} COMMANDS:")
-            for cmd in commands:
-                event = cmd.get('event', '')
-                desc = cmd.get('description', '')
-                params = cmd.get('parameters', {})
-                
-                params_str = ', '.join([f"{k}: {v}" for k, v in params.items()])
-                commands_desc.append(f"  - {event}: {desc}")
-                if params_str:
-                    commands_desc.append(f"    Parameters: {params_str}")
-        
+        return self.get_system_prompt_info()['prompt']
+
+    def render_system_prompt(self, commands_catalogue):
+        """Отрисовка системного промпта по каталогу команд"""
         system_prompt = f"""You are a task planning assistant. Your job is to break down user requests into a sequence of executable actions.
 
 AVAILABLE COMMANDS:
-{''.join(commands_desc)}
+{commands_catalogue}
 
 RESPONSE FORMAT:
 You must respond with a valid JSON array of actions. Each action has:
@@ -145,58 +1203,551 @@ IMPORTANT RULES:
 
         return system_prompt
 
-    def handle_plan_request(self, data):
-        """Обработка запроса на планирование задачи"""
-        if not LLAMA_AVAILABLE or not self.llm:
+    def get_plan_grammar(self):
+        """Грамматика плана; пересобирается только при изменении реестра команд"""
+        if not self.grammar_enabled or LlamaGrammar is None:
+            return None
+        
+        version, grammar, _ = self.grammar_cache
+        if version == self.command_registry.version:
+            return grammar
+        
+        grammar = gbnf = None
+        try:
+            gbnf = PlanGrammarBuilder.build(self.available_commands)
+            if gbnf:
+                grammar = LlamaGrammar.from_string(gbnf, verbose=False)
+        except Exception as e:
+            self.core.event_bus.publish('output', f"⚠ Plan grammar build failed: {e}")
+        
+        self.grammar_cache = (self.command_registry.version, grammar, gbnf if grammar else None)
+        return grammar
+
+    def get_plan_gbnf(self):
+        """Текст грамматики плана для низкоуровневых сэмплеров"""
+        if self.get_plan_grammar() is None:
+            return None
+        return self.grammar_cache[2]
+
+    def generation_kwargs(self, user_request=None):
+        """Параметры генерации плана"""
+        kwargs = {
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'stop': list(self.PLAN_STOP),
+            'echo': False
+        }
+        self.update_draft_corpus()
+        grammar = self.get_plan_grammar()
+        if grammar is not None:
+            kwargs['grammar'] = grammar
+        if StoppingCriteriaList is not None:
+            kwargs['stopping_criteria'] = StoppingCriteriaList([self.make_stop_check(user_request)])
+        return kwargs
+
+    def make_stop_check(self, user_request):
+        """Проверка отмены на каждом токене с публикацией прогресса"""
+        tokens = [0]
+        
+        def stop_check(input_ids, logits):
+            tokens[0] += 1
+            if self.progress_interval and tokens[0] % self.progress_interval == 0:
+                self.report_progress(user_request, 'generating', tokens=tokens[0])
+            return self.cancel_event.is_set()
+        
+        return stop_check
+
+    def report_progress(self, user_request, stage, **extra):
+        """Публикация события прогресса планирования"""
+        self.core.event_bus.publish('task_plan_progress', dict(extra, request=user_request, stage=stage))
+
+    def select_commands(self, user_request):
+        """Релевантные запросу команды или None, если нужен полный список"""
+        if not self.retrieval_top_k:
+            return None
+        
+        version, index = self.index_cache
+        if version != self.command_registry.version:
+            index = CommandIndex(self.command_registry.commands)
+            self.index_cache = (self.command_registry.version, index)
+        
+        # Небольшой каталог выгоднее отдавать целиком (работает кэш KV-состояния)
+        if len(index.docs) <= self.retrieval_top_k:
+            return None
+        
+        hits = index.search(user_request, self.retrieval_top_k)
+        if not hits:
+            return None
+        
+        selected = {}
+        for source, cmd in hits:
+            selected.setdefault(source, []).append(cmd)
+        return selected
+
+    def build_request_prefix(self, user_request):
+        """Префикс промпта для запроса: полный каталог или отобранные команды"""
+        selected = self.select_commands(user_request)
+        if selected is None:
+            prefix = self.build_prompt_prefix()
+            # Модель продолжит с сохраненного префикса, вычисляя только запрос
+            self.warm_prompt_state(prefix)
+            return prefix, self.command_registry.count()
+        
+        catalogue = ''.join(
+            CommandRegistry.render_section(source, commands) for source, commands in selected.items())
+        prefix = f"{self.render_system_prompt(catalogue)}\n\nUSER REQUEST:"
+        return prefix, sum(len(commands) for commands in selected.values())
+
+    def build_prompt_prefix(self):
+        """Статическая часть промпта, общая для всех запросов"""
+        return f"{self.generate_system_prompt()}\n\nUSER REQUEST:"
+
+    def warm_prompt_state(self, prefix=None):
+        """Восстановление KV-кэша модели для префикса промпта"""
+        if not self.kv_cache_enabled or not self.llm:
+            return None
+        
+        try:
+            # Хэш промпта текущей версии реестра идентифицирует префикс
+            prompt_hash = self.get_system_prompt_info()['hash']
+            source = self.prompt_state_cache.restore(
+                self.llm, prefix or self.build_prompt_prefix(), prompt_hash)
+            if source != 'memory':
+                self.core.event_bus.publish('output', f"🧠 Planner prompt state ready ({source})")
+            return source
+        except Exception as e:
+            self.core.event_bus.publish('output', f"⚠ Prompt state cache error: {e}")
+            return None
+
+    def plan_cache_key(self, user_request):
+        """Ключ кэша: нормализованный запрос, версия реестра команд, модель"""
+        parts = [
+            PlanCache.normalize(user_request),
+            self.get_system_prompt_info()['hash'],
+            self.prompt_state_cache.get_identity()
+        ]
+        return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+    def match_fast_path(self, user_request):
+        """Попытка построить план без LLM; учитывает долю попаданий и время"""
+        version, matcher = self.matcher_cache
+        if version != self.command_registry.version:
+            matcher = FastPathMatcher(self.command_registry.commands)
+            self.matcher_cache = (self.command_registry.version, matcher)
+        
+        started = time.perf_counter()
+        plan = matcher.match(user_request)
+        self.fast_path_stats['time'] += time.perf_counter() - started
+        self.fast_path_stats['hits' if plan else 'misses'] += 1
+        return plan
+
+    def handle_planner_stats(self, data):
+        """Статистика быстрого пути и кэша планов"""
+        stats = self.fast_path_stats
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups if lookups else 0.0
+        avg_us = stats['time'] / lookups * 1e6 if lookups else 0.0
+        self.core.event_bus.publish('output', 
+            f"Fast path: hit rate {hit_rate:.0%} ({stats['hits']}/{lookups}), avg match {avg_us:.1f} µs")
+        throughput = self.throughput_stats
+        plans_per_minute = throughput['plans'] / throughput['busy'] * 60 if throughput['busy'] else 0.0
+        self.core.event_bus.publish('output', 
+            f"LLM throughput: {plans_per_minute:.1f} plans/min ({throughput['plans']} plans in "
+            f"{throughput['busy']:.1f}s busy; {throughput['batched_plans']} batched in "
+            f"{throughput['batches']} batches, peak width {throughput['peak_width']})")
+        if self.drafter is not None:
+            draft = self.drafter.stats
             self.core.event_bus.publish('output', 
-                "❌ LLM not available. Cannot plan tasks.")
+                f"Speculative decoding: acceptance {self.drafter.acceptance_rate():.0%} "
+                f"({draft['accepted']}/{draft['drafted']} tokens in {draft['drafts']} drafts; "
+                f"n-gram {draft['ngram']}, draft model {draft['model']})")
+        self.handle_plan_cache({'action': 'stats'})
+
+    def handle_plan_cache(self, data):
+        """Статистика и очистка кэша планов"""
+        action = (data or {}).get('action', 'stats')
+        if action == 'clear':
+            self.plan_cache.clear()
+            self.core.event_bus.publish('output', "🗑 Plan cache cleared")
             return
         
+        stats = self.plan_cache.stats
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        hit_rate = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        self.core.event_bus.publish('output', 
+            f"Plan cache: {len(self.plan_cache.memory)} in memory, hit rate {hit_rate:.0%} "
+            f"(memory {stats['memory_hits']}, disk {stats['disk_hits']}, misses {stats['misses']}, "
+            f"stores {stats['stores']}, evictions {stats['evictions']})")
+
+    def handle_plan_request(self, data):
+        """Постановка запроса на планирование в очередь"""
         user_request = data.get('request', '')
         
         if not user_request:
             self.core.event_bus.publish('output', "No request provided for planning")
             return
         
-        self.core.event_bus.publish('output', f"🤔 Planning task: {user_request}")
+        # Простые команды разбираются по шаблонам без LLM
+        if self.fast_path_enabled:
+            plan = self.match_fast_path(user_request)
+            if plan:
+                self.core.event_bus.publish('task_plan_generated', {
+                    'request': user_request,
+                    'plan': plan,
+                    'raw_response': None,
+                    'fast_path': True
+                })
+                self.core.event_bus.publish('output', f"⚡ Plan built by fast path ({len(plan)} actions)")
+                if data.get('auto_execute', False):
+                    self.enqueue_plan_request(dict(data, plan=plan))
+                return
+        
+        # Повторный запрос обслуживается из кэша без генерации
+        if self.plan_cache_enabled:
+            plan = self.plan_cache.get(self.plan_cache_key(user_request))
+            if plan:
+                self.core.event_bus.publish('task_plan_generated', {
+                    'request': user_request,
+                    'plan': plan,
+                    'raw_response': None,
+                    'cached': True
+                })
+                self.core.event_bus.publish('output', f"⚡ Plan served from cache ({len(plan)} actions)")
+                if data.get('auto_execute', False):
+                    self.enqueue_plan_request(dict(data, plan=plan))
+                return
         
+        if not LLAMA_AVAILABLE or not self.llm:
+            self.core.event_bus.publish('output', 
+                "❌ LLM not available. Cannot plan tasks.")
+            return
+        
+        self.enqueue_plan_request(data)
+
+    def enqueue_plan_request(self, data):
+        """Постановка в очередь потока планирования; data['plan'] - готовый план к выполнению"""
+        user_request = data.get('request', '')
         try:
-            # Генерация плана
-            system_prompt = self.generate_system_prompt()
-            full_prompt = f"{system_prompt}\n\nUSER REQUEST: {user_request}\n\nRESPONSE:"
-            
-            response = self.llm(
-                full_prompt,
+            self.plan_queue.put_nowait(data)
+        except queue.Full:
+            self.core.event_bus.publish('output', 
+                f"❌ Planner queue is full ({self.queue_size} requests). Try again later or /cancel")
+            return
+        
+        position = self.plan_queue.qsize() + len(self.deferred_requests) + (1 if self.current_request else 0)
+        self.report_progress(user_request, 'queued', position=position)
+        if position > 1:
+            self.core.event_bus.publish('output', f"⏳ Queued plan request (position {position}): {user_request}")
+
+    def handle_plan_cancel(self, data):
+        """Отмена текущей генерации и очищение очереди"""
+        with self.deferred_lock:
+            cancelled = [pending for pending in self.deferred_requests if pending is not None]
+            # Сигнал остановки (None) остается в очереди
+            remaining = [pending for pending in self.deferred_requests if pending is None]
+            self.deferred_requests.clear()
+            self.deferred_requests.extend(remaining)
+        dropped = len(cancelled)
+        for pending in cancelled:
+            self.report_progress(pending.get('request', ''), 'cancelled')
+        while True:
+            try:
+                pending = self.plan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending is not None:
+                dropped += 1
+                self.report_progress(pending.get('request', ''), 'cancelled')
+        
+        if self.current_request:
+            self.cancel_event.set()
+            self.core.event_bus.publish('output', f"⏹ Cancelling plan: {self.current_request}")
+        elif not dropped:
+            self.core.event_bus.publish('output', "No plan is being generated")
+        if dropped:
+            self.core.event_bus.publish('output', f"⏹ Dropped {dropped} queued plan request(s)")
+
+    def plan_worker_loop(self):
+        """Фоновая обработка очереди запросов на планирование"""
+        while True:
+            data = self.next_request()
+            if data is None:
+                break
+            self.cancel_event.clear()
+            if data.get('plan'):
+                # Готовый план (быстрый путь, кэш): только выполнение, модель не нужна
+                self.current_request = data.get('request', '')
+                try:
+                    self.execute_plan(data['plan'], should_stop=self.cancel_event.is_set)
+                finally:
+                    self.current_request = None
+                continue
+            batch = self.collect_batch(data)
+            if len(batch) > 1:
+                self.current_request = f"{data.get('request', '')} (+{len(batch) - 1} batched)"
+            else:
+                self.current_request = data.get('request', '')
+            started = time.perf_counter()
+            try:
+                with self.llm_lock:
+                    if len(batch) > 1:
+                        ready = self.process_plan_batch(batch)
+                    else:
+                        plan = self.process_plan_request(data)
+                        ready = [plan] if plan else []
+                self.throughput_stats['busy'] += time.perf_counter() - started
+                # Выполнение - после освобождения модели: команды и удержание
+                # клавиш не задерживают следующую генерацию и клиентов сервера моделей
+                for plan in ready:
+                    if self.cancel_event.is_set():
+                        break
+                    self.execute_plan(plan, should_stop=self.cancel_event.is_set)
+            finally:
+                self.current_request = None
+
+    def next_request(self):
+        """Следующий запрос: сначала отложенные, затем очередь (с ожиданием)"""
+        with self.deferred_lock:
+            if self.deferred_requests:
+                return self.deferred_requests.popleft()
+        return self.plan_queue.get()
+
+    def can_batch(self, data):
+        """Запрос использует общий префикс (полный каталог) и может идти в пакет"""
+        return (data is not None and not data.get('plan')
+                and self.select_commands(data.get('request', '')) is None)
+
+    def next_batch_request(self):
+        """Следующий запрос из очереди для пакета или None"""
+        with self.deferred_lock:
+            if self.deferred_requests:
+                return None
+            try:
+                data = self.plan_queue.get_nowait()
+            except queue.Empty:
+                return None
+            if not self.can_batch(data):
+                # Не подходит к пакету: обрабатывается следующим, порядок сохраняется
+                self.deferred_requests.append(data)
+                return None
+        return data
+
+    def collect_batch(self, data):
+        """Запросы из очереди, которые можно декодировать вместе с data"""
+        if (self.batch_size < 2 or not self.batch_supported
+                or not BatchPlanDecoder.supported(self.llm) or not self.can_batch(data)):
+            return [data]
+        
+        batch = [data]
+        while len(batch) < self.batch_size:
+            other = self.next_batch_request()
+            if other is None:
+                break
+            batch.append(other)
+        return batch
+
+    def process_plan_batch(self, batch):
+        """Совместная генерация планов для запросов с общим префиксом.
+
+        Возвращает планы запросов с auto_execute для выполнения вне блокировки модели.
+        """
+        prefix = self.build_prompt_prefix()
+        if self.batch_decoder is None:
+            # Собственный контекст декодера переживает пакеты вместе с префиксом
+            self.batch_decoder = BatchPlanDecoder(
+                self.llm,
+                max_sequences=self.batch_size,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
-                stop=["USER REQUEST:", "\n\n\n"],
-                echo=False
+                stop=self.PLAN_STOP
             )
+        decoder = self.batch_decoder
+        taken = list(batch)
+        states = {}  # {id(data): [парсер, время старта, получен ли первый токен]}
+        finished = []
+        fallback = []
+        ready = []
+        
+        def item(data):
+            return data, f" {data.get('request', '')}\n\nRESPONSE:"
+        
+        def admit():
+            data = self.next_batch_request()
+            if data is None:
+                return None
+            taken.append(data)
+            return item(data)
+        
+        def on_start(data):
+            user_request = data.get('request', '')
+            states[id(data)] = [IncrementalPlanParser(), time.perf_counter(), False]
+            self.core.event_bus.publish('output', f"🤔 Planning task (batched): {user_request}")
+            self.report_progress(user_request, 'started', commands=self.command_registry.count(), batched=True)
+        
+        def on_text(data, text):
+            state = states[id(data)]
+            parser = state[0]
+            if not state[2]:
+                state[2] = True
+                self.report_progress(data.get('request', ''), 'first_token', ttft=time.perf_counter() - state[1])
+            parser.feed(text)
+            return parser.closed
+        
+        def on_finish(data, text, tokens):
+            parser = states.pop(id(data))[0]
+            finished.append(id(data))
+            if self.cancel_event.is_set():
+                self.report_progress(data.get('request', ''), 'cancelled')
+                return
+            response_text = text.strip()
+            plan = self.parse_plan(response_text) if parser.closed else None
+            if plan:
+                self.complete_plan_request(data, plan, response_text)
+                if data.get('auto_execute', False):
+                    ready.append(plan)
+            else:
+                # Без грамматики ответ может оказаться невалидным - повтор обычным путем
+                fallback.append(data)
+        
+        started = time.perf_counter()
+        try:
+            leftover = decoder.run(
+                prefix, [item(data) for data in batch], admit,
+                on_start, on_text, on_finish, self.cancel_event.is_set, grammar=self.get_plan_gbnf())
+        except Exception as e:
+            self.batch_supported = False
+            decoder.close()
+            self.core.event_bus.publish('output', f"⚠ Batched decoding disabled: {e}")
+            leftover = [data for data in taken if id(data) not in finished]
+        elapsed = time.perf_counter() - started
+        
+        stats = self.throughput_stats
+        stats['batches'] += 1
+        stats['batched_plans'] += len(finished)
+        stats['peak_width'] = max(stats['peak_width'], decoder.peak)
+        if finished:
+            self.core.event_bus.publish('output', 
+                f"✓ Batch of {len(finished)} plans in {elapsed:.2f}s "
+                f"({len(finished) / elapsed * 60:.1f} plans/min, peak width {decoder.peak}, {decoder.tokens} tokens)")
+        
+        for data in fallback + leftover:
+            if self.cancel_event.is_set():
+                self.report_progress(data.get('request', ''), 'cancelled')
+                continue
+            plan = self.process_plan_request(data)
+            if plan:
+                ready.append(plan)
+        return ready
+
+    def process_plan_request(self, data):
+        """Генерация плана для одного запроса; план возвращается, если его нужно выполнить"""
+        user_request = data.get('request', '')
+        
+        self.core.event_bus.publish('output', f"🤔 Planning task: {user_request}")
+        
+        try:
+            # Генерация плана
+            prefix, commands_count = self.build_request_prefix(user_request)
+            full_prompt = f"{prefix} {user_request}\n\nRESPONSE:"
+            self.report_progress(user_request, 'started',
+                                 prompt_chars=len(full_prompt), commands=commands_count)
             
-            response_text = response['choices'][0]['text'].strip()
-            
-            # Парсинг JSON ответа
-            plan = self.parse_plan(response_text)
+            auto_execute = data.get('auto_execute', False)
             
-            if plan:
-                self.core.event_bus.publish('task_plan_generated', {
-                    'request': user_request,
-                    'plan': plan,
-                    'raw_response': response_text
-                })
+            if self.stream_enabled:
+                # Действия публикуются по мере генерации, выполняется только проверенный план
+                plan, response_text = self.generate_plan_streaming(full_prompt, user_request)
+            else:
+                response = self.llm(full_prompt, **self.generation_kwargs(user_request))
                 
-                self.core.event_bus.publish('output', 
-                    f"✓ Generated plan with {len(plan)} actions")
+                response_text = response['choices'][0]['text'].strip()
                 
-                # Опционально: сразу выполнить план
-                if data.get('auto_execute', False):
-                    self.execute_plan(plan)
+                # Парсинг JSON ответа
+                plan = None if self.cancel_event.is_set() else self.parse_plan(response_text)
+            
+            if self.cancel_event.is_set():
+                self.report_progress(user_request, 'cancelled')
+                self.core.event_bus.publish('output', f"⏹ Plan cancelled: {user_request}")
+                return None
+            
+            if plan:
+                self.complete_plan_request(data, plan, response_text)
+                # Выполняет вызывающий, уже без блокировки модели
+                return plan if auto_execute else None
             else:
+                self.report_progress(user_request, 'failed')
                 self.core.event_bus.publish('output', 
                     f"❌ Failed to parse plan. Raw response:\n{response_text}")
                 
         except Exception as e:
+            self.report_progress(user_request, 'failed', error=str(e))
             self.core.event_bus.publish('output', f"❌ Planning error: {e}")
+        return None
+
+    def complete_plan_request(self, data, plan, response_text):
+        """Публикация сгенерированного плана"""
+        user_request = data.get('request', '')
+        self.throughput_stats['plans'] += 1
+        self.report_progress(user_request, 'completed', actions=len(plan))
+        if self.plan_cache_enabled:
+            self.plan_cache.put(self.plan_cache_key(user_request), user_request, plan)
+        self.core.event_bus.publish('task_plan_generated', {
+            'request': user_request,
+            'plan': plan,
+            'raw_response': response_text
+        })
+        
+        self.core.event_bus.publish('output', 
+            f"✓ Generated plan with {len(plan)} actions")
+
+    def generate_plan_streaming(self, full_prompt, user_request):
+        """Потоковая генерация плана с публикацией действий по мере закрытия.
+
+        Действия только объявляются событием task_plan_action; выполнять их
+        можно после того, как весь план закрыт и проверен.
+        """
+        parser = IncrementalPlanParser()
+        plan = []
+        chunks = []
+        valid = True
+        
+        started = time.perf_counter()
+        stream = self.llm(full_prompt, stream=True, **self.generation_kwargs(user_request))
+        
+        try:
+            for chunk in stream:
+                text = chunk['choices'][0]['text']
+                if not chunks:
+                    self.report_progress(user_request, 'first_token',
+                                         ttft=time.perf_counter() - started)
+                chunks.append(text)
+                
+                for action in parser.feed(text):
+                    if not self.validate_action(action):
+                        valid = False
+                        break
+                    plan.append(action)
+                    self.core.event_bus.publish('task_plan_action', {
+                        'request': user_request,
+                        'index': len(plan),
+                        'action': action
+                    })
+                
+                # Массив закрыт - дальнейшая генерация не нужна
+                if not valid or parser.closed or self.cancel_event.is_set():
+                    break
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+        
+        response_text = ''.join(chunks).strip()
+        if not valid or not parser.closed:
+            return None, response_text
+        return plan, response_text
+
+    def validate_action(self, action):
+        """Проверка структуры одного действия"""
+        return isinstance(action, dict) and all(k in action for k in ['event', 'data'])
 
     def parse_plan(self, response_text):
         """Парсинг JSON плана из ответа LLM"""
@@ -212,7 +1763,7 @@ IMPORTANT RULES:
                 # Валидация структуры
                 if isinstance(plan, list):
                     for action in plan:
-                        if not all(k in action for k in ['event', 'data']):
+                        if not self.validate_action(action):
                             return None
                     return plan
             
@@ -232,36 +1783,93 @@ IMPORTANT RULES:
         
         self.execute_plan(plan)
 
-    def execute_plan(self, plan):
-        """Последовательное выполнение плана"""
+    def execute_plan(self, plan, should_stop=None):
+        """Выполнение плана: независимые действия идут параллельно;
+        после should_stop() новые действия не запускаются"""
         self.core.event_bus.publish('output', f"▶ Executing plan with {len(plan)} actions...")
         
-        for i, action in enumerate(plan, 1):
-            event = action.get('event')
-            event_data = action.get('data', {})
-            description = action.get('description', 'No description')
-            
-            self.core.event_bus.publish('output', 
-                f"  [{i}/{len(plan)}] {description}")
-            
-            # Публикуем событие для выполнения
-            self.core.event_bus.publish(event, event_data)
-            
-            # Небольшая задержка между действиями
-            import time
-            time.sleep(0.1)
+        started = time.perf_counter()
+        results = self.plan_executor.execute(plan, should_stop=should_stop)
+        elapsed = time.perf_counter() - started
         
-        self.core.event_bus.publish('task_plan_completed', {'actions_count': len(plan)})
-        self.core.event_bus.publish('output', "✓ Plan execution completed")
+        succeeded = sum(1 for r in results if r.get('success', False))
+        self.core.event_bus.publish('task_plan_completed', {
+            'actions_count': len(plan),
+            'succeeded': succeeded,
+            'duration': elapsed,
+            'actions': results
+        })
+        self.core.event_bus.publish('output', 
+            f"✓ Plan execution completed: {succeeded}/{len(plan)} actions in {elapsed:.2f}s "
+            f"(sum of actions {sum(r['duration'] for r in results):.2f}s)")
+
+    def command_sources(self):
+        """Источник каждого зарегистрированного события - ресурс для графа плана"""
+        version, sources = self.sources_cache
+        if version != self.command_registry.version:
+            sources = {}
+            for source, commands in self.command_registry.commands.items():
+                for cmd in commands:
+                    sources.setdefault(cmd.get('event', ''), source)
+            self.sources_cache = (self.command_registry.version, sources)
+        return sources
+
+    def run_plan_action(self, index, action, total):
+        """Выполнение действия из PlanExecutor с публикацией его тайминга"""
+        started = time.perf_counter()
+        self.execute_action(action, f"{index + 1}/{total}")
+        self.core.event_bus.publish('task_plan_action_completed', {
+            'index': index + 1,
+            'event': action.get('event'),
+            'duration': time.perf_counter() - started
+        })
+        return {'success': True}
+
+    def execute_action(self, action, position):
+        """Выполнение одного действия плана"""
+        event = action.get('event')
+        event_data = action.get('data', {})
+        description = action.get('description', 'No description')
+        
+        self.core.event_bus.publish('output', f"  [{position}] {description}")
+        
+        # Публикуем событие для выполнения
+        self.core.event_bus.publish(event, event_data)
 
     def on_shutdown(self, event_data):
         self.shutdown()
 
     def shutdown(self):
         """Очистка ресурсов"""
-        if self.llm:
-            del self.llm
-            self.llm = None
+        # Остановка фонового планирования: отмена, очистка очереди, выход потока
+        self.cancel_event.set()
+        with self.deferred_lock:
+            self.deferred_requests.clear()
+        try:
+            while True:
+                self.plan_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.plan_queue.put_nowait(None)
+        if self.plan_worker.is_alive() and self.plan_worker is not threading.current_thread():
+            self.plan_worker.join(timeout=5.0)
+        
+        # Поток планирования мог не уложиться в join и еще декодировать:
+        # контекст и модель освобождаются только под блокировкой модели
+        with self.llm_lock:
+            if self.batch_decoder is not None:
+                self.batch_decoder.close()
+                self.batch_decoder = None
+            if self.shared_model is not None:
+                # Общая модель выгружается сервером, когда на нее не останется ссылок
+                model_server = self.core.plugins.get('ModelServerPlugin')
+                if model_server is not None:
+                    model_server.host.release(self.shared_model)
+                self.shared_model = None
+                self.llm = None
+            if self.llm:
+                del self.llm
+                self.llm = None
         self.core.event_bus.publish('output', "🧠 TaskPlannerPlugin shutdown")
 
 